@@ -0,0 +1,223 @@
+import os
+import time
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .vector_index import EmbeddingIndex, normalize_vector, top_k
+
+# Unit vectors have components in [-1, 1], so one fixed scale is enough to map them onto int8
+INT8_SCALE = 127.0
+
+
+def spherical_kmeans(vectors: np.ndarray, clusters: int, iterations: int = 20, seed: int = 0, batch_size: int = 8192) -> np.ndarray:
+    """Cluster unit vectors by cosine similarity and return normalized centroids"""
+    rng = np.random.default_rng(seed)
+    clusters = max(1, min(clusters, vectors.shape[0]))
+    centroids = vectors[rng.choice(vectors.shape[0], size=clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = assign_clusters(vectors, centroids, batch_size=batch_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=clusters)
+
+        # Reseed empty clusters from random points so every list stays useful
+        empty = np.flatnonzero(counts == 0)
+        if empty.size:
+            sums[empty] = vectors[rng.choice(vectors.shape[0], size=empty.size, replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        updated = (sums / norms).astype(np.float32)
+        if np.allclose(updated, centroids, atol=1e-5):
+            centroids = updated
+            break
+        centroids = updated
+    return centroids
+
+
+def assign_clusters(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 8192) -> np.ndarray:
+    """Return the index of the most similar centroid for every row, in bounded-memory batches"""
+    assignments = np.empty(vectors.shape[0], dtype=np.int32)
+    for start in range(0, vectors.shape[0], batch_size):
+        batch = vectors[start:start + batch_size]
+        assignments[start:start + batch_size] = np.argmax(batch @ centroids.T, axis=1)
+    return assignments
+
+
+class IVFIndex(EmbeddingIndex):
+    """Inverted-file approximate search on top of the exact embedding matrix.
+
+    A spherical k-means coarse quantizer splits the corpus into ``nlist``
+    inverted lists. A query only visits the ``nprobe`` lists whose centroids
+    are closest, ranks those candidates with int8 scalar-quantized vectors and
+    re-scores the best ``rerank`` of them exactly in float32. Without trained
+    centroids the index answers with the exact scan.
+    """
+
+    def __init__(self, centroids_path: Optional[str] = None, nprobe: int = 8, rerank: int = 100, **kwargs):
+        super().__init__(**kwargs)
+        self.centroids_path = str(centroids_path) if centroids_path else None
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self._centroids: Optional[np.ndarray] = None
+        self._centroids_mtime: Optional[float] = None
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._codes = np.empty((0, 0), dtype=np.int8)
+        self._lists: List[Set[int]] = []
+
+    @property
+    def trained(self) -> bool:
+        return self._centroids is not None
+
+    def _allocate(self, capacity: int, dimension: int):
+        super()._allocate(capacity, dimension)
+        assignments = np.full(capacity, -1, dtype=np.int32)
+        codes = np.empty((capacity, dimension), dtype=np.int8)
+        if self._size:
+            assignments[:self._size] = self._assignments[:self._size]
+            codes[:self._size] = self._codes[:self._size]
+        self._assignments, self._codes = assignments, codes
+
+    def _reset(self):
+        super()._reset()
+        self._assignments = np.empty(0, dtype=np.int32)
+        self._codes = np.empty((0, 0), dtype=np.int8)
+        self._lists = [set() for _ in range(0 if self._centroids is None else self._centroids.shape[0])]
+
+    def _row_written(self, position: int):
+        vector = self._matrix[position]
+        self._codes[position] = np.round(vector * INT8_SCALE).astype(np.int8)
+        if self._centroids is not None:
+            cluster = int(np.argmax(self._centroids @ vector))
+            self._assignments[position] = cluster
+            self._lists[cluster].add(position)
+
+    def _row_removed(self, position: int):
+        cluster = self._assignments[position]
+        if cluster >= 0 and self._centroids is not None:
+            self._lists[cluster].discard(position)
+        self._assignments[position] = -1
+
+    def _row_moved(self, source: int, target: int):
+        self._codes[target] = self._codes[source]
+        cluster = self._assignments[source]
+        self._assignments[target] = cluster
+        self._assignments[source] = -1
+        if cluster >= 0 and self._centroids is not None:
+            self._lists[cluster].discard(source)
+            self._lists[cluster].add(target)
+
+    def set_centroids(self, centroids: Optional[np.ndarray]):
+        """Install a coarse quantizer and re-assign every stored vector to it"""
+        with self._lock:
+            self._centroids = None if centroids is None else np.ascontiguousarray(centroids, dtype=np.float32)
+            if self._centroids is None:
+                self._lists = []
+                return
+            self._lists = [set() for _ in range(self._centroids.shape[0])]
+            if self._size:
+                assignments = assign_clusters(self._matrix[:self._size], self._centroids)
+                self._assignments[:self._size] = assignments
+                for position, cluster in enumerate(assignments.tolist()):
+                    self._lists[cluster].add(position)
+
+    def train(self, nlist: Optional[int] = None, iterations: int = 20, sample_size: int = 50000, seed: int = 0) -> np.ndarray:
+        """Fit the coarse quantizer on (a sample of) the indexed vectors"""
+        with self._lock:
+            if self._size == 0:
+                raise ValueError("Cannot train an IVF index without vectors")
+            nlist = nlist or max(1, int(np.sqrt(self._size)))
+            rng = np.random.default_rng(seed)
+            if self._size > sample_size:
+                sample = self._matrix[np.sort(rng.choice(self._size, size=sample_size, replace=False))]
+            else:
+                sample = self._matrix[:self._size].copy()
+        centroids = spherical_kmeans(sample, nlist, iterations=iterations, seed=seed)
+        self.set_centroids(centroids)
+        return centroids
+
+    def save_centroids(self, path: Optional[str] = None):
+        path = str(path or self.centroids_path)
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temporary = f"{path}.tmp.npy"
+        np.save(temporary, self._centroids)
+        os.replace(temporary, path)
+        self._centroids_mtime = os.path.getmtime(path)
+
+    def refresh(self) -> bool:
+        """Load centroids written by ``build_vector_index`` if the file changed since the last check"""
+        if not self.centroids_path or not os.path.exists(self.centroids_path):
+            return False
+        mtime = os.path.getmtime(self.centroids_path)
+        if mtime == self._centroids_mtime:
+            return False
+        self.set_centroids(np.load(self.centroids_path))
+        self._centroids_mtime = mtime
+        return True
+
+    def load(self, rows, expected: int = 0):
+        super().load(rows, expected=expected)
+        self.refresh()
+
+    def search(self, query: Sequence[float], limit: int = 10, owner_id: Optional[int] = None, nprobe: Optional[int] = None, rerank: Optional[int] = None, **options) -> List[Tuple[int, float]]:
+        """Approximate top-k: probe the closest lists, rank with int8 codes, re-rank exactly.
+
+        With ``owner_id``, falls back to the exact scan of the owner's rows when
+        the probed lists hold fewer than ``limit`` of them.
+        """
+        vector = normalize_vector(query)
+        nprobe = nprobe or self.nprobe
+        rerank = max(limit, rerank or self.rerank)
+        with self._lock:
+            if self._centroids is None:
+                return self.exact_search(query, limit=limit, owner_id=owner_id)
+            if vector is None or self._size == 0 or vector.shape[0] != self._matrix.shape[1]:
+                return []
+
+            probes = top_k(np.arange(self._centroids.shape[0]), self._centroids @ vector, nprobe)
+            candidates = np.fromiter(
+                (position for cluster, _ in probes for position in self._lists[cluster]),
+                dtype=np.int64
+            )
+            if owner_id is not None:
+                candidates = candidates[self._owners[candidates] == owner_id]
+                # The probed lists are chosen for the whole corpus and can hold few of a small
+                # owner's rows; scoring all of that owner's rows exactly is cheap in that case
+                if candidates.size < limit:
+                    return self.exact_search(query, limit=limit, owner_id=owner_id)
+            if candidates.size == 0:
+                return []
+
+            # Coarse ranking on quantized codes, then exact float32 scores for the shortlist
+            coarse = self._codes[candidates].astype(np.float32) @ vector
+            if candidates.size > rerank:
+                candidates = candidates[np.argpartition(-coarse, rerank - 1)[:rerank]]
+            scores = self._matrix[candidates] @ vector
+            ids = self._ids[candidates].copy()
+        return top_k(ids, scores, limit)
+
+
+def evaluate_recall(index: EmbeddingIndex, queries: np.ndarray, k: int = 10, **search_options) -> Dict[str, float]:
+    """Compare ``index.search`` against the exact scan and report recall@k and latency"""
+    recalls, exact_times, approximate_times = [], [], []
+    for query in queries:
+        started = time.perf_counter()
+        exact = {doc_id for doc_id, _ in index.exact_search(query, limit=k)}
+        exact_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        approximate = {doc_id for doc_id, _ in index.search(query, limit=k, **search_options)}
+        approximate_times.append(time.perf_counter() - started)
+
+        if exact:
+            recalls.append(len(exact & approximate) / len(exact))
+
+    return {
+        'queries': len(queries),
+        'k': k,
+        'recall': float(np.mean(recalls)) if recalls else 0.0,
+        'exact_ms': 1000 * float(np.mean(exact_times)) if exact_times else 0.0,
+        'approximate_ms': 1000 * float(np.mean(approximate_times)) if approximate_times else 0.0,
+    }
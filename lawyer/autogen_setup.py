@@ -1,6 +1,11 @@
 import autogen
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
 from typing import List, Dict, Any, Optional
 import os
+from autogen.function_utils import get_function_schema
 from django.contrib.auth.models import User
 from django.conf import settings
 from .utils import (
@@ -15,6 +20,11 @@ from .utils import (
     get_case_summary,
     find_similar_cases
 )
+from .hybrid_search import hybrid_search_documents
+from .speaker_selection import RuleSpeakerSelector, get_speaker_selection_options
+from .tool_execution import ToolExecutorAgent
+from .tool_memo import ToolMemo, memoized_tool, use_tool_memo
+from .tracing import current_trace
 
 def get_agent_config():
     """Get the base configuration for GPT-3.5"""
@@ -25,69 +35,139 @@ def get_agent_config():
     if not api_key:
         raise ValueError("OpenAI API key not found in Django settings")
     
+    model_config = {
+        "model": "gpt-4o",
+        "api_key": api_key
+    }
+    base_url = getattr(settings, 'OPENAI_BASE_URL', None)
+    if base_url:
+        model_config["base_url"] = base_url
+
     return {
         "temperature": 0.5,
-        "config_list": [{
-            "model": "gpt-4o",
-            "api_key": api_key
-        }],
+        "config_list": [model_config],
     }
 
-def create_agents(user: User):
-    """Create and return all necessary agents with registered tools"""
-    config = get_agent_config()
-    
-    # Create wrapper functions that don't expose User model
-    def wrapped_create_case(title: str, description: str = "") -> Dict[str, Any]:
-        case = create_case_with_title(title=title, description=description, user=user)
-        return {"id": str(case.id), "title": str(case.title), "description": str(case.description)}
-    
-    def wrapped_get_case(case_id: int) -> Optional[Dict[str, Any]]:
-        case = get_case_by_id(case_id=case_id, user=user)
-        if not case:
-            return None
-        return {"id": str(case.id), "title": str(case.title)}
-    
-    def wrapped_get_cases(status: str = None, limit: int = 10) -> List[Dict[str, Any]]:
-        cases = get_user_cases(user=user, status=status, limit=limit)
-        return [{"id": str(case.id), "title": str(case.title)} for case in cases]
-    
-    def wrapped_search_similar_cases(query: str, limit: int = 5) -> List[Dict[str, Any]]:
-        results = find_similar_cases(query=query, user=user, limit=limit)
-        return [{
-            "case": {"id": str(r["case"].id), "title": str(r["case"].title)}, 
-            "similarity": float(r["similarity"])
-        } for r in results]
-    
-    def wrapped_search_documents(query: str, limit: int = 5) -> List[Dict[str, Any]]:
-        results = search_documents_by_similarity(query=query, user=user, limit=limit)
-        return [{
-            "id": str(doc.id),
-            "filename": str(doc.filename),
-            "description": str(doc.description),
-            "similarity": float(score)
-        } for doc, score in results]
-    
-    def wrapped_get_case_documents(case_id: int) -> List[Dict[str, Any]]:
-        documents = get_case_documents(case_id=case_id, user=user)
-        return [{
-            "id": str(doc.id),
-            "filename": str(doc.filename),
-            "description": str(doc.description)
-        } for doc in documents]
-    
-    def wrapped_get_case_summary(case_id: int) -> Dict[str, Any]:
-        summary = get_case_summary(case_id=case_id, user=user)
-        return {
-            "id": str(summary["case"].id),
-            "title": str(summary["case"].title),
-            "description": str(summary["case"].description),
-            "document_count": int(summary["document_count"]),
-            "status": str(summary["status"])
-        }
+# The user whose request is being served; tools read it at call time so one set
+# of agents can be reused across users
+_current_user: ContextVar[Optional[User]] = ContextVar('agent_user', default=None)
+
+
+# Optional per-request observer told about speaker selection and every group chat
+# turn, e.g. to stream turns to the browser as they happen
+_chat_observer: ContextVar[Optional[Any]] = ContextVar('agent_chat_observer', default=None)
+
+
+# Whether the agents' completions stream token deltas through autogen's IOStream;
+# only the chat stream endpoint, which captures the IOStream, turns it on
+_stream_completions: ContextVar[bool] = ContextVar('agent_stream_completions', default=False)
+
+
+def get_current_user() -> User:
+    user = _current_user.get()
+    if user is None:
+        raise RuntimeError("Agent tools called outside of an agent pool checkout")
+    return user
+
+
+def tool_create_case(title: str, description: str = "") -> Dict[str, Any]:
+    case = create_case_with_title(title=title, description=description, user=get_current_user())
+    return {"id": str(case.id), "title": str(case.title), "description": str(case.description)}
+
+
+def tool_get_case(case_id: int) -> Optional[Dict[str, Any]]:
+    case = get_case_by_id(case_id=case_id, user=get_current_user())
+    if not case:
+        return None
+    return {"id": str(case.id), "title": str(case.title)}
+
+
+def tool_get_cases(status: str = None, limit: int = 10) -> List[Dict[str, Any]]:
+    cases = get_user_cases(user=get_current_user(), status=status, limit=limit)
+    return [{"id": str(case.id), "title": str(case.title)} for case in cases]
+
+
+def tool_search_similar_cases(query: str, limit: int = 5) -> List[Dict[str, Any]]:
+    results = find_similar_cases(query=query, user=get_current_user(), limit=limit)
+    return [{
+        "case": {"id": str(r["case"].id), "title": str(r["case"].title)},
+        "similarity": float(r["similarity"])
+    } for r in results]
+
+
+def tool_search_documents(query: str, limit: int = 5) -> List[Dict[str, Any]]:
+    """Search the user's documents by meaning and by keywords at once. Supports "quoted phrases" and prefix* terms. Returns one ranked list."""
+    results = hybrid_search_documents(query=query, user=get_current_user(), limit=limit)["results"]
+    return [{
+        "id": str(r["document"].id),
+        "filename": str(r["document"].filename),
+        "description": str(r["document"].description),
+        "score": float(r["score"]),
+        "excerpt": str(r["snippet"] or r["passage"] or "")
+    } for r in results]
+
+
+def tool_get_case_documents(case_id: int) -> List[Dict[str, Any]]:
+    documents = get_case_documents(case_id=case_id, user=get_current_user())
+    return [{
+        "id": str(doc.id),
+        "filename": str(doc.filename),
+        "description": str(doc.description)
+    } for doc in documents]
+
+
+def tool_get_case_summary(case_id: int) -> Dict[str, Any]:
+    summary = get_case_summary(case_id=case_id, user=get_current_user())
+    return {
+        "id": str(summary["case"].id),
+        "title": str(summary["case"].title),
+        "description": str(summary["case"].description),
+        "document_count": int(summary["document_count"]),
+        "status": str(summary["status"])
+    }
+
+
+FUNCTION_MAP = {
+    "create_case": tool_create_case,
+    "get_case": tool_get_case,
+    "get_cases": tool_get_cases,
+    "search_similar_cases": tool_search_similar_cases,
+    "search_documents": tool_search_documents,
+    "get_case_documents": tool_get_case_documents,
+    "get_case_summary": tool_get_case_summary,
+}
+
+# Tool schemas are derived from the signatures once, at import
+TOOL_SCHEMAS = [
+    get_function_schema(func, name=name, description=func.__doc__ or f"Execute {name}")
+    for name, func in FUNCTION_MAP.items()
+]
+
+
+def stream_when_requested(client: autogen.OpenAIWrapper):
+    """Make ``client`` stream its completions inside a checkout with ``stream=True``"""
+    create = client.create
+
+    def create_maybe_streamed(**config):
+        if _stream_completions.get():
+            config.setdefault("stream", True)
+        return create(**config)
 
-    # Create agents with the same system messages
-    user_proxy = autogen.UserProxyAgent(
+    client.create = create_maybe_streamed
+
+
+def create_agents(config: Optional[Dict[str, Any]] = None):
+    """Create the agents with the shared tools registered; they are not tied to a user"""
+    config = config or get_agent_config()
+
+    def tool_config():
+        # Each agent keeps a reference to its llm_config, so give every agent its own dict.
+        # Passing the tools up front builds one OpenAI client per agent instead of one per tool.
+        return {**config, "tools": list(TOOL_SCHEMAS)}
+
+    # Create agents with the same system messages; the user proxy executes the tools,
+    # running the independent calls of one turn concurrently
+    user_proxy = ToolExecutorAgent(
         name="Lawyer",
         system_message="""You are the primary interface for human legal professionals...""",
         code_execution_config=False,
@@ -96,43 +176,31 @@ def create_agents(user: User):
     
     planner = autogen.AssistantAgent(
         name="Planner",
-        llm_config=config,
-        system_message="""You are the Planner, the orchestrator of tasks..."""
+        llm_config=tool_config(),
+        system_message="""You are the Planner, the orchestrator of tasks...
+
+End each message with NEXT: LegalExpert or NEXT: Critic to choose who speaks next, or with TERMINATE on a line of its own once the request has been fully answered."""
     )
     
     legal_expert = autogen.AssistantAgent(
         name="LegalExpert",
-        llm_config=config,
+        llm_config=tool_config(),
         system_message="""You are the LegalExpert, specializing in legal analysis..."""
     )
     
     critic = autogen.AssistantAgent(
         name="Critic",
-        llm_config=config,
-        system_message="""You are the Critic, ensuring quality and accuracy..."""
-    )
+        llm_config=tool_config(),
+        system_message="""You are the Critic, ensuring quality and accuracy...
 
-    # Register wrapped functions for user_proxy
-    function_map = {
-        "create_case": wrapped_create_case,
-        "get_case": wrapped_get_case,
-        "get_cases": wrapped_get_cases,
-        "search_similar_cases": wrapped_search_similar_cases,
-        "search_documents": wrapped_search_documents,
-        "get_case_documents": wrapped_get_case_documents,
-        "get_case_summary": wrapped_get_case_summary,
-    }
+If the LegalExpert's answer needs no changes, reply APPROVED on a line of its own."""
+    )
 
-    for name, func in function_map.items():
-        user_proxy.register_for_execution(name)(func)
+    for name, func in FUNCTION_MAP.items():
+        user_proxy.register_for_execution(name)(memoized_tool(name, func))
 
-    # Register functions with other agents
-    for agent in [planner, legal_expert, critic]:
-        for name, func in function_map.items():
-            agent.register_for_llm(
-                name=name,
-                description=func.__doc__ or f"Execute {name}"
-            )(func)
+    for agent in (planner, legal_expert, critic):
+        stream_when_requested(agent.client)
 
     return {
         "user_proxy": user_proxy,
@@ -141,8 +209,35 @@ def create_agents(user: User):
         "critic": critic
     }
 
-def create_group_chat(agents: Dict[str, Any]):
-    """Create a group chat with the given agents"""
+class ObservableGroupChat(autogen.GroupChat):
+    """GroupChat that reports speakers and turns to the observer bound for the current request.
+
+    Each appended message also carries the LLM calls traced since the previous
+    one, which are the calls that produced it, including the speaker selection.
+    """
+
+    def select_speaker(self, last_speaker, selector):
+        speaker = super().select_speaker(last_speaker, selector)
+        observer = _chat_observer.get()
+        if observer is not None:
+            observer.speaker_selected(speaker)
+        return speaker
+
+    def append(self, message: Dict, speaker):
+        if message.get("tool_responses") and isinstance(speaker, ToolExecutorAgent):
+            # Kept on the group chat's copy only; agents receive messages without unknown keys
+            message["tool_timings"] = speaker.pop_tool_timings()
+        trace = current_trace()
+        if trace is not None:
+            message["trace"] = trace.take()
+        super().append(message, speaker)
+        observer = _chat_observer.get()
+        if observer is not None:
+            observer.turn(message, speaker)
+
+
+def create_group_chat(agents: Dict[str, Any], config: Optional[Dict[str, Any]] = None):
+    """Create a group chat with the given agents; the manager's LLM only picks speakers the rules cannot"""
     # Define allowed transitions
     allowed_transitions = {
         agents["user_proxy"]: [agents["planner"]],
@@ -151,17 +246,179 @@ def create_group_chat(agents: Dict[str, Any]):
         agents["critic"]: [agents["planner"]]
     }
 
+    options = get_speaker_selection_options()
+    speaker_selection_method = "auto"
+    if options['MODE'] == 'rules':
+        speaker_selection_method = RuleSpeakerSelector(
+            executor=agents["user_proxy"],
+            fallback=options['FALLBACK'],
+            termination_tags=options['TERMINATION_TAGS']
+        )
+
     # Create group chat with controlled flow
-    group_chat = autogen.GroupChat(
+    group_chat = ObservableGroupChat(
         agents=list(agents.values()),
         messages=[],
         max_round=20,
         allowed_or_disallowed_speaker_transitions=allowed_transitions,
         speaker_transitions_type="allowed",
+        speaker_selection_method=speaker_selection_method,
         send_introductions=True
     )
     
     return autogen.GroupChatManager(
         groupchat=group_chat,
-        llm_config=get_agent_config(),
-    )
\ No newline at end of file
+        llm_config=dict(config or get_agent_config()),
+    )
+
+
+class AgentSession:
+    """One set of agents and the group chat manager that runs them"""
+
+    def __init__(self, agents: Dict[str, Any], manager: autogen.GroupChatManager):
+        self.agents = agents
+        self.manager = manager
+
+    @property
+    def selector(self) -> Optional[RuleSpeakerSelector]:
+        method = self.manager.groupchat.speaker_selection_method
+        return method if isinstance(method, RuleSpeakerSelector) else None
+
+    def selection_stats(self) -> Optional[Dict[str, Any]]:
+        """Speaker selection counts for the chat run since the last reset, if rules are in use"""
+        return dict(self.selector.stats) if self.selector else None
+
+    def reset(self):
+        for agent in self.agents.values():
+            agent.reset()
+        self.manager.reset()
+        self.manager.groupchat.reset()
+        if self.selector:
+            self.selector.reset()
+
+
+class AgentPool:
+    """Reuses agent sessions across requests instead of rebuilding them per message.
+
+    Agents keep chat state while a conversation runs, so a session is used by
+    one request at a time: ``checkout`` hands out an idle session (building
+    one only when none is idle), binds the requesting user for the tools and
+    resets the session when it is returned. At most ``max_idle`` sessions are
+    kept between requests.
+    """
+
+    def __init__(self, max_idle: int = 4):
+        self.max_idle = max_idle
+        self._idle: List[AgentSession] = []
+        self._lock = threading.Lock()
+        self._config: Optional[Dict[str, Any]] = None
+        self._stats = {
+            'checkouts': 0,
+            'built': 0,
+            'reused': 0,
+            'in_use': 0,
+            'discarded': 0,
+            'build_ms_total': 0.0,
+            'last_build_ms': None,
+            'checkout_ms_total': 0.0,
+            'speaker_llm_calls_avoided': 0,
+            'speaker_llm_fallbacks': 0,
+        }
+
+    def _build(self) -> AgentSession:
+        started = time.perf_counter()
+        if self._config is None:
+            self._config = get_agent_config()
+        agents = create_agents(self._config)
+        session = AgentSession(agents, create_group_chat(agents, self._config))
+        elapsed = 1000 * (time.perf_counter() - started)
+        with self._lock:
+            self._stats['built'] += 1
+            self._stats['build_ms_total'] += elapsed
+            self._stats['last_build_ms'] = round(elapsed, 2)
+        return session
+
+    def _acquire(self) -> AgentSession:
+        with self._lock:
+            session = self._idle.pop() if self._idle else None
+            if session is not None:
+                self._stats['reused'] += 1
+        return session or self._build()
+
+    def _release(self, session: AgentSession):
+        selection = session.selection_stats()
+        if selection:
+            with self._lock:
+                self._stats['speaker_llm_calls_avoided'] += selection['llm_calls_avoided']
+                self._stats['speaker_llm_fallbacks'] += selection['llm_fallbacks']
+        try:
+            session.reset()
+        except Exception as e:
+            print(f"Discarding agent session that failed to reset: {str(e)}")
+            with self._lock:
+                self._stats['discarded'] += 1
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(session)
+            else:
+                self._stats['discarded'] += 1
+
+    @contextmanager
+    def checkout(self, user: User, observer: Optional[Any] = None, memo: Optional[ToolMemo] = None,
+                 stream: bool = False):
+        """Yield an ``AgentSession`` whose tools act on behalf of ``user``.
+
+        ``observer``, if given, needs ``speaker_selected(speaker)`` and
+        ``turn(message, speaker)`` methods; an exception raised from either
+        ends the chat. Read-only tool results are reused from ``memo``, if given.
+        With ``stream``, completions print their token deltas to autogen's IOStream.
+        """
+        started = time.perf_counter()
+        session = self._acquire()
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            self._stats['checkout_ms_total'] += 1000 * (time.perf_counter() - started)
+        token = _current_user.set(user)
+        observer_token = _chat_observer.set(observer)
+        stream_token = _stream_completions.set(stream)
+        try:
+            with use_tool_memo(memo):
+                yield session
+        finally:
+            _stream_completions.reset(stream_token)
+            _chat_observer.reset(observer_token)
+            _current_user.reset(token)
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._release(session)
+
+    def clear(self):
+        """Drop idle sessions and the cached config, e.g. after the API key changes"""
+        with self._lock:
+            self._idle.clear()
+            self._config = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        stats['build_ms_total'] = round(stats['build_ms_total'], 2)
+        stats['avg_checkout_ms'] = round(stats.pop('checkout_ms_total') / stats['checkouts'], 3) if stats['checkouts'] else None
+        return stats
+
+
+_agent_pool: Optional[AgentPool] = None
+_agent_pool_lock = threading.Lock()
+
+
+def get_agent_pool() -> AgentPool:
+    """Process-wide pool sized by ``settings.AGENT_POOL['MAX_IDLE']``"""
+    global _agent_pool
+    if _agent_pool is None:
+        with _agent_pool_lock:
+            if _agent_pool is None:
+                options = getattr(settings, 'AGENT_POOL', {})
+                _agent_pool = AgentPool(max_idle=options.get('MAX_IDLE', 4))
+    return _agent_pool
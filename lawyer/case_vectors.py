@@ -0,0 +1,73 @@
+from typing import Iterable, List, Optional, Tuple
+import numpy as np
+from django.db import transaction
+from django.contrib.auth.models import User
+from .models import BaseDocument, Case
+from .vector_index import normalize_vector, top_k
+
+
+def _unit_vectors(embeddings: Iterable) -> np.ndarray:
+    vectors = [vector for vector in (normalize_vector(embedding) for embedding in embeddings) if vector is not None]
+    if not vectors:
+        return np.empty((0, 0), dtype=np.float32)
+    dimension = vectors[0].shape[0]
+    return np.stack([vector for vector in vectors if vector.shape[0] == dimension])
+
+
+def _centroid_fields(total: Optional[np.ndarray], count: int) -> dict:
+    centroid = normalize_vector(total) if total is not None and count else None
+    return {
+        'embedding_sum': total if centroid is not None else None,
+        'centroid': centroid,
+        'embedded_document_count': count if centroid is not None else 0,
+    }
+
+
+def recompute_case_centroid(case_id: int):
+    """Rebuild a case's centroid from all of its embedded documents"""
+    embeddings = BaseDocument.objects.filter(cases__id=case_id, embeddings__isnull=False).values_list('embeddings', flat=True)
+    vectors = _unit_vectors(embeddings)
+    total = vectors.sum(axis=0) if vectors.size else None
+    Case.objects.filter(id=case_id).update(**_centroid_fields(total, vectors.shape[0]))
+
+
+def add_documents_to_centroid(case_id: int, document_ids: Iterable[int]):
+    """Fold newly linked documents into the running sum instead of re-reading the whole case"""
+    embeddings = BaseDocument.objects.filter(id__in=list(document_ids), embeddings__isnull=False).values_list('embeddings', flat=True)
+    vectors = _unit_vectors(embeddings)
+    if not vectors.size:
+        return
+    with transaction.atomic():
+        case = Case.objects.select_for_update().only('id', 'embedding_sum', 'embedded_document_count').get(id=case_id)
+        if case.embedding_sum is not None and case.embedding_sum.shape[0] != vectors.shape[1]:
+            # Embedding model changed since the sum was built
+            recompute_case_centroid(case_id)
+            return
+        total = vectors.sum(axis=0)
+        if case.embedding_sum is not None:
+            total = total + case.embedding_sum
+        count = case.embedded_document_count + vectors.shape[0]
+        Case.objects.filter(id=case_id).update(**_centroid_fields(total, count))
+
+
+def case_ids_for_documents(document_ids: Iterable[int]) -> List[int]:
+    return list(Case.documents.through.objects.filter(
+        basedocument_id__in=list(document_ids)
+    ).values_list('case_id', flat=True).distinct())
+
+
+def rank_cases_by_centroid(query_embedding, user: User, limit: int = 5) -> List[Tuple[int, float]]:
+    """Cosine similarity of the query to every case centroid of the user, in one matrix product"""
+    vector = normalize_vector(query_embedding)
+    if vector is None:
+        return []
+    rows = [
+        (case_id, centroid) for case_id, centroid in
+        Case.objects.filter(created_by=user, centroid__isnull=False).values_list('id', 'centroid')
+        if centroid.shape[0] == vector.shape[0]
+    ]
+    if not rows:
+        return []
+    ids = np.fromiter((case_id for case_id, _ in rows), dtype=np.int64, count=len(rows))
+    matrix = np.stack([centroid for _, centroid in rows])
+    return top_k(ids, matrix @ vector, limit)
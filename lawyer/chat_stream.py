@@ -0,0 +1,275 @@
+import asyncio
+import json
+import threading
+import traceback
+from typing import Any, Dict, List, Optional, Set, Tuple
+from autogen.io.base import IOStream
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections, transaction
+from .autogen_setup import get_agent_pool
+from .conversation_memory import build_chat_prompt, schedule_memory_update
+from .models import BaseDocument, Conversation, Message
+from .tool_memo import load_tool_memo
+from .tracing import TRACE_KEY, start_trace, summarize_calls, trace_label
+
+
+class ChatCancelled(Exception):
+    """Raised inside the chat thread once the client has gone away"""
+
+
+def _referenced_document_ids(msg: Dict[str, Any]) -> List[int]:
+    # If message contains document references, they are listed in its metadata
+    if "metadata" in msg and "documents" in msg["metadata"]:
+        return list(msg["metadata"]["documents"])
+    return []
+
+
+def build_agent_message(conversation: Conversation, msg: Dict[str, Any]) -> Message:
+    """Unsaved ``Message`` for one group chat turn"""
+    metadata = {"sender": msg.get("name", "System"), "role": msg["role"]}
+    if msg.get("tool_calls"):
+        metadata["tool_calls"] = msg["tool_calls"]
+    if msg.get("tool_timings"):
+        metadata["tool_timings"] = msg["tool_timings"]
+    if msg.get(TRACE_KEY):
+        metadata[TRACE_KEY] = msg[TRACE_KEY]
+    return Message(
+        conversation=conversation,
+        message_type='assistant' if msg.get("name") == "LegalExpert" else 'system',
+        content=msg.get("content") or "",
+        metadata=metadata
+    )
+
+
+def save_agent_message(conversation: Conversation, msg: Dict[str, Any]) -> Tuple[Message, List[BaseDocument]]:
+    """Persist one group chat turn and link any documents it references"""
+    message = build_agent_message(conversation, msg)
+    message.save()
+
+    docs = []
+    doc_ids = _referenced_document_ids(msg)
+    if doc_ids:
+        docs = list(BaseDocument.objects.filter(id__in=doc_ids))
+        message.referenced_documents.add(*docs)
+    return message, docs
+
+
+def save_agent_messages(conversation: Conversation, msgs: List[Dict[str, Any]]) -> Tuple[List[Message], List[BaseDocument]]:
+    """Persist a whole transcript in one transaction.
+
+    One query loads every referenced document, one ``bulk_create`` inserts
+    the messages and one more inserts all rows of the ``referenced_documents``
+    through table, however many turns the chat had.
+    """
+    if not msgs:
+        return [], []
+    messages = [build_agent_message(conversation, msg) for msg in msgs]
+    doc_ids = {doc_id for msg in msgs for doc_id in _referenced_document_ids(msg)}
+    with transaction.atomic():
+        docs = BaseDocument.objects.only('id', 'filename', 'description').in_bulk(list(doc_ids)) if doc_ids else {}
+        Message.objects.bulk_create(messages)
+        Link = Message.referenced_documents.through
+        links = [
+            Link(message_id=message.id, basedocument_id=doc_id)
+            for message, msg in zip(messages, msgs)
+            for doc_id in dict.fromkeys(_referenced_document_ids(msg))
+            if doc_id in docs
+        ]
+        if links:
+            Link.objects.bulk_create(links, ignore_conflicts=True)
+    return messages, list(docs.values())
+
+
+def final_response(messages: List[Message]) -> Optional[str]:
+    """The answer to show: the last non-empty LegalExpert message, else the last non-empty agent message"""
+    answer = fallback = None
+    for message in messages:
+        if not message.content:
+            continue
+        if message.message_type == 'assistant':
+            answer = message.content
+        fallback = message.content
+    return answer if answer is not None else fallback
+
+
+def save_prompt_trace(user_message_id: int, msg: Dict[str, Any]):
+    """Store the LLM calls made before the chat started, e.g. memory retrieval, with the user's message"""
+    if msg.get(TRACE_KEY):
+        Message.objects.filter(id=user_message_id).update(metadata={TRACE_KEY: msg[TRACE_KEY]})
+
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def get_stream_options() -> Dict[str, Any]:
+    options = {
+        'TOKEN_DELTAS': True,
+        'KEEPALIVE_SECONDS': 15,
+    }
+    options.update(getattr(settings, 'CHAT_STREAM', {}))
+    return options
+
+
+class ChatEventStream:
+    """Runs a group chat in a worker thread and relays it to an async response as events.
+
+    The object is both autogen's IOStream for the chat thread, where streamed
+    completions print their token deltas, and the group chat observer, which
+    saves every turn as a ``Message`` as soon as it is appended. Events cross
+    from the thread to the event loop through an ``asyncio.Queue``, both taken
+    when ``events()`` starts: under WSGI Django iterates the response in an
+    event loop of its own, not the one the view ran in.
+
+    Cancelling (the client disconnected) makes the next print or turn raise
+    ``ChatCancelled``, which aborts the in-flight completion and the chat.
+    """
+
+    def __init__(self, conversation: Conversation):
+        self.conversation = conversation
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.cancelled = threading.Event()
+        self.speaker: Optional[str] = None
+        self.turns = 0
+        self.saved_messages: List[Message] = []
+        self.referenced_docs: Set[BaseDocument] = set()
+        self.speaker_selection: Optional[Dict[str, Any]] = None
+        self.user_message_id: Optional[int] = None
+        self.trace = None
+
+    def emit(self, event: str, data: Dict[str, Any]):
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, (event, data))
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def _check_cancelled(self):
+        if self.cancelled.is_set():
+            raise ChatCancelled()
+
+    # autogen IOStream
+
+    def print(self, *objects: Any, sep: str = " ", end: str = "\n", flush: bool = False):
+        self._check_cancelled()
+        # Streamed completions print each content delta with end="" and flush=True;
+        # the rest is console chatter (colors, "Next speaker", message echoes)
+        if end == "" and flush:
+            self.emit('delta', {'sender': self.speaker, 'content': sep.join(str(obj) for obj in objects)})
+
+    def input(self, prompt: str = "", *, password: bool = False) -> str:
+        return ""
+
+    # Group chat observer
+
+    def speaker_selected(self, speaker):
+        self._check_cancelled()
+        self.speaker = speaker.name
+        self.emit('speaker', {'sender': speaker.name})
+
+    def turn(self, message: Dict[str, Any], speaker):
+        self.turns += 1
+        # The first turn is the user's own message, saved before the chat started
+        if self.turns == 1:
+            save_prompt_trace(self.user_message_id, message)
+            return
+        saved, docs = save_agent_message(self.conversation, message)
+        self.referenced_docs.update(docs)
+        self.saved_messages.append(saved)
+        self.emit('turn', {
+            'id': saved.id,
+            'sender': saved.metadata['sender'],
+            'role': message['role'],
+            'message_type': saved.message_type,
+            'content': saved.content,
+        })
+        self._check_cancelled()
+
+    # Worker thread
+
+    def run(self, user: User, content: str, user_message_id: int):
+        self.user_message_id = user_message_id
+        try:
+            with start_trace() as self.trace:
+                self._run_chat(user, content, user_message_id)
+        except Exception as e:
+            # _run_chat reports its own failures; this is anything around it
+            print(f"Error in chat stream: {str(e)}")
+            print(traceback.format_exc())
+            self.emit('error', {'message': str(e)})
+        finally:
+            # The executor thread is reused; do not leave its connection open
+            connections.close_all()
+
+    def _run_chat(self, user: User, content: str, user_message_id: int):
+        try:
+            with trace_label('memory'):
+                prompt, memory_stats = build_chat_prompt(self.conversation, content, exclude_id=user_message_id)
+            self.emit('memory', memory_stats)
+            memo = load_tool_memo(self.conversation)
+            with IOStream.set_default(self):
+                with get_agent_pool().checkout(user, observer=self, memo=memo,
+                                               stream=get_stream_options()['TOKEN_DELTAS']) as session:
+                    session.agents["user_proxy"].initiate_chat(
+                        session.manager,
+                        message=prompt,
+                        clear_history=True
+                    )
+                    self.speaker_selection = session.selection_stats()
+        except ChatCancelled:
+            print(f"Chat stream for conversation {self.conversation.id} cancelled after {self.turns} turns")
+            return
+        except Exception as e:
+            print(f"Error in chat stream: {str(e)}")
+            print(traceback.format_exc())
+            self.emit('error', {'message': str(e)})
+            return
+
+        if memo is not None:
+            memo.save(self.conversation.id)
+        done = {
+            'content': final_response(self.saved_messages),
+            'turns': max(self.turns - 1, 0),
+            'speaker_selection': self.speaker_selection,
+            'referenced_documents': [{
+                'id': doc.id,
+                'filename': doc.filename,
+                'description': doc.description
+            } for doc in self.referenced_docs]
+        }
+        if settings.DEBUG:
+            done['debug'] = {
+                'tool_memo': memo.as_stats() if memo else None,
+                'llm': summarize_calls(self.trace.calls) if self.trace else None,
+            }
+        self.emit('done', done)
+        # After 'done', so folding old turns into the summary never delays the answer
+        schedule_memory_update(self.conversation)
+
+    async def events(self, user: User, content: str, user_message_id: int):
+        """Async iterator of SSE frames for ``StreamingHttpResponse``"""
+        keepalive = get_stream_options()['KEEPALIVE_SECONDS']
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+        worker = self.loop.run_in_executor(None, self.run, user, content, user_message_id)
+        try:
+            yield format_sse('start', {'conversation_id': self.conversation.id, 'message_id': user_message_id})
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(self.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    if worker.done() and self.queue.empty():
+                        # The thread ended without a final event, e.g. it was cancelled
+                        yield format_sse('error', {'message': 'Chat ended unexpectedly'})
+                        break
+                    # Comment frame keeps proxies from closing an idle connection
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event, data)
+                if event in ('done', 'error'):
+                    break
+        finally:
+            # Client disconnected (the response task was cancelled) or the chat ended
+            if not worker.done():
+                self.cancel()
@@ -0,0 +1,203 @@
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from django.conf import settings
+from django.db import transaction
+from openai import OpenAI
+from .models import BaseDocument, DocumentChunk
+from .services import EMBEDDING_MODEL, get_openai_client, embed_texts, with_retries, sha256_text
+from .vector_index import peek_chunk_index
+
+try:
+    import tiktoken
+except ImportError:  # Optional: fall back to a word-based token estimate
+    tiktoken = None
+
+# Rough tokens per whitespace-separated word for English legal text when tiktoken is unavailable
+TOKENS_PER_WORD = 1.3
+
+_encoding = None
+_encoding_loaded = False
+
+
+def get_chunking_options() -> Dict[str, Any]:
+    options = {
+        'ENABLED': True,
+        'MAX_TOKENS': 400,
+        'OVERLAP_TOKENS': 60,
+        'EMBEDDING_BATCH_SIZE': 64,
+    }
+    options.update(getattr(settings, 'DOCUMENT_CHUNKS', {}))
+    return options
+
+
+def _get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded and tiktoken is not None:
+        _encoding_loaded = True
+        try:
+            _encoding = tiktoken.encoding_for_model(EMBEDDING_MODEL)
+        except Exception as e:
+            # The BPE ranks are downloaded on first use, which fails on offline hosts
+            print(f"Falling back to word-based token counts: {str(e)}")
+    return _encoding
+
+
+def _token_spans(text: str) -> List[Tuple[int, int]]:
+    """Character ``(start, end)`` of every token, so chunks can be cut back out of the original text"""
+    encoding = _get_encoding()
+    if encoding is None:
+        # Each word counts as TOKENS_PER_WORD tokens; spans are whole words
+        return [match.span() for match in re.finditer(r'\S+', text)]
+    _, starts = encoding.decode_with_offsets(encoding.encode(text, disallowed_special=()))
+    return list(zip(starts, starts[1:] + [len(text)]))
+
+
+def count_tokens(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return int(len(text.split()) * TOKENS_PER_WORD)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of ``text`` that fits in ``max_tokens`` tokens"""
+    if max_tokens <= 0:
+        return ""
+    spans = _token_spans(text)
+    limit = max_tokens if _get_encoding() is not None else int(max_tokens / TOKENS_PER_WORD)
+    if len(spans) <= limit:
+        return text
+    return text[:spans[limit - 1][1]] if limit else ""
+
+
+def chunk_text(text: str, max_tokens: Optional[int] = None, overlap: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Split text into overlapping windows of at most ``max_tokens`` tokens.
+
+    Window ends are pulled back to the last paragraph or sentence break in
+    the final quarter of the window when there is one, so chunks rarely cut
+    a clause in half.
+    """
+    options = get_chunking_options()
+    max_tokens = max_tokens or options['MAX_TOKENS']
+    overlap = options['OVERLAP_TOKENS'] if overlap is None else overlap
+    overlap = min(overlap, max_tokens // 2)
+    if not text or not text.strip():
+        return []
+
+    spans = _token_spans(text)
+    per_unit = 1 if _get_encoding() is not None else TOKENS_PER_WORD
+    window = max(1, int(max_tokens / per_unit))
+    step_back = int(overlap / per_unit)
+
+    chunks = []
+    start = 0
+    while start < len(spans):
+        end = min(start + window, len(spans))
+        if end < len(spans):
+            # Prefer to end on a break, but never give up more than a quarter of the window
+            for candidate in range(end, start + (3 * window) // 4, -1):
+                boundary = text[spans[candidate - 1][0]:spans[candidate - 1][1]]
+                if '\n\n' in boundary or boundary.rstrip().endswith(('.', ';', ':')):
+                    end = candidate
+                    break
+        chunk = text[spans[start][0]:spans[end - 1][1]].strip()
+        if chunk:
+            chunks.append({
+                'start_char': spans[start][0],
+                'end_char': spans[end - 1][1],
+                'text': chunk,
+                'token_count': int((end - start) * per_unit),
+            })
+        if end >= len(spans):
+            break
+        start = max(start + 1, end - step_back)
+    return chunks
+
+
+def _known_chunk_embeddings(hashes: Iterable[str]) -> Dict[str, Any]:
+    """Embeddings already stored for any chunk with the same text, across all documents"""
+    found = {}
+    rows = DocumentChunk.objects.filter(
+        text_sha256__in=set(hashes),
+        embeddings__isnull=False
+    ).values_list('text_sha256', 'embeddings')
+    for text_sha256, embeddings in rows:
+        found.setdefault(text_sha256, embeddings)
+    return found
+
+
+def chunk_documents(documents: List[BaseDocument], client: Optional[OpenAI] = None,
+                    batch_size: Optional[int] = None, max_retries: Optional[int] = None) -> Dict[str, int]:
+    """Rebuild the chunks of each document, embedding only chunk text not seen before.
+
+    Chunks whose text matches an existing chunk (of this or any other
+    document) reuse its stored embedding, so re-chunking an edited document
+    costs embedding calls proportional to the changed chunks. Missing
+    embeddings are requested in batches across all the given documents.
+    """
+    options = get_chunking_options()
+    batch_size = batch_size or options['EMBEDDING_BATCH_SIZE']
+    attempts = max_retries or getattr(settings, 'INGESTION', {}).get('MAX_RETRIES', 4)
+    stats = {'documents': 0, 'chunks': 0, 'reused': 0, 'embedded': 0, 'api_calls': 0}
+
+    planned = []
+    for document in documents:
+        contents = document.contents
+        if contents is None and document.pk:
+            # Streamed extractions leave contents in the database only
+            contents = BaseDocument.objects.filter(pk=document.pk).values_list('contents', flat=True).first()
+        chunks = chunk_text(contents or "")
+        for chunk in chunks:
+            chunk['text_sha256'] = sha256_text(chunk['text'])
+        planned.append((document, chunks))
+
+    known = _known_chunk_embeddings(chunk['text_sha256'] for _, chunks in planned for chunk in chunks)
+    missing = list(dict.fromkeys(
+        chunk['text'] for _, chunks in planned for chunk in chunks if chunk['text_sha256'] not in known
+    ))
+    if missing:
+        client = client or get_openai_client()
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            for text, embedding in zip(batch, with_retries(embed_texts, client, batch, attempts=attempts)):
+                known[sha256_text(text)] = embedding
+            stats['api_calls'] += 1
+        stats['embedded'] = len(missing)
+
+    for document, chunks in planned:
+        rows = [
+            DocumentChunk(
+                document=document,
+                position=position,
+                start_char=chunk['start_char'],
+                end_char=chunk['end_char'],
+                text=chunk['text'],
+                token_count=chunk['token_count'],
+                text_sha256=chunk['text_sha256'],
+                embeddings=known.get(chunk['text_sha256'])
+            )
+            for position, chunk in enumerate(chunks)
+        ]
+        with transaction.atomic():
+            # Deleted chunks leave the chunk index through the post_delete signal
+            document.chunks.all().delete()
+            created = DocumentChunk.objects.bulk_create(rows)
+            _sync_chunk_index(document.uploaded_by_id, created)
+        stats['documents'] += 1
+        stats['chunks'] += len(rows)
+    stats['reused'] = stats['chunks'] - stats['embedded']
+    return stats
+
+
+def _sync_chunk_index(owner_id: int, created: List[DocumentChunk]):
+    """Add new chunks to the in-memory chunk index once the transaction commits"""
+    updates = [(chunk.id, chunk.embeddings) for chunk in created]
+
+    def apply():
+        index = peek_chunk_index()
+        if index is None:
+            return
+        for chunk_id, embeddings in updates:
+            index.upsert(chunk_id, owner_id, embeddings)
+
+    transaction.on_commit(apply)
@@ -0,0 +1,254 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from openai import OpenAI
+from .chunking import count_tokens, truncate_to_tokens
+from .models import Conversation, Message
+from .services import SUMMARY_MODEL, embed_texts, get_openai_client, with_retries
+from .utils import get_embeddings
+from .vector_index import normalize_vector
+
+# Conversation.context key holding the rolling memory
+MEMORY_KEY = 'memory'
+
+SUMMARY_HEADER = "Summary of the conversation so far:"
+RETRIEVED_HEADER = "Relevant earlier messages:"
+RECENT_HEADER = "Most recent messages:"
+REQUEST_HEADER = "Current request:"
+
+# Only the user's messages and the LegalExpert's answers are remembered; inter-agent
+# chatter and tool output are saved as 'system' messages and left out
+DIALOGUE_TYPES = ('user', 'assistant')
+
+
+def get_memory_options() -> Dict[str, Any]:
+    options = {
+        'ENABLED': True,
+        'TOKEN_BUDGET': 3000,
+        'RECENT_MESSAGES': 6,
+        'SUMMARY_TOKENS': 500,
+        'RETRIEVED_MESSAGES': 4,
+        'MIN_SIMILARITY': 0.3,
+        'FOLD_BATCH': 4,
+        'MODE': 'inline',
+    }
+    options.update(getattr(settings, 'CONVERSATION_MEMORY', {}))
+    return options
+
+
+def get_memory_state(conversation: Conversation) -> Dict[str, Any]:
+    state = {'summary': '', 'summarized_through': 0, 'folded_messages': 0}
+    state.update((conversation.context or {}).get(MEMORY_KEY, {}))
+    return state
+
+
+def _speaker(message: Message) -> str:
+    if message.message_type == 'user':
+        return 'User'
+    return (message.metadata or {}).get('sender', 'Assistant')
+
+
+def _line(message: Message) -> str:
+    return f"{_speaker(message)}: {message.content}"
+
+
+def _retrieve(conversation: Conversation, content: str, exclude_ids: List[int], limit: int,
+              min_similarity: float, client: Optional[OpenAI]) -> List[Message]:
+    """Folded messages most similar to the new message, best first"""
+    rows = list(
+        Message.objects.filter(conversation=conversation, embeddings__isnull=False)
+        .exclude(id__in=exclude_ids)
+        .values_list('id', 'embeddings')
+    )
+    if not rows or limit <= 0:
+        return []
+    query = normalize_vector(get_embeddings(content, client or get_openai_client()))
+    vectors = [(message_id, normalize_vector(embedding)) for message_id, embedding in rows]
+    vectors = [(message_id, vector) for message_id, vector in vectors if vector is not None and vector.shape == query.shape]
+    if not vectors:
+        return []
+    scores = np.stack([vector for _, vector in vectors]) @ query
+    ranked = [
+        vectors[position][0] for position in np.argsort(-scores)[:limit]
+        if scores[position] >= min_similarity
+    ]
+    messages = Message.objects.in_bulk(ranked)
+    return [messages[message_id] for message_id in ranked if message_id in messages]
+
+
+def build_chat_prompt(conversation: Conversation, content: str, exclude_id: Optional[int] = None,
+                      client: Optional[OpenAI] = None) -> Tuple[str, Dict[str, Any]]:
+    """The message to start the agents with: ``content`` plus as much memory as the budget allows.
+
+    The newest messages are kept verbatim first, then the running summary of
+    older ones, then earlier messages retrieved by similarity to ``content``.
+    Whatever does not fit in ``TOKEN_BUDGET`` tokens is dropped, so the
+    prompt stays bounded however long the conversation gets.
+    """
+    options = get_memory_options()
+    stats = {'recent': 0, 'summary_tokens': 0, 'retrieved': 0, 'prompt_tokens': count_tokens(content)}
+    if not options['ENABLED']:
+        return content, stats
+
+    headers = ' '.join((SUMMARY_HEADER, RETRIEVED_HEADER, RECENT_HEADER, REQUEST_HEADER))
+    budget = options['TOKEN_BUDGET'] - stats['prompt_tokens'] - count_tokens(headers)
+    state = get_memory_state(conversation)
+    dialogue = Message.objects.filter(conversation=conversation, message_type__in=DIALOGUE_TYPES)
+    if exclude_id is not None:
+        dialogue = dialogue.exclude(id=exclude_id)
+
+    recent = []
+    for message in dialogue.order_by('-id')[:options['RECENT_MESSAGES']]:
+        tokens = count_tokens(_line(message))
+        if tokens > budget:
+            break
+        recent.append(message)
+        budget -= tokens
+    recent.reverse()
+
+    summary = truncate_to_tokens(state['summary'], min(options['SUMMARY_TOKENS'], budget))
+    if summary:
+        budget -= count_tokens(summary)
+
+    retrieved = []
+    if budget > 0 and state['summarized_through']:
+        exclude_ids = [message.id for message in recent] + ([exclude_id] if exclude_id is not None else [])
+        try:
+            candidates = _retrieve(conversation, content, exclude_ids, options['RETRIEVED_MESSAGES'],
+                                   options['MIN_SIMILARITY'], client)
+        except Exception as e:
+            print(f"Error retrieving conversation memory: {str(e)}")
+            candidates = []
+        for message in candidates:
+            tokens = count_tokens(_line(message))
+            if tokens > budget:
+                continue
+            retrieved.append(message)
+            budget -= tokens
+        retrieved.sort(key=lambda message: message.id)
+
+    sections = []
+    if summary:
+        sections.append(f"{SUMMARY_HEADER}\n{summary}")
+    if retrieved:
+        sections.append(f"{RETRIEVED_HEADER}\n" + "\n".join(_line(message) for message in retrieved))
+    if recent:
+        sections.append(f"{RECENT_HEADER}\n" + "\n".join(_line(message) for message in recent))
+    if not sections:
+        return content, stats
+
+    sections.append(f"{REQUEST_HEADER}\n{content}")
+    prompt = "\n\n".join(sections)
+    stats.update({
+        'recent': len(recent),
+        'summary_tokens': count_tokens(summary) if summary else 0,
+        'retrieved': len(retrieved),
+        'prompt_tokens': count_tokens(prompt),
+    })
+    return prompt, stats
+
+
+def summarize_messages(client: OpenAI, summary: str, messages: List[Message], max_tokens: int) -> str:
+    """Fold new messages into the running summary"""
+    transcript = "\n".join(_line(message) for message in messages)
+    prompt = (
+        f"Current summary of a conversation between a lawyer and their legal assistants:\n{summary or '(empty)'}\n\n"
+        f"New messages:\n{transcript}\n\n"
+        f"Rewrite the summary to include the new messages in at most {max_tokens} tokens. Keep case names, "
+        "document names, facts, decisions and open questions; drop pleasantries."
+    )
+    response = client.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": "You maintain concise running summaries of legal conversations."},
+            {"role": "user", "content": prompt}
+        ],
+        max_tokens=max_tokens
+    )
+    return response.choices[0].message.content or summary
+
+
+def update_conversation_memory(conversation_id: int, client: Optional[OpenAI] = None) -> Dict[str, Any]:
+    """Fold messages that left the recent window into the summary and embed them for retrieval.
+
+    Nothing happens until at least ``FOLD_BATCH`` messages are waiting, so the
+    summary is rewritten once every few turns rather than on every message.
+    """
+    options = get_memory_options()
+    conversation = Conversation.objects.only('id', 'context').get(id=conversation_id)
+    state = get_memory_state(conversation)
+    dialogue = Message.objects.filter(conversation=conversation, message_type__in=DIALOGUE_TYPES)
+    recent_ids = list(dialogue.order_by('-id').values_list('id', flat=True)[:options['RECENT_MESSAGES']])
+    pending = dialogue.filter(id__gt=state['summarized_through'])
+    if recent_ids:
+        pending = pending.filter(id__lt=min(recent_ids))
+    pending = list(pending.order_by('id'))
+    if not options['ENABLED'] or len(pending) < options['FOLD_BATCH']:
+        return {'folded': 0, 'pending': len(pending)}
+
+    client = client or get_openai_client()
+    summary = with_retries(summarize_messages, client, state['summary'], pending, options['SUMMARY_TOKENS'])
+    embeddings = with_retries(embed_texts, client, [_line(message) for message in pending])
+    for message, embedding in zip(pending, embeddings):
+        message.embeddings = embedding
+
+    with transaction.atomic():
+        locked = Conversation.objects.select_for_update().only('id', 'context').get(id=conversation_id)
+        current = get_memory_state(locked)
+        if current['summarized_through'] != state['summarized_through']:
+            # Another worker folded these messages first
+            return {'folded': 0, 'pending': 0}
+        Message.objects.bulk_update(pending, ['embeddings'])
+        context = dict(locked.context or {})
+        context[MEMORY_KEY] = {
+            'summary': summary,
+            'summarized_through': pending[-1].id,
+            'folded_messages': current['folded_messages'] + len(pending),
+            'summary_tokens': count_tokens(summary),
+            'updated_at': timezone.now().isoformat(),
+        }
+        Conversation.objects.filter(id=conversation_id).update(context=context)
+    return {'folded': len(pending), 'pending': 0}
+
+
+_memory_executor: Optional[ThreadPoolExecutor] = None
+_memory_executor_lock = threading.Lock()
+
+
+def get_memory_executor() -> ThreadPoolExecutor:
+    """Single background thread for inline-mode memory updates, so folds run one at a time"""
+    global _memory_executor
+    if _memory_executor is None:
+        with _memory_executor_lock:
+            if _memory_executor is None:
+                _memory_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='conversation-memory')
+    return _memory_executor
+
+
+def _update_in_background(conversation_id: int):
+    try:
+        update_conversation_memory(conversation_id)
+    except Exception as e:
+        print(f"Error updating conversation memory: {str(e)}")
+    finally:
+        # The thread outlives the request, so it must not hold on to its connection
+        connection.close()
+
+
+def schedule_memory_update(conversation: Conversation):
+    """Update the memory after the response, in a background thread or via the job queue per ``CONVERSATION_MEMORY['MODE']``"""
+    options = get_memory_options()
+    if not options['ENABLED']:
+        return
+    if options['MODE'] == 'queue':
+        from .jobs import enqueue
+
+        enqueue('update_conversation_memory', {'conversation_id': conversation.id})
+        return
+    # Once the turn's messages are committed, so the fold sees them and the request never waits on it
+    conversation_id = conversation.id
+    transaction.on_commit(lambda: get_memory_executor().submit(_update_in_background, conversation_id))
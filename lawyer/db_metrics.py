@@ -0,0 +1,83 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+from django.db import connections
+
+# Leading SQL keywords counted as writes
+WRITE_STATEMENTS = {'INSERT', 'UPDATE', 'DELETE', 'REPLACE'}
+
+
+class QueryCounter:
+    """Counts the queries, and the writes among them, run on one database alias while active.
+
+    Installed as a Django execute wrapper on the starting thread's connection.
+    Worker threads running in a copy of that thread's context, such as
+    parallel tool calls and hybrid retrievers, add their queries by wrapping
+    their work in ``count_worker_queries()``. Use as a context manager or with
+    ``start()`` / ``stop()`` when the counted region does not fit a ``with`` block.
+    """
+
+    def __init__(self, using: str = 'default'):
+        self.using = using
+        self.queries = 0
+        self.writes = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+        self._token = None
+
+    def __call__(self, execute, sql, params, many, context):
+        write = sql.lstrip().split(None, 1)[0].upper() in WRITE_STATEMENTS
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.queries += 1
+                self.writes += write
+                self.seconds += elapsed
+
+    def start(self) -> 'QueryCounter':
+        connections[self.using].execute_wrappers.append(self)
+        self._token = _active_counter.set(self)
+        return self
+
+    def stop(self):
+        wrappers = connections[self.using].execute_wrappers
+        if self in wrappers:
+            wrappers.remove(self)
+        if self._token is not None:
+            _active_counter.reset(self._token)
+            self._token = None
+
+    def __enter__(self) -> 'QueryCounter':
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'queries': self.queries, 'writes': self.writes, 'db_ms': round(1000 * self.seconds, 2)}
+
+
+# The counter started in this context, seen by worker threads through copied contexts
+_active_counter: ContextVar[Optional[QueryCounter]] = ContextVar('db_query_counter', default=None)
+
+
+@contextmanager
+def count_worker_queries():
+    """Count this thread's queries in the ``QueryCounter`` of the context it was copied from, if any"""
+    counter = _active_counter.get()
+    wrappers = connections[counter.using].execute_wrappers if counter is not None else None
+    if counter is None or counter in wrappers:
+        yield
+        return
+    wrappers.append(counter)
+    try:
+        yield
+    finally:
+        if counter in wrappers:
+            wrappers.remove(counter)
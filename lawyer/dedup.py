@@ -0,0 +1,78 @@
+import os
+from typing import Dict, Iterable, Optional
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from .models import BaseDocument
+
+# A reused document skips one chat completion (summary) and one embeddings request
+API_CALLS_PER_ENRICHMENT = 2
+
+
+def enriched_documents():
+    """Documents whose contents, description and embedding can be copied to a duplicate"""
+    return BaseDocument.objects.filter(
+        contents__isnull=False,
+        description__isnull=False,
+        embeddings__isnull=False
+    )
+
+
+def find_by_file_hashes(hashes: Iterable[str]) -> Dict[str, BaseDocument]:
+    """Map each known file hash to one enriched document with those exact bytes"""
+    found = {}
+    for document in enriched_documents().filter(file_sha256__in=set(hashes)).order_by('id'):
+        found.setdefault(document.file_sha256, document)
+    return found
+
+
+def find_by_content_hashes(hashes: Iterable[str]) -> Dict[str, BaseDocument]:
+    """Map each known extracted-text hash to one enriched document with that text"""
+    found = {}
+    for document in enriched_documents().filter(content_sha256__in=set(hashes)).order_by('id'):
+        found.setdefault(document.content_sha256, document)
+    return found
+
+
+def copy_enrichment(source: BaseDocument, target: BaseDocument, contents: bool = True):
+    """Copy the expensive derived fields of ``source`` onto ``target``"""
+    if contents:
+        target.contents = source.contents
+    target.description = source.description
+    target.embeddings = source.embeddings
+    target.status = 'ready'
+
+
+def blob_name(file_sha256: str, filename: str) -> str:
+    extension = os.path.splitext(filename)[1].lower()
+    return f"documents/blobs/{file_sha256[:2]}/{file_sha256}{extension}"
+
+
+def store_file(document: BaseDocument, data: bytes, file_sha256: str, filename: str) -> bool:
+    """Attach the upload to ``document``; returns True if existing stored bytes were reused.
+
+    With ``DOCUMENT_BLOB_STORE`` enabled files are stored once under their
+    hash, so identical uploads share a single file on disk.
+    """
+    if not getattr(settings, 'DOCUMENT_BLOB_STORE', False):
+        document.file.save(filename, ContentFile(data), save=False)
+        return False
+    name = blob_name(file_sha256, filename)
+    if default_storage.exists(name):
+        document.file.name = name
+        return True
+    document.file.name = default_storage.save(name, ContentFile(data))
+    return False
+
+
+def find_enriched_duplicate(document: BaseDocument) -> Optional[BaseDocument]:
+    """Enriched document sharing this document's file bytes or extracted text, if any"""
+    if document.file_sha256:
+        duplicate = find_by_file_hashes([document.file_sha256]).get(document.file_sha256)
+        if duplicate and duplicate.pk != document.pk:
+            return duplicate
+    if document.content_sha256:
+        duplicate = find_by_content_hashes([document.content_sha256]).get(document.content_sha256)
+        if duplicate and duplicate.pk != document.pk:
+            return duplicate
+    return None
@@ -0,0 +1,99 @@
+import json
+import struct
+from typing import Optional, Sequence
+import numpy as np
+from django.conf import settings
+from django.db import models
+
+# Every stored vector starts with a two byte header: a magic byte and a dtype code.
+# int8 vectors follow the header with a float32 scale, so rows are self-describing and
+# the storage dtype can change without a schema migration.
+MAGIC = b'V'
+DTYPE_CODES = {'float32': b'f', 'float16': b'h', 'int8': b'b'}
+CODE_DTYPES = {code: dtype for dtype, code in DTYPE_CODES.items()}
+HEADER_SIZE = 2
+SCALE_SIZE = 4
+
+
+def get_storage_dtype() -> str:
+    return getattr(settings, 'EMBEDDING_STORAGE', {}).get('DTYPE', 'float32')
+
+
+def encode_vector(vector: Sequence[float], dtype: str = 'float32') -> bytes:
+    """Pack a vector as header + raw little-endian values"""
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    array = np.asarray(vector, dtype=np.float32).ravel()
+    header = MAGIC + DTYPE_CODES[dtype]
+    if dtype == 'int8':
+        # Symmetric per-vector scale: the largest magnitude maps to 127
+        peak = float(np.max(np.abs(array))) if array.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        codes = np.clip(np.round(array / scale), -127, 127).astype('<i1')
+        return header + struct.pack('<f', scale) + codes.tobytes()
+    return header + array.astype('<f4' if dtype == 'float32' else '<f2').tobytes()
+
+
+def decode_vector(data) -> np.ndarray:
+    """Turn stored bytes back into a float vector.
+
+    float32 rows come back as a read-only ``np.frombuffer`` view over the
+    database buffer, with no copy. float16 and int8 rows are widened to
+    float32, which allocates one new array.
+    """
+    if bytes(data[:1]) != MAGIC:
+        raise ValueError("Not an encoded embedding")
+    dtype = CODE_DTYPES[bytes(data[1:2])]
+    if dtype == 'float32':
+        return np.frombuffer(data, dtype='<f4', offset=HEADER_SIZE)
+    if dtype == 'float16':
+        return np.frombuffer(data, dtype='<f2', offset=HEADER_SIZE).astype(np.float32)
+    scale = struct.unpack_from('<f', data, HEADER_SIZE)[0]
+    return np.frombuffer(data, dtype='<i1', offset=HEADER_SIZE + SCALE_SIZE).astype(np.float32) * np.float32(scale)
+
+
+class VectorField(models.BinaryField):
+    """Embedding stored as packed float32, float16 or int8 bytes and loaded as a NumPy array.
+
+    Assign lists or arrays; reads return ``np.ndarray``. New rows are written
+    with ``settings.EMBEDDING_STORAGE['DTYPE']`` unless ``dtype`` is given.
+    """
+
+    def __init__(self, *args, dtype: Optional[str] = None, **kwargs):
+        self.dtype = dtype
+        super().__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super().deconstruct()
+        if self.dtype is not None:
+            kwargs['dtype'] = self.dtype
+        return name, path, args, kwargs
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return None
+        return decode_vector(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, np.ndarray):
+            return value
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return decode_vector(value)
+        if isinstance(value, str):
+            # Serialized fixtures store the vector as a JSON list
+            return np.asarray(json.loads(value), dtype=np.float32)
+        return np.asarray(value, dtype=np.float32)
+
+    def get_prep_value(self, value):
+        if value is None or isinstance(value, (bytes, bytearray, memoryview)):
+            return value
+        return encode_vector(value, self.dtype or get_storage_dtype())
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if not prepared:
+            value = self.get_prep_value(value)
+        return super().get_db_prep_value(value, connection, prepared=True)
+
+    def value_to_string(self, obj):
+        value = self.value_from_object(obj)
+        return None if value is None else json.dumps(np.asarray(value, dtype=np.float32).tolist())
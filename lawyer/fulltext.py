@@ -0,0 +1,196 @@
+import re
+import threading
+from typing import Any, Dict, List, Optional
+from django.conf import settings
+from django.db import OperationalError, connection
+from django.db.models import Q
+
+FTS_TABLE = 'lawyer_document_fts'
+
+# bm25() weights in column order: filename, description, contents, owner_id (unindexed)
+BM25_WEIGHTS = (10.0, 4.0, 1.0, 0.0)
+
+# Quoted phrases, then bare terms with an optional trailing * for prefix matches
+QUERY_TOKENS = re.compile(r'"([^"]+)"|(\S+)')
+OPERATORS = {'AND', 'OR', 'NOT'}
+
+
+def to_fts_query(query: str) -> str:
+    """Translate user input into a safe FTS5 MATCH expression.
+
+    ``"exact phrase"`` stays a phrase, ``term*`` becomes a prefix query and
+    upper-case AND/OR/NOT between two terms are kept as operators; everything
+    else is quoted so punctuation in legal text (``s.12(3)``) cannot break the
+    syntax. Of several operators in a row only the first is kept, except that
+    a NOT there is searched for as a word, as is a leading operator.
+    """
+    parts = []
+    operator = None  # Held until a term follows it
+    for phrase, term in QUERY_TOKENS.findall(query):
+        if phrase:
+            term = '"' + phrase.replace('"', '') + '"'
+        elif term in OPERATORS and parts and (operator is None or term != 'NOT'):
+            operator = operator or term
+            continue
+        else:
+            prefix = term.endswith('*')
+            term = term.rstrip('*').replace('"', '')
+            if not term:
+                continue
+            term = f'"{term}"' + ('*' if prefix else '')
+        if operator:
+            parts.append(operator)
+            operator = None
+        parts.append(term)
+    return ' '.join(parts)
+
+
+class FullTextBackend:
+    """Interface for document full-text search backends"""
+
+    name = 'base'
+
+    def index_document(self, document_id: int):
+        """(Re)index one document from its current database row"""
+        raise NotImplementedError
+
+    def remove_document(self, document_id: int):
+        raise NotImplementedError
+
+    def rebuild(self) -> int:
+        """Re-index every document; returns the number indexed"""
+        raise NotImplementedError
+
+    def search(self, query: str, limit: int = 10, owner_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Return ``{'id', 'score', 'snippet'}`` dicts, best match first"""
+        raise NotImplementedError
+
+
+class IContainsBackend(FullTextBackend):
+    """Unranked substring matching; works on any database but scans every row"""
+
+    name = 'icontains'
+
+    def index_document(self, document_id: int):
+        pass
+
+    def remove_document(self, document_id: int):
+        pass
+
+    def rebuild(self) -> int:
+        return 0
+
+    def search(self, query: str, limit: int = 10, owner_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        from .models import BaseDocument
+
+        documents = BaseDocument.objects.filter(
+            Q(contents__icontains=query) |
+            Q(description__icontains=query) |
+            Q(filename__icontains=query)
+        )
+        if owner_id is not None:
+            documents = documents.filter(uploaded_by_id=owner_id)
+        return [{'id': doc_id, 'score': None, 'snippet': None} for doc_id in documents.values_list('id', flat=True)[:limit]]
+
+
+class SQLiteFTS5Backend(FullTextBackend):
+    """BM25-ranked search over an FTS5 virtual table in the default SQLite database.
+
+    The table keeps its own copy of the indexed text so ``snippet()`` can
+    highlight matches. Rows are copied from ``lawyer_basedocument`` inside
+    SQLite, so indexing never pulls document contents into Python.
+    """
+
+    name = 'sqlite_fts5'
+
+    def __init__(self, snippet_tokens: int = 24):
+        self.snippet_tokens = snippet_tokens
+
+    @staticmethod
+    def is_supported() -> bool:
+        if connection.vendor != 'sqlite':
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+            return bool(cursor.fetchone()[0])
+
+    def index_document(self, document_id: int):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [document_id])
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, filename, description, contents, owner_id) "
+                "SELECT id, filename, COALESCE(description, ''), COALESCE(contents, ''), uploaded_by_id "
+                "FROM lawyer_basedocument WHERE id = %s",
+                [document_id]
+            )
+
+    def remove_document(self, document_id: int):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [document_id])
+
+    def rebuild(self) -> int:
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, filename, description, contents, owner_id) "
+                "SELECT id, filename, COALESCE(description, ''), COALESCE(contents, ''), uploaded_by_id "
+                "FROM lawyer_basedocument"
+            )
+            cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+            cursor.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}")
+            return cursor.fetchone()[0]
+
+    def search(self, query: str, limit: int = 10, owner_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        expression = to_fts_query(query)
+        if not expression:
+            return []
+        weights = ', '.join(str(weight) for weight in BM25_WEIGHTS)
+        sql = (
+            f"SELECT rowid, bm25({FTS_TABLE}, {weights}) AS rank, "
+            f"snippet({FTS_TABLE}, -1, '<mark>', '</mark>', '…', %s) "
+            f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s"
+        )
+        params: List[Any] = [self.snippet_tokens, expression]
+        if owner_id is not None:
+            sql += " AND owner_id = %s"
+            params.append(owner_id)
+        sql += " ORDER BY rank LIMIT %s"
+        params.append(limit)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+        except OperationalError as e:
+            print(f"Full-text query {expression!r} failed: {str(e)}")
+            return []
+        # bm25() is lower-is-better; flip the sign so larger scores rank higher like similarity
+        return [{'id': row[0], 'score': -row[1], 'snippet': row[2]} for row in rows]
+
+
+BACKENDS = {
+    IContainsBackend.name: IContainsBackend,
+    SQLiteFTS5Backend.name: SQLiteFTS5Backend,
+}
+
+_backend: Optional[FullTextBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_full_text_backend() -> FullTextBackend:
+    """Backend selected by ``settings.FULL_TEXT_SEARCH['BACKEND']``, falling back to icontains"""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                options = getattr(settings, 'FULL_TEXT_SEARCH', {})
+                name = options.get('BACKEND', SQLiteFTS5Backend.name)
+                if name not in BACKENDS:
+                    raise ValueError(f"Unknown full-text search backend: {name}")
+                if name == SQLiteFTS5Backend.name and not SQLiteFTS5Backend.is_supported():
+                    print("SQLite FTS5 is not available; falling back to icontains search")
+                    name = IContainsBackend.name
+                backend = BACKENDS[name]()
+                if isinstance(backend, SQLiteFTS5Backend):
+                    backend.snippet_tokens = options.get('SNIPPET_TOKENS', backend.snippet_tokens)
+                _backend = backend
+    return _backend
@@ -0,0 +1,146 @@
+import base64
+import hashlib
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Q
+from .models import Conversation, Message
+
+# Columns a history page needs; contents of other fields are never loaded
+MESSAGE_FIELDS = ('id', 'message_type', 'content', 'metadata', 'created_at')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def get_history_options() -> Dict[str, Any]:
+    options = {
+        'PAGE_SIZE': 50,
+        'MAX_PAGE_SIZE': 200,
+        'CONVERSATION_LIST_SIZE': 50,
+    }
+    options.update(getattr(settings, 'CHAT_HISTORY', {}))
+    return options
+
+
+def encode_cursor(created_at: datetime, message_id: int) -> str:
+    """Opaque cursor for a message's position in ``(created_at, id)`` order"""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{message_id}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, message_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(message_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+def _referenced_documents(message_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+    """Documents referenced by each message, in one join over the through table"""
+    documents: Dict[int, List[Dict[str, Any]]] = {}
+    if not message_ids:
+        return documents
+    links = Message.referenced_documents.through.objects.filter(message_id__in=message_ids).values(
+        'message_id', 'basedocument_id', 'basedocument__filename', 'basedocument__description'
+    )
+    for link in links:
+        documents.setdefault(link['message_id'], []).append({
+            'id': link['basedocument_id'],
+            'filename': link['basedocument__filename'],
+            'description': link['basedocument__description'],
+        })
+    return documents
+
+
+def _serialize(row: Dict[str, Any], documents: List[Dict[str, Any]]) -> Dict[str, Any]:
+    return {
+        'id': row['id'],
+        'content': row['content'],
+        'message_type': row['message_type'],
+        'sender': (row['metadata'] or {}).get('sender'),
+        'created_at': row['created_at'].isoformat(),
+        'cursor': encode_cursor(row['created_at'], row['id']),
+        'referenced_documents': documents,
+    }
+
+
+def get_message_page(conversation_id: int, limit: Optional[int] = None, before: Optional[str] = None,
+                     after: Optional[str] = None) -> Dict[str, Any]:
+    """One page of a conversation's messages, oldest first, by keyset on ``(created_at, id)``.
+
+    Without a cursor this is the newest page. ``before`` pages back through
+    older messages; ``after`` returns only messages newer than the cursor, so
+    a client holding ``latest`` can poll for new ones. Each query reads at
+    most ``limit + 1`` rows, however long the conversation is.
+    """
+    options = get_history_options()
+    limit = min(max(limit or options['PAGE_SIZE'], 1), options['MAX_PAGE_SIZE'])
+    messages = Message.objects.filter(conversation_id=conversation_id)
+
+    if after:
+        created_at, message_id = decode_cursor(after)
+        rows = list(
+            messages.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=message_id))
+            .order_by('created_at', 'id')
+            .values(*MESSAGE_FIELDS)[:limit + 1]
+        )
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+    else:
+        if before:
+            created_at, message_id = decode_cursor(before)
+            messages = messages.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=message_id))
+        rows = list(messages.order_by('-created_at', '-id').values(*MESSAGE_FIELDS)[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+
+    documents = _referenced_documents([row['id'] for row in rows])
+    page = [_serialize(row, documents.get(row['id'], [])) for row in rows]
+    return {
+        'messages': page,
+        # after=: more new messages are waiting; otherwise: older messages exist
+        'has_more': has_more,
+        'next_before': page[0]['cursor'] if page and not after and has_more else None,
+        'latest': page[-1]['cursor'] if page and (after or not before) else after,
+    }
+
+
+def get_history_version(conversation_id: int, user: User) -> Optional[Dict[str, Any]]:
+    """Newest message and conversation timestamp, for ETag / Last-Modified; None if not the user's"""
+    conversation = Conversation.objects.filter(id=conversation_id, created_by=user).values('updated_at').first()
+    if conversation is None:
+        return None
+    latest = (
+        Message.objects.filter(conversation_id=conversation_id)
+        .order_by('-created_at', '-id')
+        .values('id', 'created_at')
+        .first()
+    )
+    last_modified = conversation['updated_at']
+    if latest and latest['created_at'] > last_modified:
+        last_modified = latest['created_at']
+    return {
+        'latest_id': latest['id'] if latest else None,
+        'latest_at': latest['created_at'] if latest else None,
+        'last_modified': last_modified,
+    }
+
+
+def history_etag(conversation_id: int, version: Dict[str, Any], query: str) -> str:
+    """Changes whenever a message is added or the conversation is updated; pages differ by query string"""
+    key = f"{conversation_id}|{version['latest_id']}|{version['latest_at']}|{version['last_modified']}|{query}"
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def get_recent_conversations(user: User, limit: Optional[int] = None) -> List[Conversation]:
+    """The user's most recently updated conversations, with only the columns the sidebar shows"""
+    limit = limit or get_history_options()['CONVERSATION_LIST_SIZE']
+    return list(
+        Conversation.objects.filter(created_by=user)
+        .only('id', 'title', 'updated_at')
+        .order_by('-updated_at')[:limit]
+    )
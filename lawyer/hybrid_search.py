@@ -0,0 +1,138 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from .db_metrics import count_worker_queries
+from .fulltext import get_full_text_backend
+from .models import BaseDocument
+from .services import get_openai_client
+from .utils import get_embeddings, vector_search_hits
+
+# Retriever name -> weight; both contribute equally unless settings say otherwise
+DEFAULT_WEIGHTS = {'vector': 1.0, 'lexical': 1.0}
+
+
+def get_hybrid_options() -> Dict[str, Any]:
+    options = {
+        'METHOD': 'rrf',
+        'RRF_K': 60,
+        'WEIGHTS': DEFAULT_WEIGHTS,
+        'CANDIDATES': 50,
+    }
+    options.update(getattr(settings, 'HYBRID_SEARCH', {}))
+    return options
+
+
+def reciprocal_rank_fusion(rankings: Dict[str, List[Dict[str, Any]]], weights: Dict[str, float], k: int = 60) -> Dict[int, float]:
+    """Sum ``weight / (k + rank)`` over every retriever that returned the document"""
+    fused: Dict[int, float] = {}
+    for name, hits in rankings.items():
+        weight = weights.get(name, 1.0)
+        for rank, hit in enumerate(hits, start=1):
+            fused[hit['id']] = fused.get(hit['id'], 0.0) + weight / (k + rank)
+    return fused
+
+
+def weighted_score_fusion(rankings: Dict[str, List[Dict[str, Any]]], weights: Dict[str, float]) -> Dict[int, float]:
+    """Min-max normalize each retriever's scores to [0, 1], then take the weighted sum"""
+    fused: Dict[int, float] = {}
+    for name, hits in rankings.items():
+        scores = [hit['score'] for hit in hits if hit['score'] is not None]
+        if not scores:
+            continue
+        low, high = min(scores), max(scores)
+        weight = weights.get(name, 1.0)
+        for hit in hits:
+            if hit['score'] is None:
+                continue
+            normalized = (hit['score'] - low) / (high - low) if high > low else 1.0
+            fused[hit['id']] = fused.get(hit['id'], 0.0) + weight * normalized
+    return fused
+
+
+def _timed(retriever, *args):
+    """Run a retriever in a worker thread and release that thread's database connection afterwards"""
+    started = time.perf_counter()
+    try:
+        with count_worker_queries():
+            return retriever(*args), time.perf_counter() - started
+    finally:
+        connection.close()
+
+
+def _vector_hits(query: str, limit: int, user: Optional[User]) -> List[Dict[str, Any]]:
+    query_embedding = get_embeddings(query, get_openai_client())
+    return vector_search_hits(query_embedding, limit=limit, user=user)
+
+
+def _lexical_hits(query: str, limit: int, user: Optional[User]) -> List[Dict[str, Any]]:
+    return get_full_text_backend().search(query, limit=limit, owner_id=user.id if user else None)
+
+
+def hybrid_search_documents(query: str, limit: int = 10, user: Optional[User] = None, method: Optional[str] = None,
+                            weights: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+    """Run vector and keyword retrieval concurrently and fuse them into one ranking.
+
+    ``method`` is 'rrf' (reciprocal-rank fusion) or 'weighted' (normalized
+    score sum). Each result carries its fused score, the rank and score from
+    each retriever and the best passage or snippet. A retriever that fails
+    is reported in ``errors`` and the other one still answers.
+    """
+    options = get_hybrid_options()
+    method = method or options['METHOD']
+    weights = {**options['WEIGHTS'], **(weights or {})}
+    candidates = max(limit, options['CANDIDATES'])
+    started = time.perf_counter()
+
+    retrievers = {'vector': _vector_hits, 'lexical': _lexical_hits}
+    rankings: Dict[str, List[Dict[str, Any]]] = {}
+    timings: Dict[str, float] = {}
+    errors: Dict[str, str] = {}
+    # The embedding request dominates vector latency, so keyword search runs alongside it.
+    # Each retriever runs in a copy of this context, so its queries and LLM calls count for the request.
+    with ThreadPoolExecutor(max_workers=len(retrievers)) as pool:
+        futures = {
+            name: pool.submit(contextvars.copy_context().run, _timed, retriever, query, candidates, user)
+            for name, retriever in retrievers.items()
+        }
+        for name, future in futures.items():
+            try:
+                rankings[name], seconds = future.result()
+                timings[f'{name}_ms'] = round(1000 * seconds, 2)
+            except Exception as e:
+                print(f"Error in {name} retrieval: {str(e)}")
+                errors[name] = str(e)
+                rankings[name] = []
+
+    if method == 'weighted':
+        fused = weighted_score_fusion(rankings, weights)
+    else:
+        fused = reciprocal_rank_fusion(rankings, weights, k=options['RRF_K'])
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:limit]
+
+    per_retriever = {
+        name: {hit['id']: (rank, hit) for rank, hit in enumerate(hits, start=1)}
+        for name, hits in rankings.items()
+    }
+    documents = BaseDocument.objects.in_bulk([doc_id for doc_id, _ in ranked])
+    results = []
+    for doc_id, score in ranked:
+        if doc_id not in documents:
+            continue
+        vector_rank, vector_hit = per_retriever['vector'].get(doc_id, (None, {}))
+        lexical_rank, lexical_hit = per_retriever['lexical'].get(doc_id, (None, {}))
+        results.append({
+            'document': documents[doc_id],
+            'score': score,
+            'vector_rank': vector_rank,
+            'vector_score': vector_hit.get('score'),
+            'lexical_rank': lexical_rank,
+            'lexical_score': lexical_hit.get('score'),
+            'passage': vector_hit.get('passage'),
+            'snippet': lexical_hit.get('snippet'),
+        })
+    timings['total_ms'] = round(1000 * (time.perf_counter() - started), 2)
+    return {'results': results, 'method': method, 'timings': timings, 'errors': errors}
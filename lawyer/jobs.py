@@ -0,0 +1,160 @@
+import os
+import socket
+import time
+import traceback
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import BaseDocument, Job
+
+# Job kind -> handler(job); handlers raise to signal a failed attempt
+HANDLERS: Dict[str, Callable[[Job], Any]] = {}
+
+
+def register(kind: str):
+    """Register a function as the handler for a job kind"""
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def get_queue_options() -> Dict[str, Any]:
+    options = {
+        'LEASE_SECONDS': 300,
+        'MAX_ATTEMPTS': 5,
+        'RETRY_BASE_SECONDS': 10,
+        'RETRY_MAX_SECONDS': 3600,
+        'POLL_INTERVAL': 2.0,
+    }
+    options.update(getattr(settings, 'JOB_QUEUE', {}))
+    return options
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue(kind: str, payload: Optional[Dict[str, Any]] = None, document: Optional[BaseDocument] = None,
+            max_attempts: Optional[int] = None) -> Job:
+    """Add a job to the queue; it becomes runnable immediately"""
+    if kind not in HANDLERS:
+        raise ValueError(f"No handler registered for job kind: {kind}")
+    return Job.objects.create(
+        kind=kind,
+        payload=payload or {},
+        document=document,
+        max_attempts=max_attempts or get_queue_options()['MAX_ATTEMPTS']
+    )
+
+
+def _claimable(now) -> Q:
+    # Runnable pending jobs, plus running jobs whose worker let the lease expire
+    return Q(status='pending', run_after__lte=now) | Q(status='running', leased_until__lt=now)
+
+
+def claim(worker_id: str, lease_seconds: Optional[int] = None) -> Optional[Job]:
+    """Lease the next runnable job for this worker, or return None if the queue is idle.
+
+    The claim is a conditional UPDATE on a single row, so two workers racing
+    for the same job cannot both win, and no row locking support is needed.
+    """
+    lease_seconds = lease_seconds or get_queue_options()['LEASE_SECONDS']
+    now = timezone.now()
+    candidates = Job.objects.filter(_claimable(now)).order_by('run_after', 'id').values_list('id', flat=True)[:20]
+    for job_id in candidates:
+        claimed = Job.objects.filter(_claimable(now), id=job_id).update(
+            status='running',
+            worker=worker_id,
+            leased_until=now + timedelta(seconds=lease_seconds),
+            attempts=F('attempts') + 1,
+            updated_at=now
+        )
+        if claimed:
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def complete(job: Job):
+    now = timezone.now()
+    Job.objects.filter(id=job.id, worker=job.worker).update(
+        status='done', leased_until=None, finished_at=now, updated_at=now, last_error=None
+    )
+
+
+def fail(job: Job, error: str):
+    """Record a failed attempt: retry later with backoff, or dead-letter once attempts run out"""
+    options = get_queue_options()
+    now = timezone.now()
+    if job.attempts >= job.max_attempts:
+        Job.objects.filter(id=job.id, worker=job.worker).update(
+            status='dead', leased_until=None, finished_at=now, updated_at=now, last_error=error
+        )
+        if job.document_id:
+            BaseDocument.objects.filter(id=job.document_id).update(status='failed')
+        return
+    delay = min(options['RETRY_BASE_SECONDS'] * (2 ** (job.attempts - 1)), options['RETRY_MAX_SECONDS'])
+    Job.objects.filter(id=job.id, worker=job.worker).update(
+        status='pending', leased_until=None, run_after=now + timedelta(seconds=delay), updated_at=now, last_error=error
+    )
+    if job.document_id:
+        BaseDocument.objects.filter(id=job.document_id).update(status='pending')
+
+
+def run_job(job: Job) -> bool:
+    """Execute a claimed job and record the outcome; returns True on success"""
+    handler = HANDLERS.get(job.kind)
+    if job.attempts > job.max_attempts:
+        # Lease expired on the final attempt, most likely because the worker crashed
+        fail(job, job.last_error or "Lease expired after the final attempt")
+        return False
+    try:
+        if handler is None:
+            raise ValueError(f"No handler registered for job kind: {job.kind}")
+        handler(job)
+    except Exception as e:
+        print(f"Job {job.id} ({job.kind}) failed on attempt {job.attempts}: {str(e)}")
+        fail(job, f"{str(e)}\n{traceback.format_exc()}")
+        return False
+    complete(job)
+    return True
+
+
+def work(worker_id: Optional[str] = None, once: bool = False, max_jobs: Optional[int] = None,
+         poll_interval: Optional[float] = None, lease_seconds: Optional[int] = None) -> int:
+    """Claim and run jobs until stopped; with once=True, exit as soon as the queue is idle"""
+    worker_id = worker_id or default_worker_id()
+    poll_interval = poll_interval if poll_interval is not None else get_queue_options()['POLL_INTERVAL']
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        close_old_connections()
+        job = claim(worker_id, lease_seconds=lease_seconds)
+        if job is None:
+            if once:
+                break
+            time.sleep(poll_interval)
+            continue
+        run_job(job)
+        processed += 1
+    return processed
+
+
+@register('enrich_document')
+def enrich_document_job(job: Job):
+    """Extract, summarize and embed an uploaded document"""
+    from .pipeline import enrich_document
+
+    document = BaseDocument.objects.get(id=job.payload['document_id'])
+    BaseDocument.objects.filter(id=document.id).update(status='processing')
+    enrich_document(document)
+
+
+@register('update_conversation_memory')
+def update_conversation_memory_job(job: Job):
+    """Fold older chat messages into the conversation's running summary"""
+    from .conversation_memory import update_conversation_memory
+
+    update_conversation_memory(job.payload['conversation_id'])
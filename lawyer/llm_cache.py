@@ -0,0 +1,330 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+from openai.types import CreateEmbeddingResponse, Embedding
+from openai.types.chat import ChatCompletion
+from openai.types.create_embedding_response import Usage
+
+# Request options that change how a call is transported but not what it returns
+TRANSPORT_OPTIONS = {'timeout', 'extra_headers', 'extra_query', 'extra_body', 'user'}
+
+# Set by each CachedOpenAIClient call: True when the whole response was served from the cache
+served_from_cache: ContextVar[bool] = ContextVar('llm_served_from_cache', default=False)
+
+
+def request_key(kind: str, model: str, request: Dict[str, Any]) -> str:
+    """Stable hash of a request: canonical JSON with sorted keys and transport options dropped"""
+    normalized = {key: value for key, value in request.items() if key not in TRANSPORT_OPTIONS and value is not None}
+    payload = json.dumps({'kind': kind, 'model': model, 'request': normalized}, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryTier:
+    """Thread-safe LRU bounded by entry count and total value size"""
+
+    def __init__(self, max_entries: int = 2048, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str, ttl: Optional[float]) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, created_at = entry
+            if ttl and time.time() - created_at > ttl:
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str, created_at: Optional[float] = None):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, created_at or time.time())
+            self._bytes += len(value)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: str):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteTier:
+    """Persistent cache table in its own SQLite file, shared by every process on the host"""
+
+    def __init__(self, path: str, max_entries: int = 100000, max_bytes: int = 512 * 1024 * 1024):
+        self.path = str(path)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._writes_since_prune = 0
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed ON llm_cache (accessed_at)")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str, ttl: Optional[float]) -> Optional[tuple]:
+        connection = self._connection()
+        row = connection.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if ttl and time.time() - row[1] > ttl:
+            connection.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            return None
+        connection.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        return row
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value), now, now)
+        )
+        # Size checks scan the table, so only run them every so often
+        self._writes_since_prune += 1
+        if self._writes_since_prune >= 100:
+            self.prune()
+
+    def prune(self, ttl: Optional[float] = None) -> int:
+        """Drop expired rows, then least recently used rows until under the size bounds"""
+        self._writes_since_prune = 0
+        connection = self._connection()
+        removed = 0
+        if ttl:
+            removed += connection.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - ttl,)).rowcount
+        count, total = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return removed
+        excess_rows = max(0, count - self.max_entries)
+        excess_bytes = max(0, total - self.max_bytes)
+        doomed, freed = [], 0
+        for key, size in connection.execute("SELECT key, size FROM llm_cache ORDER BY accessed_at"):
+            if len(doomed) >= excess_rows and freed >= excess_bytes:
+                break
+            doomed.append((key,))
+            freed += size
+        connection.executemany("DELETE FROM llm_cache WHERE key = ?", doomed)
+        return removed + len(doomed)
+
+    def clear(self):
+        self._connection().execute("DELETE FROM llm_cache")
+
+    def info(self) -> Dict[str, int]:
+        count, total = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        return {'entries': count, 'bytes': total}
+
+
+class ResponseCache:
+    """Two-tier response cache: in-process LRU in front of a persistent SQLite file"""
+
+    def __init__(self, memory: MemoryTier, disk: Optional[SQLiteTier] = None, ttl: Optional[float] = None):
+        self.memory = memory
+        self.disk = disk
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.counters = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'writes': 0, 'bypassed': 0}
+
+    def _count(self, name: str, amount: int = 1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.memory.get(key, self.ttl)
+        if value is not None:
+            self._count('memory_hits')
+            return value
+        if self.disk is not None:
+            row = self.disk.get(key, self.ttl)
+            if row is not None:
+                self.memory.set(key, row[0], created_at=row[1])
+                self._count('disk_hits')
+                return row[0]
+        self._count('misses')
+        return None
+
+    def set(self, key: str, value: str):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+        self._count('writes')
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        counters = dict(self.counters)
+        lookups = counters['memory_hits'] + counters['disk_hits'] + counters['misses']
+        counters['hit_rate'] = round((counters['memory_hits'] + counters['disk_hits']) / lookups, 3) if lookups else None
+        counters['memory_entries'] = len(self.memory)
+        if self.disk is not None:
+            counters['disk'] = self.disk.info()
+        return counters
+
+
+class _Namespace:
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
+
+
+class CachedOpenAIClient:
+    """Drop-in wrapper around ``OpenAI`` that caches chat completions and embeddings.
+
+    Chat completions are cached per normalized request. Embeddings are cached
+    per input string, so a batched request only sends the inputs that missed.
+    Pass ``cache=False`` to a call, or use ``with client.bypass():``, to go
+    straight to the API. Anything else is delegated to the wrapped client.
+    """
+
+    def __init__(self, client, cache: ResponseCache):
+        self._client = client
+        self._cache = cache
+        self._local = threading.local()
+        self.chat = _Namespace(completions=_Namespace(create=self._create_chat_completion))
+        self.embeddings = _Namespace(create=self._create_embeddings)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    @property
+    def cache(self) -> ResponseCache:
+        return self._cache
+
+    @contextmanager
+    def bypass(self):
+        previous = getattr(self._local, 'bypass', False)
+        self._local.bypass = True
+        try:
+            yield self
+        finally:
+            self._local.bypass = previous
+
+    def _bypassed(self, use_cache: bool) -> bool:
+        if not use_cache or getattr(self._local, 'bypass', False):
+            self._cache._count('bypassed')
+            return True
+        return False
+
+    def _create_chat_completion(self, cache: bool = True, **kwargs):
+        served_from_cache.set(False)
+        # Streams and multi-choice sampling are not replayable from a single stored response
+        if self._bypassed(cache) or kwargs.get('stream') or (kwargs.get('n') or 1) > 1:
+            return self._client.chat.completions.create(**kwargs)
+
+        key = request_key('chat', kwargs.get('model'), kwargs)
+        cached = self._cache.get(key)
+        if cached is not None:
+            served_from_cache.set(True)
+            return ChatCompletion.model_validate_json(cached)
+        response = self._client.chat.completions.create(**kwargs)
+        self._cache.set(key, response.model_dump_json())
+        return response
+
+    def _create_embeddings(self, cache: bool = True, **kwargs):
+        served_from_cache.set(False)
+        if self._bypassed(cache) or kwargs.get('encoding_format', 'float') != 'float':
+            return self._client.embeddings.create(**kwargs)
+
+        inputs = kwargs['input']
+        texts: List[str] = [inputs] if isinstance(inputs, str) else list(inputs)
+        if not all(isinstance(text, str) for text in texts):
+            # Token-id inputs are rare; send them as they are
+            return self._client.embeddings.create(**kwargs)
+
+        options = {key: value for key, value in kwargs.items() if key != 'input'}
+        keys = [request_key('embedding', kwargs.get('model'), {**options, 'input': text}) for text in texts]
+        vectors: List[Optional[List[float]]] = []
+        for key in keys:
+            cached = self._cache.get(key)
+            vectors.append(json.loads(cached) if cached is not None else None)
+
+        # Send each distinct missing text once, in a single request
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        usage = Usage(prompt_tokens=0, total_tokens=0)
+        if missing:
+            response = self._client.embeddings.create(**{**options, 'input': missing})
+            usage = response.usage
+            fetched = {missing[item.index]: item.embedding for item in response.data}
+            for position, (text, key) in enumerate(zip(texts, keys)):
+                if vectors[position] is None:
+                    vectors[position] = fetched[text]
+            for text in missing:
+                self._cache.set(keys[texts.index(text)], json.dumps(fetched[text]))
+        else:
+            served_from_cache.set(True)
+
+        return CreateEmbeddingResponse(
+            data=[Embedding(embedding=vector, index=index, object='embedding') for index, vector in enumerate(vectors)],
+            model=kwargs.get('model'),
+            object='list',
+            usage=usage
+        )
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Process-wide response cache configured by ``settings.LLM_CACHE``, or None when disabled"""
+    global _response_cache
+    from django.conf import settings
+
+    options = getattr(settings, 'LLM_CACHE', {})
+    if not options.get('ENABLED', False):
+        return None
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                disk = None
+                if options.get('PATH'):
+                    disk = SQLiteTier(
+                        options['PATH'],
+                        max_entries=options.get('MAX_ENTRIES', 100000),
+                        max_bytes=options.get('MAX_BYTES', 512 * 1024 * 1024)
+                    )
+                _response_cache = ResponseCache(
+                    MemoryTier(
+                        max_entries=options.get('MEMORY_ENTRIES', 2048),
+                        max_bytes=options.get('MEMORY_BYTES', 64 * 1024 * 1024)
+                    ),
+                    disk=disk,
+                    ttl=options.get('TTL_SECONDS')
+                )
+    return _response_cache
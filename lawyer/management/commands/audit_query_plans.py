@@ -0,0 +1,102 @@
+import re
+from typing import Callable, List, Tuple
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from lawyer.dedup import find_by_content_hashes, find_by_file_hashes
+from lawyer.history import get_history_version, get_message_page, get_recent_conversations
+from lawyer.models import BaseDocument, Case, Conversation, Job, Message
+from lawyer.utils import get_case_by_id, get_case_documents, get_user_cases
+
+# "SCAN lawyer_message" reads the whole table; "SCAN t USING INDEX i" walks an index in order
+FULL_SCAN = re.compile(r'^SCAN (\w+)(?! USING)')
+TEMP_SORT = re.compile(r'USE TEMP B-TREE FOR (ORDER BY|GROUP BY|DISTINCT)')
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "EXPLAIN QUERY PLAN the hot queries of the lawyer views and fail on full table scans"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--strict', action='store_true', help="Also fail when a query sorts in a temporary B-tree")
+        parser.add_argument('--verbose-plans', action='store_true', help="Print the plan of every query, not only flagged ones")
+
+    def scenarios(self, user: User) -> List[Tuple[str, Callable]]:
+        """(name, callable) pairs that run the queries each view or helper runs"""
+        document = BaseDocument.objects.bulk_create([BaseDocument(
+            filename='audit.txt', uploaded_by=user, file_sha256='0' * 64, content_sha256='1' * 64
+        )])[0]
+        case = Case.objects.bulk_create([Case(title="Default Case", created_by=user)])[0]
+        conversation = Conversation.objects.bulk_create([Conversation(title='audit', case=case, created_by=user)])[0]
+        Message.objects.bulk_create([
+            Message(conversation=conversation, message_type='user', content=f'audit {i}') for i in range(3)
+        ])
+        cursor = get_message_page(conversation.id, limit=2)['messages'][0]['cursor']
+
+        return [
+            ('views.chat: default case', lambda: Case.objects.filter(title="Default Case", created_by=user).first()),
+            ('views.chat: conversation list', lambda: get_recent_conversations(user)),
+            ('views.chat / get_conversation: newest page', lambda: get_message_page(conversation.id)),
+            ('views.get_conversation: older page', lambda: get_message_page(conversation.id, before=cursor)),
+            ('views.get_conversation: new messages', lambda: get_message_page(conversation.id, after=cursor)),
+            ('views.get_conversation: ETag version', lambda: get_history_version(conversation.id, user)),
+            ('views.send_message: conversation', lambda: Conversation.objects.get(id=conversation.id, created_by=user)),
+            ('views.configure: documents', lambda: list(BaseDocument.objects.filter(uploaded_by=user).order_by('-created_at')[:50])),
+            ('views.document_status: jobs', lambda: list(
+                Job.objects.filter(document_id__in=[document.id]).order_by('created_at').values('document_id', 'status')
+            )),
+            ('utils.get_user_cases', lambda: list(get_user_cases(user))),
+            ('utils.get_user_cases: by status', lambda: list(get_user_cases(user, status='active'))),
+            ('utils.get_case_by_id', lambda: get_case_by_id(case.id, user)),
+            ('utils.get_case_documents', lambda: get_case_documents(case)),
+            ('dedup.find_by_file_hashes', lambda: find_by_file_hashes(['0' * 64])),
+            ('dedup.find_by_content_hashes', lambda: find_by_content_hashes(['1' * 64])),
+        ]
+
+    def explain(self, sql: str) -> List[str]:
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return [row[-1] for row in cursor.fetchall()]
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError(f"EXPLAIN QUERY PLAN auditing needs SQLite, not {connection.vendor}")
+
+        failures, warnings, audited = [], [], 0
+        # Fixture rows only exist inside this transaction
+        try:
+            with transaction.atomic():
+                user = User.objects.create(username='__query_plan_audit__')
+                for name, run in self.scenarios(user):
+                    with CaptureQueriesContext(connection) as captured:
+                        run()
+                    for query in captured.captured_queries:
+                        sql = query['sql']
+                        if not sql.lstrip().upper().startswith('SELECT'):
+                            continue
+                        audited += 1
+                        plan = self.explain(sql)
+                        scans = [match.group(1) for match in map(FULL_SCAN.match, plan) if match]
+                        sorts = [detail for detail in plan if TEMP_SORT.search(detail)]
+                        flagged = bool(scans or sorts)
+                        if scans:
+                            failures.append(f"{name}: full scan of {', '.join(scans)}")
+                        if sorts:
+                            (failures if options['strict'] else warnings).append(f"{name}: {'; '.join(sorts)}")
+                        if flagged or options['verbose_plans']:
+                            self.stdout.write(f"{name}\n  {sql}\n" + "".join(f"    {detail}\n" for detail in plan))
+                raise Rollback()
+        except Rollback:
+            pass
+
+        for warning in warnings:
+            self.stdout.write(self.style.WARNING(f"WARNING {warning}"))
+        for failure in failures:
+            self.stdout.write(self.style.ERROR(f"FAIL {failure}"))
+        if failures:
+            raise CommandError(f"{len(failures)} of {audited} queries need a full scan or sort")
+        self.stdout.write(self.style.SUCCESS(f"Audited {audited} queries: no full table scans"))
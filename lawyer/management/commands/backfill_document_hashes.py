@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from lawyer.models import BaseDocument
+from lawyer.services import sha256_file, sha256_text
+
+
+class Command(BaseCommand):
+    help = "Compute file and content SHA-256 hashes for documents uploaded before deduplication"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help="Rows written per bulk update")
+
+    def handle(self, *args, **options):
+        documents = BaseDocument.objects.filter(
+            Q(file_sha256__isnull=True) | Q(content_sha256__isnull=True, contents__isnull=False)
+        ).only('id', 'file', 'contents', 'file_sha256', 'content_sha256').order_by('id')
+
+        batch = []
+        updated = missing_files = 0
+        for document in documents.iterator(chunk_size=options['batch_size']):
+            if not document.file_sha256 and document.file:
+                try:
+                    document.file_sha256 = sha256_file(document.file)
+                except (FileNotFoundError, OSError):
+                    missing_files += 1
+            if document.contents:
+                document.content_sha256 = sha256_text(document.contents)
+            batch.append(document)
+            if len(batch) >= options['batch_size']:
+                updated += BaseDocument.objects.bulk_update(batch, ['file_sha256', 'content_sha256'])
+                batch = []
+        if batch:
+            updated += BaseDocument.objects.bulk_update(batch, ['file_sha256', 'content_sha256'])
+
+        distinct_hashes = BaseDocument.objects.filter(file_sha256__isnull=False).values('file_sha256').distinct().count()
+        total = BaseDocument.objects.filter(file_sha256__isnull=False).count()
+        self.stdout.write(self.style.SUCCESS(
+            f"Hashed {updated} documents ({missing_files} with missing files); "
+            f"{total - distinct_hashes} of {total} hashed files duplicate another upload"
+        ))
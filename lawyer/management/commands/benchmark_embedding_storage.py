@@ -0,0 +1,55 @@
+import json
+import time
+import numpy as np
+from django.core.management.base import BaseCommand
+from lawyer.fields import DTYPE_CODES, decode_vector, encode_vector
+from lawyer.models import BaseDocument
+
+
+class Command(BaseCommand):
+    help = "Compare row size, decode time and accuracy of JSON embeddings against packed vector storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=2000, help="Number of vectors to benchmark")
+        parser.add_argument('--dimension', type=int, default=1536, help="Dimension of synthetic vectors")
+        parser.add_argument('--synthetic', action='store_true', help="Use random vectors even if documents have embeddings")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        vectors = []
+        if not options['synthetic']:
+            rows = BaseDocument.objects.exclude(embeddings__isnull=True).values_list('embeddings', flat=True)
+            vectors = [np.asarray(vector, dtype=np.float32) for vector in rows[:options['count']]]
+        source = "stored document embeddings"
+        if not vectors:
+            rng = np.random.default_rng(options['seed'])
+            vectors = list(rng.normal(size=(options['count'], options['dimension'])).astype(np.float32))
+            source = "synthetic vectors"
+        self.stdout.write(f"{len(vectors)} {source} of dimension {vectors[0].shape[0]}")
+
+        # The old layout: JSON text of Python floats
+        payloads = [json.dumps(vector.tolist()) for vector in vectors]
+        started = time.perf_counter()
+        for payload in payloads:
+            np.asarray(json.loads(payload), dtype=np.float32)
+        json_seconds = time.perf_counter() - started
+
+        self.stdout.write(f"{'layout':>8} {'bytes/row':>10} {'decode us':>10} {'speedup':>8} {'max err':>9} {'min cos':>8}")
+        self._report('json', np.mean([len(payload.encode('utf-8')) for payload in payloads]), json_seconds, json_seconds, 0.0, 1.0, len(vectors))
+
+        for dtype in DTYPE_CODES:
+            encoded = [encode_vector(vector, dtype) for vector in vectors]
+            started = time.perf_counter()
+            decoded = [decode_vector(data) for data in encoded]
+            seconds = time.perf_counter() - started
+            errors = [float(np.max(np.abs(original - restored))) for original, restored in zip(vectors, decoded)]
+            cosines = [
+                float(original @ restored / (np.linalg.norm(original) * np.linalg.norm(restored)))
+                for original, restored in zip(vectors, decoded)
+            ]
+            self._report(dtype, np.mean([len(data) for data in encoded]), seconds, json_seconds, max(errors), min(cosines), len(vectors))
+
+    def _report(self, name, size, seconds, baseline, error, cosine, count):
+        self.stdout.write(
+            f"{name:>8} {size:>10.0f} {1e6 * seconds / count:>10.2f} {baseline / seconds:>7.1f}x {error:>9.5f} {cosine:>8.5f}"
+        )
@@ -0,0 +1,63 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from lawyer.ann import IVFIndex, evaluate_recall
+from lawyer.vector_index import load_chunk_embeddings, load_document_embeddings
+
+
+class Command(BaseCommand):
+    help = "Train the IVF coarse quantizer for document or chunk search and report recall@k against the exact scan"
+
+    def add_arguments(self, parser):
+        options = getattr(settings, 'VECTOR_SEARCH', {})
+        parser.add_argument('--nlist', type=int, default=options.get('NLIST'), help="Number of inverted lists (default: sqrt of corpus size)")
+        parser.add_argument('--iterations', type=int, default=20, help="k-means iterations")
+        parser.add_argument('--sample', type=int, default=50000, help="Vectors sampled for training")
+        parser.add_argument('--chunks', action='store_true', help="Train the chunk index instead of the document index")
+        parser.add_argument('--output', help="Where to write the centroids (default: VECTOR_SEARCH['INDEX_PATH'] or ['CHUNK_INDEX_PATH'])")
+        parser.add_argument('--evaluate', type=int, default=100, help="Number of sample queries for the recall report (0 to skip)")
+        parser.add_argument('--k', type=int, default=10, help="k for recall@k")
+        parser.add_argument('--nprobe', default=str(options.get('NPROBE', 8)), help="Comma separated nprobe values to evaluate")
+        parser.add_argument('--rerank', type=int, default=options.get('RERANK', 100), help="Candidates re-scored exactly")
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        search = getattr(settings, 'VECTOR_SEARCH', {})
+        options['output'] = options['output'] or search.get('CHUNK_INDEX_PATH' if options['chunks'] else 'INDEX_PATH')
+        if not options['output']:
+            raise CommandError("No output path: set VECTOR_SEARCH['INDEX_PATH'] or pass --output")
+
+        # Train from the database, ignoring any centroids already on disk
+        index = IVFIndex()
+        (load_chunk_embeddings if options['chunks'] else load_document_embeddings)(index)
+        if len(index) == 0:
+            raise CommandError(f"No {'chunk' if options['chunks'] else 'document'} embeddings to index")
+        self.stdout.write(f"Loaded {len(index)} vectors of dimension {index.dimension}")
+
+        centroids = index.train(
+            nlist=options['nlist'],
+            iterations=options['iterations'],
+            sample_size=options['sample'],
+            seed=options['seed']
+        )
+        index.save_centroids(options['output'])
+        sizes = np.array([len(members) for members in index._lists])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {centroids.shape[0]} centroids to {options['output']} "
+            f"(list sizes min={sizes.min()} median={int(np.median(sizes))} max={sizes.max()})"
+        ))
+
+        if options['evaluate'] <= 0:
+            return
+        rng = np.random.default_rng(options['seed'])
+        _, matrix = index.vectors()
+        picks = rng.choice(matrix.shape[0], size=min(options['evaluate'], matrix.shape[0]), replace=False)
+        # Perturb stored vectors so queries are not trivially their own nearest neighbour
+        queries = matrix[picks] + rng.normal(scale=0.05, size=(picks.size, matrix.shape[1])).astype(np.float32)
+
+        self.stdout.write(f"{'nprobe':>8} {'recall@' + str(options['k']):>10} {'exact ms':>10} {'ivf ms':>10}")
+        for nprobe in [int(value) for value in options['nprobe'].split(',') if value.strip()]:
+            report = evaluate_recall(index, queries, k=options['k'], nprobe=nprobe, rerank=options['rerank'])
+            self.stdout.write(
+                f"{nprobe:>8} {report['recall']:>10.3f} {report['exact_ms']:>10.2f} {report['approximate_ms']:>10.2f}"
+            )
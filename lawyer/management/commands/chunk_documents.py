@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from lawyer.chunking import chunk_documents
+from lawyer.models import BaseDocument
+
+
+class Command(BaseCommand):
+    help = "Split document contents into overlapping chunks and embed any chunk text not seen before"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help="Re-chunk every document, not only those without chunks")
+        parser.add_argument('--batch-size', type=int, default=20, help="Documents chunked per embedding pass")
+
+    def handle(self, *args, **options):
+        documents = BaseDocument.objects.filter(contents__isnull=False).exclude(contents='').order_by('id')
+        if not options['all']:
+            documents = documents.filter(chunks__isnull=True)
+
+        totals = {'documents': 0, 'chunks': 0, 'reused': 0, 'embedded': 0, 'api_calls': 0}
+        batch = []
+        for document in documents.iterator(chunk_size=options['batch_size']):
+            batch.append(document)
+            if len(batch) >= options['batch_size']:
+                for key, value in chunk_documents(batch).items():
+                    totals[key] += value
+                batch = []
+        if batch:
+            for key, value in chunk_documents(batch).items():
+                totals[key] += value
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Chunked {totals['documents']} documents into {totals['chunks']} chunks: "
+            f"{totals['embedded']} embedded in {totals['api_calls']} requests, {totals['reused']} reused"
+        ))
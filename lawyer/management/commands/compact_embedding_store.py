@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from lawyer.mmap_store import MmapEmbeddingIndex
+from lawyer.models import BaseDocument, DocumentChunk
+from lawyer.vector_index import load_chunk_embeddings, load_document_embeddings
+
+
+class Command(BaseCommand):
+    help = "Drop tombstoned and deleted-document vectors from the memory-mapped embedding store"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunks', action='store_true', help="Compact the chunk store instead of the document store")
+        parser.add_argument('--rebuild', action='store_true', help="Rewrite the store from the database instead of compacting it")
+        parser.add_argument('--path', help="Store directory (default: VECTOR_SEARCH['STORE_PATH'] or ['CHUNK_STORE_PATH'])")
+
+    def handle(self, *args, **options):
+        search = getattr(settings, 'VECTOR_SEARCH', {})
+        path = options['path'] or search.get('CHUNK_STORE_PATH' if options['chunks'] else 'STORE_PATH')
+        if not path:
+            raise CommandError("No store path: set VECTOR_SEARCH['STORE_PATH'] or pass --path")
+        store = MmapEmbeddingIndex(path)
+
+        if options['rebuild']:
+            (load_chunk_embeddings if options['chunks'] else load_document_embeddings)(store)
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {path} with {len(store)} vectors"))
+            return
+
+        # Vectors whose row is gone from the database are dropped along with tombstones
+        model = DocumentChunk if options['chunks'] else BaseDocument
+        keep_ids = set(model.objects.exclude(embeddings__isnull=True).values_list('id', flat=True).iterator(chunk_size=5000))
+        report = store.compact(keep_ids=keep_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {path}: {report['rows_before']} -> {report['rows_after']} rows, "
+            f"{report['bytes_before']} -> {report['bytes_after']} bytes"
+        ))
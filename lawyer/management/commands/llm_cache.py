@@ -0,0 +1,24 @@
+import json
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from lawyer.llm_cache import get_response_cache
+
+
+class Command(BaseCommand):
+    help = "Inspect, prune or clear the persistent OpenAI response cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['stats', 'prune', 'clear'])
+
+    def handle(self, *args, **options):
+        cache = get_response_cache()
+        if cache is None or cache.disk is None:
+            raise CommandError("The response cache is disabled or has no persistent tier (see settings.LLM_CACHE)")
+
+        if options['action'] == 'prune':
+            removed = cache.disk.prune(ttl=settings.LLM_CACHE.get('TTL_SECONDS'))
+            self.stdout.write(self.style.SUCCESS(f"Removed {removed} cache entries"))
+        elif options['action'] == 'clear':
+            cache.clear()
+            self.stdout.write(self.style.SUCCESS("Cleared the response cache"))
+        self.stdout.write(json.dumps(cache.disk.info(), indent=2))
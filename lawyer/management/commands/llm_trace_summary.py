@@ -0,0 +1,81 @@
+import json
+from datetime import timedelta
+from typing import Any, Dict, List
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from lawyer.models import Message
+from lawyer.tracing import TRACE_KEY, summarize_calls
+
+
+class Command(BaseCommand):
+    help = "p50/p95 latency and token burn of traced LLM calls per agent, per tool and per conversation"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=float, default=7, help="Only messages from the last N days (default: 7)")
+        parser.add_argument('--conversation', type=int, help="Only this conversation")
+        parser.add_argument('--top', type=int, default=10, help="Conversations to list, slowest first (default: 10)")
+        parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+
+    def table(self, title: str, summary: Dict[str, Dict[str, Any]], columns: List[str]):
+        self.stdout.write(self.style.MIGRATE_HEADING(title))
+        if not summary:
+            self.stdout.write("  (none)")
+            return
+        width = max(len(name) for name in summary) + 2
+        self.stdout.write("  " + " " * width + "".join(f"{column:>18}" for column in columns))
+        for name, row in summary.items():
+            values = "".join(f"{'-' if row.get(column) is None else row[column]:>18}" for column in columns)
+            self.stdout.write(f"  {name:<{width}}{values}")
+
+    def handle(self, *args, **options):
+        messages = Message.objects.filter(created_at__gte=timezone.now() - timedelta(days=options['days']))
+        if options['conversation']:
+            messages = messages.filter(conversation_id=options['conversation'])
+
+        calls, tool_calls = [], []
+        by_conversation: Dict[int, List[Dict[str, Any]]] = {}
+        rows = messages.exclude(metadata__isnull=True).values_list('conversation_id', 'metadata')
+        for conversation_id, metadata in rows.iterator(chunk_size=2000):
+            traced = metadata.get(TRACE_KEY) or []
+            calls.extend(traced)
+            by_conversation.setdefault(conversation_id, []).extend(traced)
+            tool_calls.extend(metadata.get('tool_timings') or [])
+        if not calls and not tool_calls:
+            raise CommandError("No traced LLM calls or tool calls in the selected messages")
+
+        # Tokens and OpenAI time spent inside tools were traced under "tool:<name>"
+        tool_llm = summarize_calls([call for call in calls if str(call.get('agent', '')).startswith('tool:')])
+        tools = summarize_calls(tool_calls, key='name')
+        for name, row in tools.items():
+            llm = tool_llm.get(f"tool:{name}", {})
+            row['llm_calls'] = llm.get('calls', 0)
+            row['tokens'] = llm.get('prompt_tokens', 0) + llm.get('completion_tokens', 0)
+
+        conversations = {}
+        for conversation_id, traced in by_conversation.items():
+            if not traced:
+                continue
+            conversations[str(conversation_id)] = {
+                'calls': len(traced),
+                'total_ms': round(sum(call['ms'] for call in traced), 2),
+                'prompt_tokens': sum(call.get('prompt_tokens', 0) for call in traced),
+                'completion_tokens': sum(call.get('completion_tokens', 0) for call in traced),
+            }
+        slowest = dict(sorted(conversations.items(), key=lambda item: -item[1]['total_ms'])[:options['top']])
+
+        summary = {
+            'agents': summarize_calls(calls),
+            'models': summarize_calls(calls, key='model'),
+            'tools': tools,
+            'conversations': slowest,
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+
+        llm_columns = ['calls', 'cached', 'errors', 'retries', 'p50_ms', 'p95_ms', 'prompt_tokens', 'completion_tokens']
+        self.table("LLM calls by agent", summary['agents'], llm_columns)
+        self.table("LLM calls by model", summary['models'], llm_columns)
+        self.table("Tool calls", summary['tools'], ['calls', 'errors', 'p50_ms', 'p95_ms', 'llm_calls', 'tokens'])
+        self.table("Slowest conversations (LLM time)", summary['conversations'],
+                   ['calls', 'total_ms', 'prompt_tokens', 'completion_tokens'])
@@ -0,0 +1,233 @@
+import json
+import random
+import threading
+import time
+from typing import Any, Dict, List, Tuple
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from lawyer.models import Case, Conversation
+
+USERNAME_PREFIX = 'loadtest-'
+SCENARIOS = ('send', 'search', 'upload', 'chat')
+SEARCH_TERMS = ['contract breach', 'notice period', 'liability clause', 'damages', 'jurisdiction']
+
+
+def _text_pdf(text: str) -> bytes:
+    """A one-page PDF showing ``text``, small enough to generate per request"""
+    escaped = text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+    stream = f"BT /F1 12 Tf 72 720 Td ({escaped}) Tj ET".encode('latin-1', errors='replace')
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+        b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+        b"/Resources << /Font << /F1 5 0 R >> >> >>",
+        b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    pdf = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return pdf
+
+
+def _is_locked(text: str) -> bool:
+    return 'database is locked' in text or 'database table is locked' in text
+
+
+class Command(BaseCommand):
+    help = ("Drive the chat, search, upload and chat page endpoints concurrently as logged-in users "
+            "and report throughput, latency percentiles and database lock errors")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mix', default='send=1,search=3,upload=1,chat=1',
+                            help="Relative weight of each scenario (default: send=1,search=3,upload=1,chat=1)")
+        parser.add_argument('--users', type=int, default=4, help="Synthetic users to log in as (default: 4)")
+        parser.add_argument('--concurrency', type=int, default=4, help="Concurrent clients (default: 4)")
+        parser.add_argument('--requests', type=int, default=100, help="Total requests to send (default: 100)")
+        parser.add_argument('--duration', type=float, default=None, help="Run for this many seconds instead of --requests")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for the scenario order")
+        parser.add_argument('--cleanup', action='store_true', help="Delete the synthetic users and their data afterwards")
+        parser.add_argument('--allow-real-api', action='store_true',
+                            help="Run even though OPENAI_BASE_URL is unset and requests would reach OpenAI")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+
+    def parse_mix(self, mix: str) -> Dict[str, float]:
+        weights = {}
+        for part in mix.split(','):
+            name, _, weight = part.partition('=')
+            name = name.strip()
+            if name not in SCENARIOS:
+                raise CommandError(f"Unknown scenario '{name}'; choose from {', '.join(SCENARIOS)}")
+            try:
+                weights[name] = float(weight or 1)
+            except ValueError:
+                raise CommandError(f"Weight of '{name}' is not a number: {weight}")
+        if not any(weights.values()):
+            raise CommandError("--mix needs at least one scenario with a positive weight")
+        return weights
+
+    def setup_users(self, count: int) -> List[Tuple[User, Conversation]]:
+        """Synthetic users, each with a Default Case and a conversation to chat in"""
+        accounts = []
+        for index in range(count):
+            user, _ = User.objects.get_or_create(username=f"{USERNAME_PREFIX}{index}")
+            case, _ = Case.objects.get_or_create(title="Default Case", created_by=user)
+            conversation = Conversation.objects.create(title=f"Load test {index}", case=case, created_by=user)
+            accounts.append((user, conversation))
+        return accounts
+
+    def request(self, client: Client, scenario: str, conversation: Conversation, rng: random.Random, sequence: int):
+        if scenario == 'send':
+            return client.post('/chat/send/', data=json.dumps({
+                'conversation_id': conversation.id,
+                'message': f"What does the {rng.choice(SEARCH_TERMS)} mean for my case? ({sequence})",
+            }), content_type='application/json')
+        if scenario == 'search':
+            return client.get('/search/', {'q': rng.choice(SEARCH_TERMS)})
+        if scenario == 'upload':
+            # Only PDFs are ingested; the sequence number keeps uploads within a run from being deduplicated
+            text = f"Load test document {sequence}. The {rng.choice(SEARCH_TERMS)} applies to both parties."
+            upload = SimpleUploadedFile(f"loadtest-{sequence}.pdf", _text_pdf(text), content_type='application/pdf')
+            return client.post('/upload/', {'files[]': [upload]})
+        return client.get('/chat/')
+
+    def rejected_files(self, response) -> List[Dict[str, Any]]:
+        """Per-file errors of an upload, which answers 200 even when it ingested nothing"""
+        if response.get('Content-Type', '').startswith('application/json'):
+            try:
+                return response.json().get('errors') or []
+            except ValueError:
+                return []
+        return []
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'OPENAI_BASE_URL', None) and not options['allow_real_api']:
+            raise CommandError("OPENAI_BASE_URL is not set, so the load would hit the real OpenAI API. "
+                               "Start `manage.py openai_stub` and set OPENAI_BASE_URL, or pass --allow-real-api")
+        if options['users'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--users and --concurrency must be at least 1")
+        weights = self.parse_mix(options['mix'])
+        scenarios, scenario_weights = list(weights), list(weights.values())
+
+        # django.test.Client talks to the app as "testserver"
+        if 'testserver' not in settings.ALLOWED_HOSTS and '*' not in settings.ALLOWED_HOSTS:
+            settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'testserver']
+
+        accounts = self.setup_users(options['users'])
+        results: List[Dict[str, Any]] = []
+        lock = threading.Lock()
+        issued = [0]
+        deadline = time.perf_counter() + options['duration'] if options['duration'] else None
+
+        def next_sequence():
+            with lock:
+                if deadline is None and issued[0] >= options['requests']:
+                    return None
+                issued[0] += 1
+                return issued[0]
+
+        def worker(index: int):
+            user, conversation = accounts[index % len(accounts)]
+            client = Client(raise_request_exception=False)
+            client.force_login(user)
+            rng = random.Random(options['seed'] + index)
+            try:
+                while deadline is None or time.perf_counter() < deadline:
+                    sequence = next_sequence()
+                    if sequence is None:
+                        break
+                    scenario = rng.choices(scenarios, scenario_weights)[0]
+                    started = time.perf_counter()
+                    try:
+                        response = self.request(client, scenario, conversation, rng, sequence)
+                        status = response.status_code
+                        exc_info = getattr(response, 'exc_info', None)
+                        detail = str(exc_info[1]) if exc_info else response.content.decode(errors='replace')[:2000]
+                        rejected = status < 400 and bool(self.rejected_files(response))
+                    except Exception as e:
+                        status, detail, rejected = None, str(e), False
+                    elapsed = 1000 * (time.perf_counter() - started)
+                    ok = status is not None and status < 400 and not rejected
+                    with lock:
+                        results.append({
+                            'scenario': scenario,
+                            'ms': elapsed,
+                            'ok': ok,
+                            'locked': not ok and _is_locked(detail),
+                            'status': 'rejected' if rejected else status,
+                        })
+            finally:
+                # Each client thread opened its own connection
+                connections.close_all()
+
+        threads = [threading.Thread(target=worker, args=(index,), name=f"load-test-{index}")
+                   for index in range(options['concurrency'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - started
+
+        report = {
+            'seconds': round(wall, 2),
+            'concurrency': options['concurrency'],
+            'scenarios': {name: self.summarize([r for r in results if r['scenario'] == name], wall)
+                          for name in scenarios if any(r['scenario'] == name for r in results)},
+            'total': self.summarize(results, wall),
+        }
+
+        if options['cleanup']:
+            User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.print_report(report)
+        if report['total']['db_locked']:
+            self.stdout.write(self.style.WARNING(
+                f"{report['total']['db_locked']} requests failed with 'database is locked'"
+            ))
+
+    def summarize(self, results: List[Dict[str, Any]], wall: float) -> Dict[str, Any]:
+        latencies = [r['ms'] for r in results]
+        statuses: Dict[str, int] = {}
+        for r in results:
+            if not r['ok']:
+                statuses[str(r['status'])] = statuses.get(str(r['status']), 0) + 1
+        return {
+            'requests': len(results),
+            'errors': sum(1 for r in results if not r['ok']),
+            'db_locked': sum(1 for r in results if r['locked']),
+            'req_per_s': round(len(results) / wall, 2) if wall else None,
+            'p50_ms': round(float(np.percentile(latencies, 50)), 2) if latencies else None,
+            'p95_ms': round(float(np.percentile(latencies, 95)), 2) if latencies else None,
+            'p99_ms': round(float(np.percentile(latencies, 99)), 2) if latencies else None,
+            'error_statuses': statuses,
+        }
+
+    def print_report(self, report: Dict[str, Any]):
+        columns = ['requests', 'errors', 'db_locked', 'req_per_s', 'p50_ms', 'p95_ms', 'p99_ms']
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f"{report['total']['requests']} requests in {report['seconds']}s with {report['concurrency']} clients"
+        ))
+        rows = dict(report['scenarios'], total=report['total'])
+        width = max(len(name) for name in rows) + 2
+        self.stdout.write("  " + " " * width + "".join(f"{column:>12}" for column in columns))
+        for name, row in rows.items():
+            values = "".join(f"{'-' if row[column] is None else row[column]:>12}" for column in columns)
+            self.stdout.write(f"  {name:<{width}}{values}")
+        for name, row in rows.items():
+            if row['error_statuses'] and name != 'total':
+                self.stdout.write(f"  {name} errors by status: {row['error_statuses']}")
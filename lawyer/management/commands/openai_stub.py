@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from lawyer.openai_stub import StubServer, StubState
+
+
+class Command(BaseCommand):
+    help = "Serve a local OpenAI-compatible stand-in with deterministic chat completions, tool calls and embeddings"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help="Interface to bind (default: 127.0.0.1)")
+        parser.add_argument('--port', type=int, default=8765, help="Port to listen on (default: 8765)")
+        parser.add_argument('--latency-ms', type=float, default=0, help="Delay added to every response")
+        parser.add_argument('--jitter-ms', type=float, default=0, help="Random +/- variation of the delay")
+        parser.add_argument('--token-ms', type=float, default=0, help="Delay between streamed chunks")
+        parser.add_argument('--error-rate', type=float, default=0, help="Fraction of requests answered with an error (0-1)")
+        parser.add_argument('--error-statuses', default='429,500', help="Comma-separated statuses for injected errors")
+        parser.add_argument('--dimensions', type=int, default=1536, help="Embedding dimensions (default: 1536)")
+        parser.add_argument('--seed', type=int, default=0, help="Seed for latency jitter and error injection")
+        parser.add_argument('--verbose-requests', action='store_true', help="Log every request")
+
+    def handle(self, *args, **options):
+        if not 0 <= options['error_rate'] <= 1:
+            raise CommandError("--error-rate must be between 0 and 1")
+        try:
+            statuses = tuple(int(status) for status in options['error_statuses'].split(',') if status.strip())
+        except ValueError:
+            raise CommandError("--error-statuses must be comma-separated HTTP status codes")
+
+        state = StubState(
+            latency_ms=options['latency_ms'],
+            jitter_ms=options['jitter_ms'],
+            token_ms=options['token_ms'],
+            error_rate=options['error_rate'],
+            error_statuses=statuses or (500,),
+            dimensions=options['dimensions'],
+            seed=options['seed'],
+        )
+        try:
+            server = StubServer((options['host'], options['port']), state, verbose=options['verbose_requests'])
+        except OSError as e:
+            raise CommandError(f"Cannot listen on {options['host']}:{options['port']}: {e}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"OpenAI stub listening; run the app with OPENAI_BASE_URL=http://{options['host']}:{options['port']}/v1"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+        counts = state.counts
+        self.stdout.write(f"Served {counts['chat']} chat completions and {counts['embeddings']} embedding requests, "
+                          f"injected {counts['errors']} errors")
@@ -0,0 +1,15 @@
+import time
+from django.core.management.base import BaseCommand
+from lawyer.fulltext import get_full_text_backend
+
+
+class Command(BaseCommand):
+    help = "Re-index every document in the configured full-text search backend"
+
+    def handle(self, *args, **options):
+        backend = get_full_text_backend()
+        started = time.perf_counter()
+        indexed = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} documents with the {backend.name} backend in {time.perf_counter() - started:.2f}s"
+        ))
@@ -0,0 +1,48 @@
+import multiprocessing
+from django.core.management.base import BaseCommand
+from django.db import connections
+from lawyer.jobs import default_worker_id, work
+
+
+def _worker(work_options):
+    # Each process opens its own database connection on first use
+    work(worker_id=default_worker_id(), **work_options)
+
+
+class Command(BaseCommand):
+    help = "Run background job workers (document enrichment and other queued work)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=1, help="Number of worker processes")
+        parser.add_argument('--once', action='store_true', help="Exit once the queue is empty instead of polling")
+        parser.add_argument('--max-jobs', type=int, default=None, help="Stop each worker after this many jobs")
+        parser.add_argument('--poll-interval', type=float, default=None, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--lease', type=int, default=None, help="Seconds a claimed job stays leased to its worker")
+
+    def handle(self, *args, **options):
+        work_options = {
+            'once': options['once'],
+            'max_jobs': options['max_jobs'],
+            'poll_interval': options['poll_interval'],
+            'lease_seconds': options['lease'],
+        }
+        if options['processes'] <= 1:
+            processed = work(**work_options)
+            self.stdout.write(self.style.SUCCESS(f"Processed {processed} jobs"))
+            return
+
+        # Never share a parent connection with forked children
+        connections.close_all()
+        processes = [
+            multiprocessing.Process(target=_worker, args=(work_options,))
+            for _ in range(options['processes'])
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(f"Started {len(processes)} workers")
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            for process in processes:
+                process.terminate()
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lawyer', '0003_basedocument_status_flowcase_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basedocument',
+            name='content_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='basedocument',
+            name='file_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lawyer', '0004_basedocument_hashes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basedocument',
+            name='extraction_stats',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
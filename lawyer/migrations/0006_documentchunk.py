@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lawyer', '0005_basedocument_extraction_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('start_char', models.PositiveIntegerField()),
+                ('end_char', models.PositiveIntegerField()),
+                ('text', models.TextField()),
+                ('token_count', models.PositiveIntegerField(default=0)),
+                ('text_sha256', models.CharField(db_index=True, max_length=64)),
+                ('embeddings', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='lawyer.basedocument')),
+            ],
+            options={
+                'ordering': ['document', 'position'],
+                'constraints': [models.UniqueConstraint(fields=('document', 'position'), name='documentchunk_document_position_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Converts JSON float lists in BaseDocument.embeddings and DocumentChunk.embeddings
+# into packed VectorField bytes, in batches, and back again on reverse.
+
+import json
+
+import lawyer.fields
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def _convert(model, source, target, transform):
+    rows = model.objects.exclude(**{f'{source}__isnull': True}).only('id', source).order_by('id')
+    batch = []
+    for row in rows.iterator(chunk_size=BATCH_SIZE):
+        setattr(row, target, transform(getattr(row, source)))
+        batch.append(row)
+        if len(batch) >= BATCH_SIZE:
+            model.objects.bulk_update(batch, [target])
+            batch = []
+    if batch:
+        model.objects.bulk_update(batch, [target])
+
+
+def json_to_vectors(apps, schema_editor):
+    for name in ('BaseDocument', 'DocumentChunk'):
+        model = apps.get_model('lawyer', name)
+        _convert(model, 'embeddings', 'embeddings_vector', lambda value: json.loads(value) if isinstance(value, str) else value)
+
+
+def vectors_to_json(apps, schema_editor):
+    for name in ('BaseDocument', 'DocumentChunk'):
+        model = apps.get_model('lawyer', name)
+        _convert(model, 'embeddings_vector', 'embeddings', lambda value: [float(x) for x in value])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lawyer', '0006_documentchunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='basedocument',
+            name='embeddings_vector',
+            field=lawyer.fields.VectorField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='documentchunk',
+            name='embeddings_vector',
+            field=lawyer.fields.VectorField(blank=True, null=True),
+        ),
+        migrations.RunPython(json_to_vectors, vectors_to_json),
+        migrations.RemoveField(
+            model_name='basedocument',
+            name='embeddings',
+        ),
+        migrations.RemoveField(
+            model_name='documentchunk',
+            name='embeddings',
+        ),
+        migrations.RenameField(
+            model_name='basedocument',
+            old_name='embeddings_vector',
+            new_name='embeddings',
+        ),
+        migrations.RenameField(
+            model_name='documentchunk',
+            old_name='embeddings_vector',
+            new_name='embeddings',
+        ),
+    ]
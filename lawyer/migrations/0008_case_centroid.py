@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:25
+
+import lawyer.fields
+import numpy as np
+from django.db import migrations, models
+
+
+def build_centroids(apps, schema_editor):
+    Case = apps.get_model('lawyer', 'Case')
+    BaseDocument = apps.get_model('lawyer', 'BaseDocument')
+    for case in Case.objects.only('id').iterator():
+        vectors = []
+        for embedding in BaseDocument.objects.filter(cases__id=case.id, embeddings__isnull=False).values_list('embeddings', flat=True):
+            vector = np.asarray(embedding, dtype=np.float32)
+            norm = np.linalg.norm(vector)
+            if norm > 0 and (not vectors or vector.shape == vectors[0].shape):
+                vectors.append(vector / norm)
+        if not vectors:
+            continue
+        total = np.sum(vectors, axis=0)
+        norm = np.linalg.norm(total)
+        if norm == 0:
+            continue
+        Case.objects.filter(id=case.id).update(
+            embedding_sum=total, centroid=total / norm, embedded_document_count=len(vectors)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lawyer', '0007_embeddings_vectorfield'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='case',
+            name='centroid',
+            field=lawyer.fields.VectorField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='case',
+            name='embedded_document_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='case',
+            name='embedding_sum',
+            field=lawyer.fields.VectorField(blank=True, null=True),
+        ),
+        migrations.RunPython(build_centroids, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Full-text index for BaseDocument on SQLite builds with FTS5. Other databases keep
+# using the icontains backend, so the migration does nothing there.
+
+from django.db import migrations
+
+FTS_TABLE = 'lawyer_document_fts'
+
+
+def create_fts_table(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if not cursor.fetchone()[0]:
+            return
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "filename, description, contents, owner_id UNINDEXED, "
+            "tokenize = 'porter unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, filename, description, contents, owner_id) "
+            "SELECT id, filename, COALESCE(description, ''), COALESCE(contents, ''), uploaded_by_id "
+            "FROM lawyer_basedocument"
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lawyer', '0008_case_centroid'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
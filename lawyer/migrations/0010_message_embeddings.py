@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:33
+
+import lawyer.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lawyer', '0009_document_fts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='embeddings',
+            field=lawyer.fields.VectorField(blank=True, null=True),
+        ),
+    ]
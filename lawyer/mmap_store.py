@@ -0,0 +1,289 @@
+import json
+import os
+import shutil
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .vector_index import EmbeddingIndex, normalize_vector
+
+try:
+    import fcntl
+except ImportError:  # Windows: only one process writes in development
+    fcntl = None
+
+# Each row appends one float32 vector, one tombstone byte and one (id, owner_id) int64 pair.
+# The id record is written last, so its file size commits the row: readers map only that many
+# rows, and a writer first truncates every file to that length, dropping the tail of a write
+# that crashed before its id record landed.
+VECTORS_FILE = 'vectors.f32'
+DEAD_FILE = 'dead.u8'
+ROWS_FILE = 'rows.i64'
+META_FILE = 'meta.json'
+CURRENT_FILE = 'CURRENT'
+LOCK_FILE = '.lock'
+ROW_RECORD_SIZE = 16
+
+
+class MmapEmbeddingIndex(EmbeddingIndex):
+    """Embedding index backed by append-only files opened with ``np.memmap``.
+
+    Every worker process maps the same files, so the vectors live once in the
+    page cache instead of once per process, and opening an existing store
+    costs a few ``stat`` calls. Upserts append a row and tombstone the row it
+    replaces; deletes only set the tombstone. Readers pick up appends from
+    other processes in ``refresh()`` by remapping the grown files.
+
+    ``compact()`` rewrites live rows into a new generation directory and
+    atomically repoints ``CURRENT`` at it; readers switch on their next
+    refresh while their old mapping stays valid.
+    """
+
+    shared = True
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__(**kwargs)
+        self.path = str(path)
+        self._generation: Optional[str] = None
+        self._dimension: Optional[int] = None
+        self._count = 0
+        self._vectors: Optional[np.memmap] = None
+        self._rows: Optional[np.memmap] = None
+        self._dead: Optional[np.memmap] = None
+        os.makedirs(self.path, exist_ok=True)
+        self.refresh()
+
+    # Files and generations
+
+    def _generation_path(self, name: str, generation: Optional[str] = None) -> str:
+        return os.path.join(self.path, generation or self._generation, name)
+
+    def _read_current(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.path, CURRENT_FILE)) as file:
+                return file.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def _write_lock(self):
+        """Serialize writers across threads and, through flock, across processes"""
+        with self._lock:
+            with open(os.path.join(self.path, LOCK_FILE), 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self.refresh()
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _attach(self, generation: str):
+        with open(self._generation_path(META_FILE, generation)) as file:
+            self._dimension = json.load(file).get('dimension')
+        self._generation = generation
+        self._count = 0
+        self._vectors = self._rows = self._dead = None
+        self._positions = {}
+        self._map_rows()
+
+    def _record_sizes(self) -> Dict[str, int]:
+        return {VECTORS_FILE: 4 * self._dimension, DEAD_FILE: 1, ROWS_FILE: ROW_RECORD_SIZE}
+
+    def _map_rows(self):
+        """Map every committed row and index ids appended since the last call"""
+        if not self._dimension:
+            return False
+        count = min(
+            os.path.getsize(self._generation_path(name)) // size
+            for name, size in self._record_sizes().items()
+        )
+        if count == self._count:
+            return False
+        previous = self._count
+        self._vectors = np.memmap(self._generation_path(VECTORS_FILE), dtype='<f4', mode='r', shape=(count, self._dimension))
+        self._rows = np.memmap(self._generation_path(ROWS_FILE), dtype='<i8', mode='r', shape=(count, 2))
+        self._dead = np.memmap(self._generation_path(DEAD_FILE), dtype=np.uint8, mode='r', shape=(count,))
+        # Later rows win, so a re-upserted id points at its newest vector
+        self._positions.update(zip(self._rows[previous:count, 0].tolist(), range(previous, count)))
+        self._count = count
+        return True
+
+    def refresh(self) -> bool:
+        """Follow compactions and pick up rows appended by other processes"""
+        with self._lock:
+            generation = self._read_current()
+            if generation is None:
+                self.loaded = False
+                return False
+            if generation != self._generation:
+                self._attach(generation)
+                self.loaded = True
+                return True
+            return self._map_rows()
+
+    def _write_generation(self, rows: Iterable[Tuple[int, int, Sequence[float]]], dimension: Optional[int] = None) -> Dict[str, int]:
+        """Write rows into a fresh generation directory and make it current"""
+        existing = [name for name in os.listdir(self.path) if name.isdigit()]
+        generation = f"{max((int(name) for name in existing), default=0) + 1:08d}"
+        directory = os.path.join(self.path, generation)
+        os.makedirs(directory)
+        written = 0
+        with open(os.path.join(directory, VECTORS_FILE), 'wb') as vectors, \
+                open(os.path.join(directory, DEAD_FILE), 'wb') as dead, \
+                open(os.path.join(directory, ROWS_FILE), 'wb') as records:
+            for doc_id, owner_id, embedding in rows:
+                vector = normalize_vector(embedding)
+                if vector is None:
+                    continue
+                dimension = dimension or vector.shape[0]
+                if vector.shape[0] != dimension:
+                    print(f"Skipping embedding for document {doc_id}: dimension {vector.shape[0]} != {dimension}")
+                    continue
+                vectors.write(vector.astype('<f4').tobytes())
+                dead.write(b'\0')
+                records.write(np.array([doc_id, -1 if owner_id is None else owner_id], dtype='<i8').tobytes())
+                written += 1
+        with open(os.path.join(directory, META_FILE), 'w') as file:
+            json.dump({'dimension': dimension}, file)
+
+        temporary = os.path.join(self.path, f"{CURRENT_FILE}.tmp")
+        with open(temporary, 'w') as file:
+            file.write(generation)
+        os.replace(temporary, os.path.join(self.path, CURRENT_FILE))
+        # Processes still mapping an old generation keep their open files until they refresh
+        for name in existing:
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+        self.refresh()
+        return {'rows': written}
+
+    # EmbeddingIndex interface
+
+    def __len__(self) -> int:
+        if self._dead is None:
+            return 0
+        return int(self._count - np.count_nonzero(self._dead))
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self._dimension
+
+    def load(self, rows: Iterable[Tuple[int, int, Sequence[float]]], expected: int = 0):
+        """Replace the store with ``(id, owner_id, embedding)`` rows, as a new generation.
+
+        A first load that finds another process created the store while it
+        waited for the lock uses that store instead of writing another one.
+        """
+        first_load = not self.loaded
+        with self._write_lock():
+            if first_load and self.loaded:
+                return
+            self._write_generation(rows)
+
+    def _truncate_uncommitted(self):
+        """Cut every file back to the committed rows; call with the write lock held"""
+        for name, size in self._record_sizes().items():
+            path = self._generation_path(name)
+            if os.path.getsize(path) != self._count * size:
+                os.truncate(path, self._count * size)
+
+    def _set_dead(self, position: int):
+        # Written through the file so every process's read-only mapping sees it
+        with open(self._generation_path(DEAD_FILE), 'r+b') as file:
+            os.pwrite(file.fileno(), b'\1', position)
+
+    def upsert(self, doc_id: int, owner_id: int, embedding: Optional[Sequence[float]]) -> bool:
+        """Append a new vector for the document and tombstone the one it replaces"""
+        if embedding is None or len(embedding) == 0:
+            return self.remove(doc_id)
+        vector = normalize_vector(embedding)
+        if vector is None:
+            return self.remove(doc_id)
+        with self._write_lock():
+            if self._generation is None:
+                self._write_generation([], dimension=vector.shape[0])
+            if self._dimension is None:
+                with open(self._generation_path(META_FILE), 'w') as file:
+                    json.dump({'dimension': int(vector.shape[0])}, file)
+                self._dimension = int(vector.shape[0])
+            if vector.shape[0] != self._dimension:
+                print(f"Skipping embedding for document {doc_id}: dimension {vector.shape[0]} != {self._dimension}")
+                return False
+            self._truncate_uncommitted()
+            position = self._positions.get(doc_id)
+            if position is not None and not self._dead[position]:
+                self._set_dead(position)
+            with open(self._generation_path(VECTORS_FILE), 'ab') as file:
+                file.write(vector.astype('<f4').tobytes())
+            with open(self._generation_path(DEAD_FILE), 'ab') as file:
+                file.write(b'\0')
+            with open(self._generation_path(ROWS_FILE), 'ab') as file:
+                file.write(np.array([doc_id, -1 if owner_id is None else owner_id], dtype='<i8').tobytes())
+            self._map_rows()
+        return True
+
+    def remove(self, doc_id: int) -> bool:
+        with self._write_lock():
+            position = self._positions.get(doc_id)
+            if position is None or self._dead[position]:
+                return False
+            self._set_dead(position)
+        return True
+
+    def score(self, query: Sequence[float], owner_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        vector = normalize_vector(query)
+        with self._lock:
+            if vector is None or not self._count or vector.shape[0] != self._dimension:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            scores = self._vectors @ vector
+            mask = self._dead == 0
+            if owner_id is not None:
+                mask &= self._rows[:, 1] == owner_id
+            ids = np.asarray(self._rows[:, 0])[mask]
+        return ids, scores[mask]
+
+    def score_ids(self, query: Sequence[float], doc_ids: Sequence[int]) -> Dict[int, float]:
+        vector = normalize_vector(query)
+        with self._lock:
+            if vector is None or not self._count or vector.shape[0] != self._dimension:
+                return {}
+            present = [doc_id for doc_id in doc_ids if doc_id in self._positions and not self._dead[self._positions[doc_id]]]
+            positions = np.fromiter((self._positions[doc_id] for doc_id in present), dtype=np.int64, count=len(present))
+            scores = self._vectors[positions] @ vector
+        return dict(zip(present, scores.tolist()))
+
+    def vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        with self._lock:
+            if not self._count:
+                return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+            mask = self._dead == 0
+            return np.asarray(self._rows[:, 0])[mask], np.asarray(self._vectors)[mask]
+
+    def compact(self, keep_ids: Optional[Set[int]] = None) -> Dict[str, Any]:
+        """Rewrite live rows into a new generation, dropping tombstones and ids not in ``keep_ids``"""
+        with self._write_lock():
+            before = self._count
+            if self._generation is None:
+                return {'rows_before': 0, 'rows_after': 0, 'bytes_before': 0, 'bytes_after': 0}
+            bytes_before = self._disk_bytes()
+            live: List[int] = [
+                position for position in range(self._count)
+                if not self._dead[position]
+                and (keep_ids is None or int(self._rows[position, 0]) in keep_ids)
+            ]
+            rows = ((int(self._rows[position, 0]), int(self._rows[position, 1]), self._vectors[position]) for position in live)
+            self._write_generation(rows, dimension=self._dimension)
+            return {
+                'rows_before': before,
+                'rows_after': self._count,
+                'bytes_before': bytes_before,
+                'bytes_after': self._disk_bytes(),
+            }
+
+    def _disk_bytes(self) -> int:
+        return sum(
+            os.path.getsize(self._generation_path(name))
+            for name in (VECTORS_FILE, DEAD_FILE, ROWS_FILE)
+        )
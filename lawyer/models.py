@@ -1,25 +1,48 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
-from .services import get_openai_client, extract_text_from_pdf
+from .services import get_openai_client, extract_text_from_pdf, summarize_document, embed_texts, sha256_text
+from .fields import VectorField
 import os
 
 class BaseDocument(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed')
+    ]
+
     filename = models.CharField(max_length=255)
     filepath = models.CharField(max_length=1000, blank=True, null=True)
     file = models.FileField(upload_to='documents/', blank=True, null=True)
     resource_link = models.URLField(max_length=1000, blank=True, null=True)
     contents = models.TextField(blank=True, null=True)  # New field for storing document contents
     description = models.TextField(blank=True, null=True)
-    embeddings = models.JSONField(blank=True, null=True)  # Store vector embeddings as JSON
+    embeddings = VectorField(blank=True, null=True)  # Packed vector bytes, read back as a NumPy array
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     uploaded_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='documents')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='ready')  # Enrichment (extraction, summary, embedding) state
+    file_sha256 = models.CharField(max_length=64, blank=True, null=True, db_index=True)  # Hash of the uploaded file bytes
+    content_sha256 = models.CharField(max_length=64, blank=True, null=True, db_index=True)  # Hash of the extracted text
+    extraction_stats = models.JSONField(blank=True, null=True)  # Page counts, budget truncation and per-page timings
 
     def __str__(self):
         return self.filename
 
-    def save(self, *args, **kwargs):
+    def save(self, *args, enrich=True, **kwargs):
+        adding = self._state.adding
+        previous_sha256 = self.content_sha256
+        # Contents streamed straight into the row are saved with update_fields that leave them out
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'contents' in update_fields:
+            self.content_sha256 = sha256_text(self.contents) if self.contents else None
+
+        # Documents saved with enrich=False are left for the background job queue
+        if not enrich:
+            return super().save(*args, **kwargs)
+
         # Try to read and save file contents if a file is present
         if self.file and not self.contents:
             try:
@@ -32,43 +55,75 @@ class BaseDocument(models.Model):
                     file_content = extract_text_from_pdf(self.file)
                 
                 self.contents = file_content
+                self.content_sha256 = sha256_text(file_content) if file_content else None
             except Exception as e:
                 print(f"Error reading file contents: {str(e)}")
 
+        # Reuse the summary and embedding of an already processed copy of the same text
+        if self.contents and (not self.description or self.embeddings is None):
+            duplicate = BaseDocument.objects.filter(
+                content_sha256=self.content_sha256,
+                description__isnull=False,
+                embeddings__isnull=False
+            ).exclude(pk=self.pk).only('description', 'embeddings').first()
+            if duplicate:
+                self.description = duplicate.description
+                self.embeddings = duplicate.embeddings
+
         # Generate description and embeddings using OpenAI if we have contents
-        if self.contents and (not self.description or not self.embeddings):
+        if self.contents and (not self.description or self.embeddings is None):
             try:
                 client = get_openai_client()
                 
                 # Generate description using OpenAI
-                prompt = f"Given the following legal document, summarize in a single to three paragraphs the contents of the document, capture all the necessary aspects, the title is {self.filename} and the content is: {self.contents[:4000]}"  # Limit content length
-                
-                response = client.chat.completions.create(
-                    model="gpt-4o-mini",
-                    messages=[
-                        {"role": "system", "content": "You are a legal document summarizer. Provide concise, accurate summaries capturing key legal aspects."},
-                        {"role": "user", "content": prompt}
-                    ]
-                )
-                
-                self.description = response.choices[0].message.content
+                self.description = summarize_document(client, self.filename, self.contents)
 
                 # Generate embeddings for the description
-                embedding_response = client.embeddings.create(
-                    model="text-embedding-3-small",
-                    input=self.description,
-                    encoding_format="float"
-                )
-                
-                self.embeddings = embedding_response.data[0].embedding
+                self.embeddings = embed_texts(client, [self.description])[0]
 
             except Exception as e:
                 print(f"Error generating description or embeddings: {str(e)}")
 
         super().save(*args, **kwargs)
 
+        # Chunk-level embeddings let search reach past the first pages the description covers.
+        # Rebuilding them deletes every chunk, so only do it when the text changed or none exist yet.
+        if self.contents:
+            from .chunking import chunk_documents, get_chunking_options
+            rechunk = adding or self.content_sha256 != previous_sha256 or not self.chunks.exists()
+            if rechunk and get_chunking_options()['ENABLED']:
+                try:
+                    chunk_documents([self])
+                except Exception as e:
+                    print(f"Error generating chunk embeddings: {str(e)}")
+
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # A user's documents, newest first (configure page)
+            models.Index(fields=['uploaded_by', '-created_at'], name='doc_owner_created_idx'),
+        ]
+
+class DocumentChunk(models.Model):
+    """A token-bounded, overlapping slice of a document's contents with its own embedding"""
+    document = models.ForeignKey(BaseDocument, on_delete=models.CASCADE, related_name='chunks')
+    position = models.PositiveIntegerField()  # Order of the chunk within the document
+    start_char = models.PositiveIntegerField()
+    end_char = models.PositiveIntegerField()
+    text = models.TextField()
+    token_count = models.PositiveIntegerField(default=0)
+    text_sha256 = models.CharField(max_length=64, db_index=True)  # Chunks with identical text share one embedding
+    embeddings = VectorField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.document.filename} #{self.position}"
+
+    class Meta:
+        ordering = ['document', 'position']
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'position'], name='documentchunk_document_position_unique'),
+        ]
 
 class Case(models.Model):
     STATUS_CHOICES = [
@@ -85,12 +140,23 @@ class Case(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     tags = models.JSONField(blank=True, null=True)  # Store case tags as JSON
+    # Maintained from Case.documents by signals; see case_vectors.py
+    embedding_sum = VectorField(blank=True, null=True)  # Sum of the documents' unit embeddings
+    centroid = VectorField(blank=True, null=True)  # embedding_sum normalized to unit length
+    embedded_document_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.title
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # get_user_cases, with and without a status filter
+            models.Index(fields=['created_by', 'status', '-created_at'], name='case_owner_status_created_idx'),
+            models.Index(fields=['created_by', '-created_at'], name='case_owner_created_idx'),
+            # The "Default Case" lookup on every chat page
+            models.Index(fields=['created_by', 'title'], name='case_owner_title_idx'),
+        ]
 
 
 class FlowCase(models.Model):
@@ -130,6 +196,10 @@ class Conversation(models.Model):
 
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # The chat sidebar: a user's conversations, most recently updated first
+            models.Index(fields=['created_by', '-updated_at'], name='conv_owner_updated_idx'),
+        ]
 
 class Message(models.Model):
     MESSAGE_TYPES = [
@@ -143,6 +213,7 @@ class Message(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     metadata = models.JSONField(blank=True, null=True)  # Store additional message metadata as JSON
+    embeddings = VectorField(blank=True, null=True)  # Set when the message is folded into conversation memory
     referenced_documents = models.ManyToManyField(BaseDocument, related_name='referenced_in_messages', blank=True)
 
     def __str__(self):
@@ -150,3 +221,40 @@ class Message(models.Model):
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # Keyset pagination of a conversation's history on (created_at, id)
+            models.Index(fields=['conversation', 'created_at', 'id'], name='message_conv_created_idx'),
+        ]
+
+
+class Job(models.Model):
+    """A unit of background work, leased by `manage.py run_jobs` workers"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('dead', 'Dead')
+    ]
+
+    kind = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict, blank=True)
+    document = models.ForeignKey(BaseDocument, on_delete=models.CASCADE, related_name='jobs', blank=True, null=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    leased_until = models.DateTimeField(blank=True, null=True)
+    worker = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return f"{self.kind} #{self.id} ({self.status})"
+
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_status_run_after_idx'),
+        ]
@@ -0,0 +1,251 @@
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+
+# Words the stub's answers are built from, picked by a hash of the request
+VOCABULARY = (
+    "the contract clause liability party agreement court notice breach term damages evidence claim "
+    "statute obligation remedy plaintiff defendant jurisdiction precedent filing deadline"
+).split()
+
+SELECT_SPEAKER = re.compile(r"select the next role from \[([^\]]*)\]", re.IGNORECASE)
+
+
+def _seed(*parts: Any) -> int:
+    return int(hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:16], 16)
+
+
+def stub_embedding(text: str, dimensions: int) -> List[float]:
+    """Unit vector seeded by the text, so the same text always gets the same embedding"""
+    vector = np.random.default_rng(_seed(text)).normal(size=dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def _count_words(value: Any) -> int:
+    return len(str(value or '').split())
+
+
+def _sentence(seed: int, words: int) -> str:
+    rng = random.Random(seed)
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words)).capitalize() + "."
+
+
+def _request_text(messages: List[Dict[str, Any]]) -> str:
+    """The user's request, without the conversation memory built around it"""
+    for message in messages:
+        if message.get('role') == 'user' and message.get('content'):
+            return str(message['content']).split("Current request:")[-1].strip()
+    return ""
+
+
+def chat_reply(request: Dict[str, Any]) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+    """Deterministic ``(content, tool_calls)`` for a chat completion request.
+
+    Plays the group chat's agents from their system messages: the Planner
+    calls tools once, then hands over to the LegalExpert and the Critic, who
+    approves. Speaker selection prompts get the first listed role; anything
+    else, e.g. summaries, gets a short sentence derived from the prompt.
+    """
+    messages = request.get('messages') or []
+    system = str(messages[0].get('content') or '') if messages and messages[0].get('role') == 'system' else ''
+    seed = _seed(request.get('model'), messages)
+    names = {message.get('name') for message in messages}
+
+    selection = SELECT_SPEAKER.search(str(messages[-1].get('content') or '')) if messages else None
+    if selection:
+        roles = [role.strip(" '\"") for role in selection.group(1).split(',') if role.strip(" '\"")]
+        return (roles[0] if roles else ''), []
+
+    if system.startswith("You are the Planner"):
+        tools = {tool['function']['name'] for tool in request.get('tools') or []}
+        if tools and not any(message.get('role') == 'tool' for message in messages):
+            query = _request_text(messages)[:80]
+            calls = [('search_documents', {'query': query, 'limit': 5}), ('get_cases', {})]
+            return None, [{
+                'id': f"call_{seed % 10 ** 8}_{position}",
+                'type': 'function',
+                'function': {'name': name, 'arguments': json.dumps(arguments)},
+            } for position, (name, arguments) in enumerate(calls) if name in tools]
+        if 'LegalExpert' not in names:
+            return f"{_sentence(seed, 12)} NEXT: LegalExpert", []
+        if 'Critic' not in names:
+            return "Please review the answer. NEXT: Critic", []
+        return "TERMINATE", []
+    if system.startswith("You are the LegalExpert"):
+        return " ".join(_sentence(seed + part, 15) for part in range(4)), []
+    if system.startswith("You are the Critic"):
+        return "APPROVED", []
+    return _sentence(seed, 40), []
+
+
+class StubState:
+    """Settings and counters shared by the stub's request threads"""
+
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, token_ms: float = 0, error_rate: float = 0,
+                 error_statuses: Tuple[int, ...] = (429, 500), dimensions: int = 1536, seed: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.token_ms = token_ms
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses
+        self.dimensions = dimensions
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {'chat': 0, 'streamed': 0, 'embeddings': 0, 'errors': 0}
+
+    def count(self, name: str):
+        with self.lock:
+            self.counts[name] += 1
+
+    def delay(self):
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0
+        time.sleep(max(self.latency_ms + jitter, 0) / 1000)
+
+    def injected_error(self) -> Optional[int]:
+        with self.lock:
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.counts['errors'] += 1
+                return self.random.choice(self.error_statuses)
+        return None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """OpenAI-compatible ``/v1/chat/completions``, ``/v1/embeddings`` and ``/v1/models``"""
+
+    server_version = "OpenAIStub/1.0"
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def state(self) -> StubState:
+        return self.server.state
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status: int):
+        error_type = 'rate_limit_exceeded' if status == 429 else 'server_error'
+        self._send_json(status, {'error': {'message': f"Injected {status} from the OpenAI stub", 'type': error_type, 'code': error_type}},
+                        headers={'Retry-After': '0'} if status == 429 else None)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            models = ['gpt-4o', 'gpt-4o-mini', 'text-embedding-3-small']
+            self._send_json(200, {'object': 'list', 'data': [{'id': model, 'object': 'model', 'owned_by': 'stub'} for model in models]})
+            return
+        self._send_json(404, {'error': {'message': f"Unknown path {self.path}", 'type': 'invalid_request_error'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': {'message': "Body is not JSON", 'type': 'invalid_request_error'}})
+            return
+
+        self.state.delay()
+        status = self.state.injected_error()
+        if status:
+            self._send_error(status)
+            return
+
+        if self.path.rstrip('/').endswith('/chat/completions'):
+            self.state.count('chat')
+            self._chat(request)
+        elif self.path.rstrip('/').endswith('/embeddings'):
+            self.state.count('embeddings')
+            self._embeddings(request)
+        else:
+            self._send_json(404, {'error': {'message': f"Unknown path {self.path}", 'type': 'invalid_request_error'}})
+
+    def _chat(self, request: Dict[str, Any]):
+        content, tool_calls = chat_reply(request)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        model = request.get('model') or 'gpt-4o'
+        finish_reason = 'tool_calls' if tool_calls else 'stop'
+        usage = {
+            'prompt_tokens': sum(_count_words(message.get('content')) for message in request.get('messages') or []),
+            'completion_tokens': _count_words(content) + sum(_count_words(call['function']['arguments']) for call in tool_calls),
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+
+        if not request.get('stream'):
+            message = {'role': 'assistant', 'content': content}
+            if tool_calls:
+                message['tool_calls'] = tool_calls
+            self._send_json(200, {
+                'id': completion_id, 'object': 'chat.completion', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'message': message, 'finish_reason': finish_reason}],
+                'usage': usage,
+            })
+            return
+
+        self.state.count('streamed')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta: Dict[str, Any], finish: Optional[str] = None):
+            body = {
+                'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': model,
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish}],
+            }
+            self.wfile.write(f"data: {json.dumps(body)}\n\n".encode())
+            self.wfile.flush()
+
+        chunk({'role': 'assistant', 'content': '' if content is not None else None})
+        for word in (content or '').split(' ') if content else []:
+            time.sleep(self.state.token_ms / 1000)
+            chunk({'content': word + ' '})
+        for position, call in enumerate(tool_calls):
+            chunk({'tool_calls': [{'index': position, **call}]})
+        chunk({}, finish_reason)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _embeddings(self, request: Dict[str, Any]):
+        inputs = request.get('input')
+        texts = [inputs] if isinstance(inputs, str) else list(inputs or [])
+        dimensions = request.get('dimensions') or self.state.dimensions
+        data = []
+        for index, text in enumerate(texts):
+            vector = stub_embedding(str(text), dimensions)
+            if request.get('encoding_format') == 'base64':
+                vector = base64.b64encode(np.asarray(vector, dtype=np.float32).tobytes()).decode()
+            data.append({'object': 'embedding', 'index': index, 'embedding': vector})
+        tokens = sum(_count_words(text) for text in texts)
+        self._send_json(200, {
+            'object': 'list', 'data': data, 'model': request.get('model') or 'text-embedding-3-small',
+            'usage': {'prompt_tokens': tokens, 'total_tokens': tokens},
+        })
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], state: StubState, verbose: bool = False):
+        super().__init__(address, StubHandler)
+        self.state = state
+        self.verbose = verbose
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import PyPDF2
+
+# Leading characters kept by sinks, enough for the summary prompt
+HEAD_CHARS = 4000
+
+
+def get_extraction_options() -> Dict[str, Any]:
+    options = {
+        'MAX_PAGES': None,
+        'MAX_BYTES': None,
+        'PARALLEL_MIN_PAGES': 200,
+        'PAGES_PER_TASK': 50,
+        'WORKERS': os.cpu_count() or 1,
+        'SPOOL_BYTES': 1024 * 1024,
+    }
+    try:
+        from django.conf import settings
+        options.update(getattr(settings, 'PDF_EXTRACTION', {}))
+    except Exception:
+        # Settings are unavailable in bare worker processes; defaults are fine there
+        pass
+    return options
+
+
+def iter_pdf_pages(source, start: int = 0, stop: Optional[int] = None, reader: Optional[PyPDF2.PdfReader] = None) -> Iterator[Tuple[int, str, float]]:
+    """Yield ``(page_number, text, seconds)`` for each page without holding earlier pages"""
+    reader = reader or PyPDF2.PdfReader(source)
+    stop = len(reader.pages) if stop is None else min(stop, len(reader.pages))
+    for number in range(start, stop):
+        started = time.perf_counter()
+        text = reader.pages[number].extract_text() or ""
+        yield number, text, time.perf_counter() - started
+
+
+def extract_page_range(path: str, start: int, stop: int) -> List[Tuple[int, str, float]]:
+    """Extract one slice of pages; module-level so it can run in a process pool"""
+    return list(iter_pdf_pages(path, start, stop))
+
+
+class TextSink:
+    """Collects extracted text in a spooled temporary file that spills to disk past ``max_memory``.
+
+    Leading and trailing whitespace of the whole text is dropped as it streams
+    through, so the stored text and its hash match ``str.strip()`` of the
+    concatenated pages.
+    """
+
+    def __init__(self, max_memory: int = 1024 * 1024):
+        self._buffer = tempfile.SpooledTemporaryFile(max_size=max_memory, mode='w+', encoding='utf-8')
+        self._hash = hashlib.sha256()
+        self._trailing = ""  # Whitespace held back until more text follows it
+        self.head = ""
+        self.bytes = 0
+
+    def write(self, text: str):
+        if not self.bytes:
+            text = text.lstrip()
+        stripped = text.rstrip()
+        if not stripped:
+            if self.bytes:
+                self._trailing += text
+            return
+        text, self._trailing = self._trailing + stripped, text[len(stripped):]
+        encoded = text.encode('utf-8')
+        self._hash.update(encoded)
+        self.bytes += len(encoded)
+        if len(self.head) < HEAD_CHARS:
+            self.head += text[:HEAD_CHARS - len(self.head)]
+        self._buffer.write(text)
+
+    def close(self):
+        pass
+
+    @property
+    def sha256(self) -> str:
+        return self._hash.hexdigest()
+
+    def getvalue(self) -> str:
+        self._buffer.seek(0)
+        return self._buffer.read()
+
+
+class DocumentContentsSink(TextSink):
+    """Collects extracted text like ``TextSink`` and stores it in ``BaseDocument.contents`` on close.
+
+    The text spools to a temporary file past ``SPOOL_BYTES``, so at most that
+    much is held in memory while pages are read. ``close()`` reads it back
+    once and writes it to the row in a single UPDATE.
+    """
+
+    def __init__(self, document_id: int, spool_bytes: Optional[int] = None):
+        super().__init__(max_memory=spool_bytes or get_extraction_options()['SPOOL_BYTES'])
+        self.document_id = document_id
+
+    def close(self):
+        from .models import BaseDocument
+
+        BaseDocument.objects.filter(id=self.document_id).update(contents=self.getvalue())
+
+
+def extract_pdf(source, sink: TextSink, max_pages: Optional[int] = None, max_bytes: Optional[int] = None,
+                workers: Optional[int] = None) -> Dict[str, Any]:
+    """Stream page text into ``sink`` within a page/byte budget and return per-page timings.
+
+    ``source`` is a path, a file object or raw bytes. Files with at least
+    ``PARALLEL_MIN_PAGES`` pages are split into ranges of ``PAGES_PER_TASK``
+    pages and extracted in a process pool; results are still written in
+    page order.
+    """
+    options = get_extraction_options()
+    max_pages = max_pages if max_pages is not None else options['MAX_PAGES']
+    max_bytes = max_bytes if max_bytes is not None else options['MAX_BYTES']
+    workers = workers or options['WORKERS']
+
+    started = time.perf_counter()
+    temporary_path = None
+    if isinstance(source, (bytes, bytearray)):
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as temporary:
+            temporary.write(source)
+        source = temporary_path = temporary.name
+
+    try:
+        reader = PyPDF2.PdfReader(source)
+        total_pages = len(reader.pages)
+        budget_pages = total_pages if max_pages is None else min(total_pages, max_pages)
+        page_seconds: List[float] = []
+        truncated = budget_pages < total_pages
+
+        if workers > 1 and isinstance(source, str) and budget_pages >= options['PARALLEL_MIN_PAGES']:
+            step = options['PAGES_PER_TASK']
+            ranges = [(start, min(start + step, budget_pages)) for start in range(0, budget_pages, step)]
+            executor = ProcessPoolExecutor(max_workers=min(workers, len(ranges)))
+            try:
+                starts, stops = zip(*ranges)
+                results = executor.map(extract_page_range, repeat(source), starts, stops)
+                pages = (page for batch in results for page in batch)
+                truncated = _consume(pages, sink, page_seconds, max_bytes) or truncated
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            pages = iter_pdf_pages(source, 0, budget_pages, reader=reader)
+            truncated = _consume(pages, sink, page_seconds, max_bytes) or truncated
+        sink.close()
+    finally:
+        if temporary_path:
+            os.unlink(temporary_path)
+
+    slowest = sorted(range(len(page_seconds)), key=lambda page: page_seconds[page], reverse=True)[:10]
+    return {
+        'pages': total_pages,
+        'pages_extracted': len(page_seconds),
+        'bytes': sink.bytes,
+        'truncated': truncated,
+        'seconds': round(time.perf_counter() - started, 4),
+        'slowest_pages': [[page, round(page_seconds[page], 4)] for page in slowest],
+        'page_seconds': [round(seconds, 4) for seconds in page_seconds],
+    }
+
+
+def _consume(pages, sink: TextSink, page_seconds: List[float], max_bytes: Optional[int]) -> bool:
+    """Write pages to the sink in order; returns True if the byte budget cut extraction short"""
+    for number, text, seconds in pages:
+        page_seconds.append(seconds)
+        chunk = text + "\n"
+        if max_bytes is not None and sink.bytes + len(chunk.encode('utf-8')) > max_bytes:
+            remaining = max_bytes - sink.bytes
+            if remaining > 0:
+                sink.write(chunk.encode('utf-8')[:remaining].decode('utf-8', errors='ignore'))
+            return True
+        sink.write(chunk)
+    return False
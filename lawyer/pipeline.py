@@ -0,0 +1,333 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from openai import OpenAI
+from .models import BaseDocument
+from .services import get_openai_client, extract_text, extract_document_text, summarize_document, embed_texts, with_retries, sha256_bytes, sha256_file, sha256_text
+from .pdf_extraction import DocumentContentsSink, extract_pdf
+from .chunking import chunk_documents, get_chunking_options
+from .jobs import enqueue
+from .dedup import API_CALLS_PER_ENRICHMENT, copy_enrichment, find_by_content_hashes, find_by_file_hashes, find_enriched_duplicate, store_file
+
+
+class StageStats:
+    """Item count, error count and wall time for one pipeline stage"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.errors = 0
+        self.api_calls = 0
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def seconds(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.perf_counter()) - self.started
+
+    def as_dict(self) -> Dict[str, Any]:
+        seconds = self.seconds
+        return {
+            'items': self.items,
+            'errors': self.errors,
+            'api_calls': self.api_calls,
+            'seconds': round(seconds, 3),
+            'items_per_second': round(self.items / seconds, 2) if seconds > 0 else None,
+        }
+
+
+class IngestionItem:
+    """A single upload moving through the pipeline"""
+
+    def __init__(self, name: str, data: bytes):
+        self.name = name
+        self.data = data
+        self.file_sha256 = sha256_bytes(data)
+        self.contents = None
+        self.extraction_stats = None
+        self.description = None
+        self.embeddings = None
+        self.document = None
+        self.error = None
+        self.copy_of = None  # Earlier item in the same upload with identical bytes
+        self.deduplicated = False
+
+    @property
+    def enriched(self) -> bool:
+        """Whether the summary and embedding exist, or there is no text to make them from"""
+        return not self.contents or (bool(self.description) and self.embeddings is not None)
+
+    def reuse(self, source: BaseDocument, contents: bool = True):
+        if contents:
+            self.contents = source.contents
+        self.description = source.description
+        self.embeddings = source.embeddings
+        self.deduplicated = True
+
+
+class IngestionPipeline:
+    """Upload processing split into extract, summarize, embed and write stages.
+
+    Text extraction is CPU bound and runs in a process pool. Summaries are
+    requested through a bounded thread pool as soon as each extraction
+    finishes, and descriptions are embedded in batched requests. Transient
+    API errors are retried with exponential backoff. Uploads whose file bytes
+    or extracted text match an already processed document reuse its
+    contents, summary and embedding instead of calling OpenAI again.
+    """
+
+    def __init__(self, user: User, client: Optional[OpenAI] = None, extract_workers: Optional[int] = None,
+                 api_concurrency: Optional[int] = None, embedding_batch_size: Optional[int] = None,
+                 max_retries: Optional[int] = None):
+        options = getattr(settings, 'INGESTION', {})
+        self.user = user
+        self.client = client
+        self.extract_workers = extract_workers or options.get('EXTRACT_WORKERS') or os.cpu_count() or 1
+        self.api_concurrency = api_concurrency or options.get('API_CONCURRENCY', 4)
+        self.embedding_batch_size = embedding_batch_size or options.get('EMBEDDING_BATCH_SIZE', 64)
+        self.max_retries = max_retries or options.get('MAX_RETRIES', 4)
+        self.stats = {name: StageStats(name) for name in ('extract', 'summarize', 'embed', 'write', 'chunk')}
+
+    def _call(self, func, *args):
+        return with_retries(func, *args, attempts=self.max_retries)
+
+    def _extract_and_summarize(self, items: List[IngestionItem]):
+        extract, summarize = self.stats['extract'], self.stats['summarize']
+        extract.start()
+        summarize.start()
+        workers = min(self.extract_workers, len(items))
+
+        with ThreadPoolExecutor(max_workers=self.api_concurrency) as api_pool:
+            summaries = {}
+
+            def on_extracted(item: IngestionItem, result):
+                contents, item.extraction_stats = result
+                item.contents = contents
+                extract.items += 1
+                if not contents:
+                    return
+                content_sha256 = sha256_text(contents)
+                duplicate = find_by_content_hashes([content_sha256]).get(content_sha256)
+                if duplicate:
+                    item.reuse(duplicate, contents=False)
+                    return
+                summaries[api_pool.submit(self._call, summarize_document, self.client, item.name, contents)] = item
+
+            # Small uploads are not worth the cost of starting worker processes
+            if workers <= 1:
+                for item in items:
+                    try:
+                        on_extracted(item, extract_document_text(item.name, item.data))
+                    except Exception as e:
+                        item.error = str(e)
+                        extract.errors += 1
+            else:
+                with ProcessPoolExecutor(max_workers=workers) as process_pool:
+                    futures = {process_pool.submit(extract_document_text, item.name, item.data): item for item in items}
+                    for future in as_completed(futures):
+                        try:
+                            on_extracted(futures[future], future.result())
+                        except Exception as e:
+                            futures[future].error = str(e)
+                            extract.errors += 1
+            extract.stop()
+
+            for future in as_completed(summaries):
+                item = summaries[future]
+                summarize.api_calls += 1
+                try:
+                    item.description = future.result()
+                    summarize.items += 1
+                except Exception as e:
+                    print(f"Error generating description for {item.name}: {str(e)}")
+                    summarize.errors += 1
+        summarize.stop()
+
+    def _embed(self, items: List[IngestionItem]):
+        stage = self.stats['embed']
+        stage.start()
+        pending = [item for item in items if item.description and item.embeddings is None]
+        batches = [pending[i:i + self.embedding_batch_size] for i in range(0, len(pending), self.embedding_batch_size)]
+
+        with ThreadPoolExecutor(max_workers=self.api_concurrency) as api_pool:
+            futures = {
+                api_pool.submit(self._call, embed_texts, self.client, [item.description for item in batch]): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                stage.api_calls += 1
+                try:
+                    for item, embedding in zip(batch, future.result()):
+                        item.embeddings = embedding
+                    stage.items += len(batch)
+                except Exception as e:
+                    print(f"Error generating embeddings: {str(e)}")
+                    stage.errors += len(batch)
+        stage.stop()
+
+    def _write(self, items: List[IngestionItem]):
+        stage = self.stats['write']
+        stage.start()
+        for item in items:
+            if item.error:
+                continue
+            try:
+                with transaction.atomic():
+                    # Contents, description and embeddings are already set; chunks follow in one batched stage
+                    document = BaseDocument(
+                        filename=item.name,
+                        contents=item.contents,
+                        description=item.description,
+                        embeddings=item.embeddings,
+                        extraction_stats=item.extraction_stats,
+                        file_sha256=item.file_sha256,
+                        uploaded_by=self.user
+                    )
+                    store_file(document, item.data, item.file_sha256, item.name)
+                    if not item.enriched:
+                        # The summary or embedding call failed for good; a job retries it
+                        document.status = 'pending'
+                    document.save(enrich=False)
+                    if not item.enriched:
+                        enqueue('enrich_document', {'document_id': document.id}, document=document)
+                item.document = document
+                stage.items += 1
+            except Exception as e:
+                item.error = f"Error processing document {item.name}: {str(e)}"
+                stage.errors += 1
+        stage.stop()
+
+    def _chunk(self, items: List[IngestionItem]):
+        stage = self.stats['chunk']
+        stage.start()
+        # Documents left to an enrichment job are chunked by it
+        documents = [item.document for item in items if item.document is not None and item.contents and item.enriched]
+        if documents and get_chunking_options()['ENABLED']:
+            try:
+                # One pass over the whole upload, so chunk embeddings are batched across files
+                result = chunk_documents(documents, client=self.client, batch_size=self.embedding_batch_size,
+                                         max_retries=self.max_retries)
+                stage.items = result['chunks']
+                stage.api_calls = result['api_calls']
+            except Exception as e:
+                print(f"Error chunking documents: {str(e)}")
+                stage.errors += len(documents)
+        stage.stop()
+
+    def run(self, files: List[Any]) -> Dict[str, Any]:
+        """Process uploaded files and return saved documents, per-file errors and stage stats"""
+        started = time.perf_counter()
+        errors = []
+        items = []
+        for file in files:
+            if not file.name.lower().endswith('.pdf'):
+                errors.append({"file": file.name, "error": "Only PDF files are supported"})
+                continue
+            items.append(IngestionItem(file.name, file.read()))
+
+        # Identical bytes: reuse a stored document, or process the first copy in this upload only
+        known = find_by_file_hashes(item.file_sha256 for item in items)
+        leaders = {}
+        for item in items:
+            if item.file_sha256 in known:
+                item.reuse(known[item.file_sha256])
+            elif item.file_sha256 in leaders:
+                item.copy_of = leaders[item.file_sha256]
+            else:
+                leaders[item.file_sha256] = item
+        to_process = [item for item in items if not item.deduplicated and item.copy_of is None]
+
+        if to_process:
+            if self.client is None:
+                self.client = get_openai_client()
+            self._extract_and_summarize(to_process)
+            self._embed(to_process)
+
+        for item in items:
+            if item.copy_of is not None:
+                leader = item.copy_of
+                item.contents, item.description, item.embeddings = leader.contents, leader.description, leader.embeddings
+                item.error = leader.error
+                item.deduplicated = bool(leader.description)
+        self._write(items)
+        self._chunk(items)
+
+        deduplicated = sum(1 for item in items if item.deduplicated and item.document is not None)
+        errors.extend({"file": item.name, "error": item.error} for item in items if item.error)
+        return {
+            "success": [item.document for item in items if item.document is not None],
+            "errors": errors,
+            "deduplicated": deduplicated,
+            "api_calls_saved": deduplicated * API_CALLS_PER_ENRICHMENT,
+            "stats": {
+                **{name: stage.as_dict() for name, stage in self.stats.items()},
+                "total_seconds": round(time.perf_counter() - started, 3),
+            }
+        }
+
+
+def _pdf_source(file):
+    """Prefer a filesystem path, which lets large PDFs be split across worker processes"""
+    try:
+        return file.path
+    except NotImplementedError:
+        with file.open('rb'):
+            return file.read()
+
+
+def enrich_document(document: BaseDocument, client: Optional[OpenAI] = None, max_retries: Optional[int] = None) -> BaseDocument:
+    """Extract, summarize and embed one stored document, raising if any step fails"""
+    attempts = max_retries or getattr(settings, 'INGESTION', {}).get('MAX_RETRIES', 4)
+    head = None  # Leading text when contents were streamed into the database instead of memory
+    if not document.contents and document.file:
+        document.file_sha256 = document.file_sha256 or sha256_file(document.file)
+        duplicate = find_enriched_duplicate(document)
+        if duplicate:
+            copy_enrichment(duplicate, document)
+        elif document.filename.lower().endswith('.pdf'):
+            sink = DocumentContentsSink(document.id)
+            document.extraction_stats = extract_pdf(_pdf_source(document.file), sink)
+            document.content_sha256 = sink.sha256 if sink.bytes else None
+            head = sink.head
+        else:
+            with document.file.open('rb') as file:
+                document.contents = extract_text(document.filename, file.read())
+
+    text = head if head is not None else document.contents
+    if text and (not document.description or document.embeddings is None):
+        if head is None:
+            document.content_sha256 = sha256_text(document.contents)
+        duplicate = find_enriched_duplicate(document)
+        if duplicate:
+            copy_enrichment(duplicate, document, contents=False)
+
+    if text and (not document.description or document.embeddings is None):
+        client = client or get_openai_client()
+        if not document.description:
+            document.description = with_retries(summarize_document, client, document.filename, text, attempts=attempts)
+        document.embeddings = with_retries(embed_texts, client, [document.description], attempts=attempts)[0]
+
+    if text and get_chunking_options()['ENABLED']:
+        chunk_documents([document], client=client, max_retries=attempts)
+
+    document.status = 'ready'
+    if head is not None:
+        document.save(enrich=False, update_fields=[
+            'file_sha256', 'content_sha256', 'extraction_stats', 'description', 'embeddings', 'status', 'updated_at'
+        ])
+    else:
+        document.save(enrich=False)
+    return document
@@ -1,21 +1,115 @@
+import hashlib
 import os
-from openai import OpenAI
-import PyPDF2
+import random
+import time
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+from django.conf import settings
+from openai import OpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+from .pdf_extraction import TextSink, extract_pdf
+from .llm_cache import CachedOpenAIClient, get_response_cache
+from .tracing import TracedOpenAIClient, get_tracing_options, retry_attempt
 
-def get_openai_client():
-    """Initialize OpenAI client with API key from environment"""
+SUMMARY_MODEL = "gpt-4o-mini"
+EMBEDDING_MODEL = "text-embedding-3-small"
+
+# Errors worth retrying: the request may succeed if sent again later
+RETRYABLE_ERRORS = (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError)
+
+def get_openai_client(cache: bool = True):
+    """Initialize OpenAI client with API key from environment.
+
+    Unless cache=False, the client is wrapped in the response cache configured
+    by settings.LLM_CACHE, so repeated identical requests skip the network.
+    With settings.LLM_TRACING enabled, calls are recorded in the active trace.
+    """
     api_key = os.getenv('OPENAI_API_KEY')
     if not api_key:
         raise ValueError("OpenAI API key not found in environment variables")
-    return OpenAI(api_key=api_key)
+    client = OpenAI(api_key=api_key, base_url=getattr(settings, 'OPENAI_BASE_URL', None))
+    if cache:
+        response_cache = get_response_cache()
+        if response_cache is not None:
+            client = CachedOpenAIClient(client, response_cache)
+    if get_tracing_options()['ENABLED']:
+        client = TracedOpenAIClient(client)
+    return client
+
+def sha256_bytes(data: bytes) -> str:
+    """Hex SHA-256 of raw file bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+def sha256_text(text: str) -> str:
+    """Hex SHA-256 of extracted text, encoded as UTF-8"""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def with_retries(func, *args, attempts: int = 4, base_delay: float = 1.0, **kwargs):
+    """Call func, retrying transient OpenAI errors with exponential backoff and jitter"""
+    for attempt in range(attempts):
+        token = retry_attempt.set(attempt)
+        try:
+            return func(*args, **kwargs)
+        except RETRYABLE_ERRORS:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(base_delay * (2 ** attempt) * (0.5 + random.random()))
+        finally:
+            retry_attempt.reset(token)
+
+def summarize_document(client: OpenAI, filename: str, contents: str) -> str:
+    """Generate a one to three paragraph legal summary of a document"""
+    prompt = f"Given the following legal document, summarize in a single to three paragraphs the contents of the document, capture all the necessary aspects, the title is {filename} and the content is: {contents[:4000]}"  # Limit content length
+    
+    response = client.chat.completions.create(
+        model=SUMMARY_MODEL,
+        messages=[
+            {"role": "system", "content": "You are a legal document summarizer. Provide concise, accurate summaries capturing key legal aspects."},
+            {"role": "user", "content": prompt}
+        ]
+    )
+    return response.choices[0].message.content
+
+def embed_texts(client: OpenAI, texts: List[str]) -> List[List[float]]:
+    """Embed several texts with a single embeddings request, preserving input order"""
+    if not texts:
+        return []
+    response = client.embeddings.create(
+        model=EMBEDDING_MODEL,
+        input=texts,
+        encoding_format="float"
+    )
+    return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
 
 def extract_text_from_pdf(file) -> str:
-    """Extract text content from a PDF file"""
+    """Extract text content from a PDF file, page by page within the configured budget"""
     try:
-        pdf_reader = PyPDF2.PdfReader(file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        return text.strip()
+        sink = TextSink()
+        extract_pdf(file, sink)
+        return sink.getvalue()
     except Exception as e:
-        raise Exception(f"Error extracting text from PDF: {str(e)}") 
\ No newline at end of file
+        raise Exception(f"Error extracting text from PDF: {str(e)}")
+
+def extract_document_text(filename: str, data: bytes) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Extract text and, for PDFs, per-page extraction stats; module-level so it can run in a process pool"""
+    if filename.lower().endswith('.txt'):
+        return data.decode('utf-8'), None
+    if filename.lower().endswith('.pdf'):
+        try:
+            sink = TextSink()
+            stats = extract_pdf(BytesIO(data), sink)
+            return sink.getvalue(), stats
+        except Exception as e:
+            raise Exception(f"Error extracting text from PDF: {str(e)}")
+    return "", None
+
+def extract_text(filename: str, data: bytes) -> str:
+    """Extract text from raw file bytes; module-level so it can run in a process pool"""
+    return extract_document_text(filename, data)[0]
+
+def sha256_file(file) -> str:
+    """Hex SHA-256 of a Django file, read in chunks"""
+    digest = hashlib.sha256()
+    with file.open('rb'):
+        for chunk in file.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,97 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from .fulltext import get_full_text_backend
+from .case_vectors import add_documents_to_centroid, case_ids_for_documents, recompute_case_centroid
+from .models import BaseDocument, Case, DocumentChunk
+from .vector_index import peek_chunk_index, peek_embedding_index
+
+
+@receiver(post_save, sender=BaseDocument)
+def sync_document_embedding(sender, instance, **kwargs):
+    """Keep the in-memory embedding index in step with saved documents"""
+    doc_id, owner_id, embeddings = instance.id, instance.uploaded_by_id, instance.embeddings
+
+    def apply():
+        index = peek_embedding_index()
+        if index is not None:
+            index.upsert(doc_id, owner_id, embeddings)
+
+    transaction.on_commit(apply)
+
+
+@receiver(post_delete, sender=BaseDocument)
+def remove_document_embedding(sender, instance, **kwargs):
+    """Drop deleted documents from the in-memory embedding index"""
+    doc_id = instance.id
+
+    def apply():
+        index = peek_embedding_index()
+        if index is not None:
+            index.remove(doc_id)
+
+    transaction.on_commit(apply)
+
+
+@receiver(post_delete, sender=DocumentChunk)
+def remove_chunk_embedding(sender, instance, **kwargs):
+    """Drop deleted chunks, including those of deleted documents, from the chunk index"""
+    chunk_id = instance.id
+
+    def apply():
+        index = peek_chunk_index()
+        if index is not None:
+            index.remove(chunk_id)
+
+    transaction.on_commit(apply)
+
+
+@receiver(m2m_changed, sender=Case.documents.through)
+def sync_case_centroid(sender, instance, action, reverse, pk_set, **kwargs):
+    """Keep case centroids in step with Case.documents"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        if action == 'post_add':
+            # pk_set only holds documents that were not already linked
+            add_documents_to_centroid(instance.id, pk_set)
+        else:
+            recompute_case_centroid(instance.id)
+        return
+    # document.cases.add/remove/clear: the affected cases are in pk_set, or unknown after a clear
+    for case_id in (pk_set if pk_set is not None else case_ids_for_documents([instance.id])):
+        recompute_case_centroid(case_id)
+
+
+@receiver(pre_delete, sender=BaseDocument)
+def remember_document_cases(sender, instance, **kwargs):
+    # The links are cascaded away without m2m_changed, so note the cases before they go
+    instance._centroid_case_ids = case_ids_for_documents([instance.id])
+
+
+@receiver(post_delete, sender=BaseDocument)
+def update_cases_after_document_delete(sender, instance, **kwargs):
+    for case_id in getattr(instance, '_centroid_case_ids', []):
+        recompute_case_centroid(case_id)
+
+
+@receiver(post_save, sender=BaseDocument)
+def update_cases_after_document_save(sender, instance, created, update_fields=None, **kwargs):
+    """A re-embedded document moves the centroid of every case it belongs to"""
+    if created or (update_fields is not None and 'embeddings' not in update_fields):
+        return
+    for case_id in case_ids_for_documents([instance.id]):
+        recompute_case_centroid(case_id)
+
+
+@receiver(post_save, sender=BaseDocument)
+def sync_document_full_text(sender, instance, **kwargs):
+    """Re-index the saved row; contents streamed in by update() are picked up by the final save"""
+    doc_id = instance.id
+    transaction.on_commit(lambda: get_full_text_backend().index_document(doc_id))
+
+
+@receiver(post_delete, sender=BaseDocument)
+def remove_document_full_text(sender, instance, **kwargs):
+    doc_id = instance.id
+    transaction.on_commit(lambda: get_full_text_backend().remove_document(doc_id))
@@ -0,0 +1,101 @@
+import re
+from typing import Any, Dict, List, Optional, Union
+from autogen import Agent, GroupChat
+from django.conf import settings
+
+# "NEXT: LegalExpert" in a message names the agent that should speak after it
+NEXT_TAG = re.compile(r'\bNEXT:\s*@?(\w+)', re.IGNORECASE)
+
+
+def get_speaker_selection_options() -> Dict[str, Any]:
+    options = {
+        # 'rules' picks speakers from the transition graph; 'auto' asks the LLM every time
+        'MODE': 'rules',
+        # Speaker selection method used when the rules cannot decide
+        'FALLBACK': 'auto',
+        # An agent message with one of these on a line of its own ends the chat
+        'TERMINATION_TAGS': ['TERMINATE', 'APPROVED'],
+    }
+    options.update(getattr(settings, 'SPEAKER_SELECTION', {}))
+    return options
+
+
+class RuleSpeakerSelector:
+    """Picks the next group chat speaker from the transition graph and message tags.
+
+    Used as the group chat's ``speaker_selection_method``. A tool call goes
+    to the agent that executes tools and the tool result back to the caller;
+    a speaker with a single allowed successor hands over to it; otherwise the
+    last message must name exactly one allowed successor with ``NEXT: <name>``.
+    Only when it does not is the choice left to ``fallback``, normally the
+    LLM. An agent message with a termination tag on a line of its own ends
+    the chat at once; "NOT APPROVED" in a sentence does not.
+
+    Counts are kept per chat and cleared with ``reset()``.
+    """
+
+    def __init__(self, executor: Agent, fallback: str = 'auto', termination_tags: Optional[List[str]] = None):
+        self.executor = executor
+        self.fallback = fallback
+        tags = termination_tags or []
+        # The tag alone on a line, optionally with a trailing full stop or exclamation mark
+        pattern = r'^\s*(?:' + '|'.join(map(re.escape, tags)) + r')[.!]?\s*$'
+        self.termination = re.compile(pattern, re.MULTILINE) if tags else None
+        self.reset()
+
+    def reset(self):
+        self.stats = {
+            'rule_selections': 0,
+            # Rule selections among several allowed speakers, each an LLM call 'auto' would have made
+            'llm_calls_avoided': 0,
+            'llm_fallbacks': 0,
+            'terminated_early': False,
+        }
+
+    def _is_termination(self, message: Dict[str, Any], last_speaker: Agent) -> bool:
+        if self.termination is None or last_speaker is self.executor or message.get('tool_calls'):
+            return False
+        return bool(self.termination.search(message.get('content') or ''))
+
+    def _tool_caller(self, groupchat: GroupChat) -> Optional[Agent]:
+        for message in reversed(groupchat.messages[:-1]):
+            if message.get('tool_calls') or message.get('function_call'):
+                return groupchat.agent_by_name(message.get('name'))
+        return None
+
+    def _decided(self, agent: Agent, avoided: bool) -> Agent:
+        self.stats['rule_selections'] += 1
+        if avoided:
+            self.stats['llm_calls_avoided'] += 1
+        return agent
+
+    def __call__(self, last_speaker: Agent, groupchat: GroupChat) -> Union[Agent, str, None]:
+        message = groupchat.messages[-1] if groupchat.messages else {}
+
+        if self._is_termination(message, last_speaker):
+            # None makes autogen end the chat (NoEligibleSpeaker)
+            self.stats['terminated_early'] = True
+            return None
+
+        # With several allowed successors, 'auto' would have asked the LLM
+        candidates = groupchat.allowed_speaker_transitions_dict.get(last_speaker, [])
+        avoided = len(candidates) > 1
+
+        if message.get('tool_calls') or message.get('function_call'):
+            return self._decided(self.executor, avoided=avoided)
+
+        if message.get('tool_responses') or message.get('role') in ('tool', 'function'):
+            caller = self._tool_caller(groupchat)
+            if caller is not None:
+                return self._decided(caller, avoided=avoided)
+
+        if len(candidates) == 1:
+            return self._decided(candidates[0], avoided=False)
+
+        named = {match.lower() for match in NEXT_TAG.findall(message.get('content') or '')}
+        tagged = [agent for agent in candidates if agent.name.lower() in named]
+        if len(tagged) == 1:
+            return self._decided(tagged[0], avoided=True)
+
+        self.stats['llm_fallbacks'] += 1
+        return self.fallback
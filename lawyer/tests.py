@@ -1,3 +1,1426 @@
-from django.test import TestCase
+import contextvars
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO, StringIO
+from types import SimpleNamespace
+from unittest import mock
+import numpy as np
+import PyPDF2
+from autogen import ConversableAgent, GroupChat
+from openai import OpenAI
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from . import hybrid_search, jobs, vector_index
+from .ann import IVFIndex
+from .autogen_setup import AgentPool, get_agent_config, get_agent_pool, get_current_user
+from .case_vectors import rank_cases_by_centroid, recompute_case_centroid
+from .conversation_memory import build_chat_prompt, get_memory_executor, get_memory_state, update_conversation_memory
+from .chat_stream import final_response, save_agent_messages
+from .db_metrics import QueryCounter, count_worker_queries
+from .fields import decode_vector, encode_vector
+from .fulltext import SQLiteFTS5Backend, to_fts_query
+from .history import InvalidCursor, decode_cursor, get_message_page
+from .hybrid_search import reciprocal_rank_fusion, weighted_score_fusion
+from .management.commands.audit_query_plans import Command as AuditQueryPlans
+from .management.commands.load_test import _text_pdf
+from .llm_cache import CachedOpenAIClient, MemoryTier, ResponseCache, SQLiteTier
+from .mmap_store import DEAD_FILE, VECTORS_FILE, MmapEmbeddingIndex
+from .models import BaseDocument, Case, Conversation, Job, Message
+from .openai_stub import StubServer, StubState, stub_embedding
+from .pdf_extraction import DocumentContentsSink, extract_pdf
+from .pipeline import IngestionPipeline
+from .services import sha256_text
+from .speaker_selection import RuleSpeakerSelector
+from .tool_execution import ToolExecutorAgent
+from .tool_memo import ToolMemo, load_tool_memo, memoized_tool, use_tool_memo
+from .tracing import TRACE_KEY, TracedOpenAIClient, current_trace, start_trace, summarize_calls, trace_label
+from .vector_index import EmbeddingIndex, top_k
 
-# Create your tests here.
+# Session and user lookups, then the view's own queries
+CHAT_QUERIES = 8
+CONFIGURE_QUERIES = 3
+
+
+def create_document(user, filename):
+    # enrich=False skips the OpenAI calls made when a document is saved
+    document = BaseDocument(filename=filename, uploaded_by=user, contents=f"Contents of {filename}", description=filename)
+    document.save(enrich=False)
+    return document
+
+
+def use_temporary_media(test):
+    """Store the test's uploads in a temporary MEDIA_ROOT, removed afterwards"""
+    media = tempfile.TemporaryDirectory()
+    test.addCleanup(media.cleanup)
+    media_settings = override_settings(MEDIA_ROOT=media.name)
+    media_settings.enable()
+    test.addCleanup(media_settings.disable)
+
+
+class FakeOpenAI:
+    """Stands in for the ``OpenAI`` client: canned summaries, text-seeded embeddings"""
+
+    def __init__(self, fail_chat: bool = False, dimensions: int = 8):
+        self.fail_chat = fail_chat
+        self.dimensions = dimensions
+        self.calls = {'chat': 0, 'embeddings': 0}
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._chat))
+        self.embeddings = SimpleNamespace(create=self._embeddings)
+
+    def _chat(self, model, messages, **kwargs):
+        self.calls['chat'] += 1
+        if self.fail_chat:
+            raise ValueError("summary model unavailable")
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content="A summary"))])
+
+    def _embeddings(self, model, input, **kwargs):
+        self.calls['embeddings'] += 1
+        texts = [input] if isinstance(input, str) else input
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=index, embedding=stub_embedding(text, self.dimensions)) for index, text in enumerate(texts)
+        ])
+
+
+class PageQueryCountTests(TestCase):
+    """Page renders run a fixed number of queries, however much data the user has"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='lawyer', password='secret')
+        self.client.force_login(self.user)
+        self.case = Case.objects.create(title="Default Case", created_by=self.user)
+        self.conversation = Conversation.objects.create(title="Consultation", case=self.case, created_by=self.user)
+
+    def add_data(self, count):
+        documents = [create_document(self.user, f"document-{i}.txt") for i in range(count)]
+        self.case.documents.add(*documents)
+        for i in range(count):
+            Conversation.objects.create(title=f"Other {i}", case=self.case, created_by=self.user)
+            message = Message.objects.create(conversation=self.conversation, message_type='assistant', content=f"Answer {i}")
+            message.referenced_documents.add(*documents)
+        # Keep self.conversation the most recently updated, so the chat page opens it
+        self.conversation.save()
+
+    def test_chat_query_count_is_constant(self):
+        self.add_data(2)
+        with self.assertNumQueries(CHAT_QUERIES):
+            response = self.client.get(reverse('lawyer:chat'))
+        self.assertContains(response, "document-1.txt")
+
+        self.add_data(10)
+        with self.assertNumQueries(CHAT_QUERIES):
+            self.client.get(reverse('lawyer:chat'))
+
+    def test_configure_query_count_is_constant(self):
+        self.add_data(2)
+        with self.assertNumQueries(CONFIGURE_QUERIES):
+            response = self.client.get(reverse('lawyer:configure'))
+        self.assertContains(response, "document-1.txt")
+
+        self.add_data(10)
+        with self.assertNumQueries(CONFIGURE_QUERIES):
+            self.client.get(reverse('lawyer:configure'))
+
+
+class StubOpenAITestCase(TransactionTestCase):
+    """Runs the OpenAI stand-in from ``manage.py openai_stub`` and points the app at it.
+
+    A TransactionTestCase, as chats run in worker threads on their own connections.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.stub = StubServer(('127.0.0.1', 0), StubState(dimensions=16))
+        threading.Thread(target=cls.stub.serve_forever, daemon=True).start()
+        cls.stub_settings = override_settings(
+            OPENAI_BASE_URL=f"http://127.0.0.1:{cls.stub.server_address[1]}/v1",
+            LLM_CACHE={'ENABLED': False},
+        )
+        cls.stub_settings.enable()
+        # Keep autogen from answering out of, or writing to, its on-disk cache in .cache/
+        config = get_agent_config
+        cls.config_patch = mock.patch('lawyer.autogen_setup.get_agent_config',
+                                      side_effect=lambda: {**config(), 'cache_seed': None})
+        cls.config_patch.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.config_patch.stop()
+        cls.stub_settings.disable()
+        cls.stub.shutdown()
+        cls.stub.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        # Pooled agents hold the client config they were built with
+        get_agent_pool().clear()
+        self.user = User.objects.create_user(username='lawyer', password='secret')
+        self.client.force_login(self.user)
+        self.case = Case.objects.create(title="Default Case", created_by=self.user)
+        self.conversation = Conversation.objects.create(title="Consultation", case=self.case, created_by=self.user)
+
+    def tearDown(self):
+        get_agent_pool().clear()
+        # Let background memory updates finish before the tables are flushed
+        get_memory_executor().submit(lambda: None).result()
+
+
+@override_settings(CHAT_STREAM={'TOKEN_DELTAS': False, 'KEEPALIVE_SECONDS': 1})
+class ChatStreamTests(StubOpenAITestCase):
+    """The SSE endpoint works when Django iterates the response itself, as under WSGI"""
+
+    def post_stream(self, message):
+        response = self.client.post(reverse('lawyer:stream_message'), data=json.dumps({
+            'conversation_id': self.conversation.id,
+            'message': message,
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response).decode()
+
+    def test_stream_runs_chat_to_done(self):
+        body = self.post_stream("What does the notice clause require?")
+        self.assertIn("event: start", body)
+        self.assertIn("event: turn", body)
+        self.assertIn("event: done", body)
+        self.assertNotIn("event: error", body)
+        self.assertTrue(Message.objects.filter(conversation=self.conversation, message_type='assistant').exists())
+
+    def test_failure_outside_chat_sends_error_event(self):
+        with mock.patch('lawyer.chat_stream.start_trace', side_effect=RuntimeError("tracing broke")):
+            body = self.post_stream("Hello")
+        self.assertIn("event: error", body)
+        self.assertIn("tracing broke", body)
+
+    def test_send_message_does_not_stream_completions(self):
+        streamed = self.stub.state.counts['streamed']
+        response = self.client.post(reverse('lawyer:send_message'), data=json.dumps({
+            'conversation_id': self.conversation.id,
+            'message': "What does the notice clause require?",
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.stub.state.counts['streamed'], streamed)
+
+
+class LoadTestCommandTests(StubOpenAITestCase):
+
+    def setUp(self):
+        super().setUp()
+        use_temporary_media(self)
+
+    def test_generated_pdf_is_readable(self):
+        text = PyPDF2.PdfReader(BytesIO(_text_pdf("Load test (1) document"))).pages[0].extract_text()
+        self.assertIn("Load test (1) document", text)
+
+    def test_upload_scenario_ingests_documents(self):
+        out = StringIO()
+        call_command('load_test', '--mix', 'upload=1', '--requests', '3', '--users', '1', '--concurrency', '1',
+                     '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['total']['requests'], 3)
+        self.assertEqual(report['total']['errors'], 0)
+        self.assertEqual(BaseDocument.objects.filter(uploaded_by__username='loadtest-0').count(), 3)
+
+    @override_settings(INGESTION={'MODE': 'queue'})
+    def test_rejected_upload_counts_as_error(self):
+        with mock.patch('lawyer.management.commands.load_test._text_pdf', return_value=b"not a pdf"), \
+                mock.patch('lawyer.views.enqueue_documents',
+                           return_value={'success': [], 'errors': [{'file': 'x.pdf', 'error': 'bad'}],
+                                         'deduplicated': 0, 'api_calls_saved': 0}):
+            out = StringIO()
+            call_command('load_test', '--mix', 'upload=1', '--requests', '2', '--users', '1', '--concurrency', '1',
+                         '--json', stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['total']['errors'], 2)
+        self.assertEqual(report['scenarios']['upload']['error_statuses'], {'rejected': 2})
+
+
+class IngestionPipelineTests(TestCase):
+
+    def setUp(self):
+        use_temporary_media(self)
+        self.user = User.objects.create_user(username='lawyer', password='secret')
+
+    def ingest(self, client, name="lease.pdf"):
+        upload = SimpleUploadedFile(name, _text_pdf(f"The tenant must give notice ({name})"), content_type='application/pdf')
+        return IngestionPipeline(self.user, client=client, extract_workers=1, max_retries=1).run([upload])
+
+    def test_enriched_document_is_ready(self):
+        result = self.ingest(FakeOpenAI())
+        document = result['success'][0]
+        self.assertEqual(result['errors'], [])
+        self.assertEqual(document.status, 'ready')
+        self.assertEqual(document.description, "A summary")
+        self.assertFalse(Job.objects.filter(document=document).exists())
+
+    def test_failed_summary_is_left_to_an_enrichment_job(self):
+        result = self.ingest(FakeOpenAI(fail_chat=True))
+        document = BaseDocument.objects.get(id=result['success'][0].id)
+        self.assertEqual(document.status, 'pending')
+        self.assertIsNone(document.embeddings)
+        self.assertTrue(Job.objects.filter(kind='enrich_document', document=document, status='pending').exists())
+        self.assertFalse(document.chunks.exists())
+
+
+class FullTextQueryTests(TestCase):
+    """User input always becomes a valid FTS5 expression"""
+
+    def test_terms_phrases_and_prefixes(self):
+        self.assertEqual(to_fts_query('notice "break clause" tenan* s.12(3)'),
+                         '"notice" "break clause" "tenan"* "s.12(3)"')
+
+    def test_operators_between_terms_are_kept(self):
+        self.assertEqual(to_fts_query('lease AND notice OR tenant NOT landlord'),
+                         '"lease" AND "notice" OR "tenant" NOT "landlord"')
+
+    def test_consecutive_operators_collapse_to_the_first(self):
+        self.assertEqual(to_fts_query('a AND OR b'), '"a" AND "b"')
+        self.assertEqual(to_fts_query('a OR AND AND b'), '"a" OR "b"')
+
+    def test_not_after_an_operator_is_a_word(self):
+        self.assertEqual(to_fts_query('a OR NOT b'), '"a" OR "NOT" "b"')
+        self.assertEqual(to_fts_query('a NOT NOT b'), '"a" NOT "NOT" "b"')
+
+    def test_leading_and_trailing_operators(self):
+        self.assertEqual(to_fts_query('NOT a'), '"NOT" "a"')
+        self.assertEqual(to_fts_query('a AND'), '"a"')
+        self.assertEqual(to_fts_query('a OR NOT'), '"a" OR "NOT"')
+        self.assertEqual(to_fts_query('* "" AND'), '"AND"')
+
+
+class SQLiteFTS5BackendTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        if not SQLiteFTS5Backend.is_supported():
+            return
+        cls.user = User.objects.create_user(username='lawyer', password='secret')
+        cls.lease = create_document(cls.user, "lease.txt")
+        cls.backend = SQLiteFTS5Backend()
+        cls.backend.index_document(cls.lease.id)
+
+    def setUp(self):
+        if not SQLiteFTS5Backend.is_supported():
+            self.skipTest("SQLite is built without FTS5")
+
+    def test_operator_edge_cases_do_not_raise(self):
+        for query in ['lease AND OR contents', 'lease OR NOT contents', 'NOT lease', 'lease NOT', 'AND OR NOT']:
+            with self.subTest(query=query):
+                self.backend.search(query, owner_id=self.user.id)
+
+    def test_consecutive_operators_still_match(self):
+        hits = self.backend.search('lease AND OR contents', owner_id=self.user.id)
+        self.assertEqual([hit['id'] for hit in hits], [self.lease.id])
+
+    def test_invalid_expression_returns_no_hits(self):
+        with mock.patch('lawyer.fulltext.to_fts_query', return_value='"a" OR NOT "b"'):
+            self.assertEqual(self.backend.search('anything'), [])
+
+
+class QueryCounterTests(TransactionTestCase):
+
+    def run_in_worker(self, func):
+        def work():
+            try:
+                func()
+            finally:
+                connections.close_all()
+        thread = threading.Thread(target=contextvars.copy_context().run, args=(work,))
+        thread.start()
+        thread.join()
+
+    def count_users(self):
+        User.objects.count()
+
+    def test_counts_request_thread_queries_and_writes(self):
+        with QueryCounter() as counter:
+            User.objects.create_user(username='lawyer')
+            User.objects.count()
+        stats = counter.as_dict()
+        self.assertGreaterEqual(stats['queries'], 2)
+        self.assertGreaterEqual(stats['writes'], 1)
+
+    def test_counts_worker_thread_queries_inside_count_worker_queries(self):
+        def counted():
+            with count_worker_queries():
+                self.count_users()
+
+        with QueryCounter() as counter:
+            self.run_in_worker(self.count_users)
+            self.assertEqual(counter.queries, 0)
+            self.run_in_worker(counted)
+        self.assertEqual(counter.queries, 1)
+
+    def test_count_worker_queries_without_counter_is_a_no_op(self):
+        with count_worker_queries():
+            self.count_users()
+
+
+class DocumentChunkingOnSaveTests(TestCase):
+    """Saving a document rebuilds its chunks only when its text changed"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='lawyer', password='secret')
+        client = FakeOpenAI()
+        for target in ('lawyer.models.get_openai_client', 'lawyer.chunking.get_openai_client'):
+            patcher = mock.patch(target, return_value=client)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.document = BaseDocument(filename="lease.txt", uploaded_by=self.user, contents="The tenant must give notice.")
+        self.document.save()
+
+    def save_and_count_chunkings(self):
+        from . import chunking
+        with mock.patch.object(chunking, 'chunk_documents', wraps=chunking.chunk_documents) as chunk_documents:
+            self.document.save()
+        return chunk_documents.call_count
+
+    def test_new_document_is_chunked(self):
+        self.assertTrue(self.document.chunks.exists())
+
+    def test_status_change_keeps_chunks(self):
+        chunk_ids = list(self.document.chunks.values_list('id', flat=True))
+        self.document.status = 'ready'
+        self.assertEqual(self.save_and_count_chunkings(), 0)
+        self.assertEqual(list(self.document.chunks.values_list('id', flat=True)), chunk_ids)
+
+    def test_changed_contents_are_rechunked(self):
+        self.document.contents = "The landlord must repair the roof."
+        self.assertEqual(self.save_and_count_chunkings(), 1)
+        self.assertIn("roof", self.document.chunks.get().text)
+
+    def test_missing_chunks_are_rebuilt(self):
+        self.document.chunks.all().delete()
+        self.assertEqual(self.save_and_count_chunkings(), 1)
+
+
+class DocumentContentsSinkTests(TestCase):
+
+    def test_extracted_text_is_stored_in_one_update(self):
+        user = User.objects.create_user(username='lawyer', password='secret')
+        document = BaseDocument(filename="lease.pdf", uploaded_by=user)
+        document.save(enrich=False)
+        sink = DocumentContentsSink(document.id, spool_bytes=8)
+        with CaptureQueriesContext(connection) as queries:
+            stats = extract_pdf(_text_pdf("The tenant must give notice"), sink, workers=1)
+        updates = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        document.refresh_from_db()
+        self.assertEqual(document.contents, "The tenant must give notice")
+        self.assertEqual(sink.getvalue(), document.contents)
+        self.assertEqual(stats['bytes'], len(document.contents))
+
+
+class MmapEmbeddingIndexTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+
+    def test_torn_append_is_dropped_before_the_next_write(self):
+        index = MmapEmbeddingIndex(self.path)
+        index.upsert(1, 10, stub_embedding("first", 8))
+        index.upsert(2, 10, stub_embedding("second", 8))
+        # A writer that died after its vector and tombstone but before its id record
+        with open(index._generation_path(VECTORS_FILE), 'ab') as file:
+            file.write(np.asarray(stub_embedding("lost", 8), dtype='<f4').tobytes())
+        with open(index._generation_path(DEAD_FILE), 'ab') as file:
+            file.write(b'\0')
+
+        reopened = MmapEmbeddingIndex(self.path)
+        self.assertEqual(len(reopened), 2)
+        reopened.upsert(3, 10, stub_embedding("third", 8))
+
+        store = MmapEmbeddingIndex(self.path)
+        self.assertEqual(len(store), 3)
+        for doc_id, text in ((1, "first"), (2, "second"), (3, "third")):
+            self.assertAlmostEqual(store.score_ids(stub_embedding(text, 8), [doc_id])[doc_id], 1.0, places=5)
+
+    def test_first_load_reuses_a_store_another_process_just_wrote(self):
+        first = MmapEmbeddingIndex(self.path)
+        second = MmapEmbeddingIndex(self.path)
+        first.load([(1, 10, stub_embedding("first", 8))])
+        # second decided to load before first finished, and only takes the lock now
+        second.load([(1, 10, stub_embedding("first", 8))])
+        self.assertEqual(second._generation, first._generation)
+        self.assertEqual(sorted(name for name in os.listdir(self.path) if name.isdigit()), [first._generation])
+
+        # An explicit reload of a loaded store still writes a new generation
+        second.load([(2, 10, stub_embedding("second", 8))])
+        self.assertNotEqual(second._generation, first._generation)
+
+
+class IVFOwnerSearchTests(TestCase):
+
+    def test_small_owner_keeps_full_recall(self):
+        rng = np.random.default_rng(0)
+        rows = [(doc_id, 1, rng.normal(size=16)) for doc_id in range(1, 301)]
+        # Three documents of a second owner, far from most of the corpus
+        owned = [(doc_id, 2, rng.normal(size=16)) for doc_id in range(301, 304)]
+        index = IVFIndex(nprobe=1)
+        index.load(rows + owned)
+        index.train(nlist=16, seed=0)
+
+        query = rng.normal(size=16)
+        expected = index.exact_search(query, limit=3, owner_id=2)
+        self.assertEqual(index.search(query, limit=3, owner_id=2), expected)
+        self.assertEqual({doc_id for doc_id, _ in expected}, {301, 302, 303})
+
+
+class IndexRefreshTests(TestCase):
+
+    def test_loaded_index_is_refreshed_at_most_once_per_interval(self):
+        index = EmbeddingIndex()
+        index.load([(1, 1, [1.0, 0.0])])
+        with mock.patch.object(vector_index, '_index', index), \
+                mock.patch.object(index, 'refresh', return_value=False) as refresh:
+            for _ in range(5):
+                self.assertIs(vector_index.get_embedding_index(), index)
+            self.assertEqual(refresh.call_count, 1)
+            index.refreshed_at -= 2
+            vector_index.get_embedding_index()
+            self.assertEqual(refresh.call_count, 2)
+
+    def test_exact_index_finds_documents_enriched_by_a_job_worker(self):
+        user = User.objects.create_user(username='lawyer', password='secret')
+        indexed = create_document(user, "indexed.txt")
+        indexed.embeddings = stub_embedding("indexed.txt", 8)
+        indexed.save(enrich=False)
+        queued = create_document(user, "queued.txt")
+
+        with mock.patch.object(vector_index, '_index', None):
+            index = vector_index.get_embedding_index()
+            self.assertEqual(len(index), 1)
+
+            # The worker runs in another process, so it never sees this process's in-memory index
+            jobs.enqueue('enrich_document', {'document_id': queued.id}, document=queued)
+            with mock.patch('lawyer.signals.peek_embedding_index', return_value=None), \
+                    mock.patch('lawyer.chunking.peek_chunk_index', return_value=None), \
+                    mock.patch('lawyer.pipeline.get_openai_client', return_value=FakeOpenAI()):
+                call_command('run_jobs', '--once', stdout=StringIO())
+
+            index.refreshed_at -= 2
+            results = vector_index.get_embedding_index().search(stub_embedding("queued.txt", 8), limit=1, owner_id=user.id)
+            self.assertEqual(results[0][0], queued.id)
+            self.assertEqual(len(index), 2)
+
+
+class ChunkIndexBackendTests(TestCase):
+    """Chunk search is served by the configured ANN backend"""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='lawyer', password='secret')
+        patcher = mock.patch('lawyer.chunking.get_openai_client', return_value=FakeOpenAI())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.documents = []
+        for clause in ("notice", "rent", "repairs", "deposit", "insurance", "subletting"):
+            document = BaseDocument(filename=f"{clause}.txt", uploaded_by=self.user, contents=f"The tenant's {clause} clause.",
+                                    description=clause, embeddings=stub_embedding(clause, 8))
+            document.save()
+            self.documents.append(document)
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.centroids = os.path.join(directory.name, 'chunk_centroids.npy')
+        search_settings = override_settings(VECTOR_SEARCH={
+            'BACKEND': 'ivf', 'NPROBE': 2, 'RERANK': 100, 'CHUNK_SEARCH': True,
+            'INDEX_PATH': os.path.join(directory.name, 'centroids.npy'), 'CHUNK_INDEX_PATH': self.centroids,
+        })
+        search_settings.enable()
+        self.addCleanup(search_settings.disable)
+        index = mock.patch.object(vector_index, '_chunk_index', None)
+        index.start()
+        self.addCleanup(index.stop)
+
+    def test_chunk_index_follows_backend_and_uses_trained_centroids(self):
+        call_command('build_vector_index', '--chunks', '--nlist', '2', '--evaluate', '0', stdout=StringIO())
+        self.assertTrue(os.path.exists(self.centroids))
+
+        from .utils import vector_search_hits
+        target = self.documents[2]
+        query = stub_embedding(target.chunks.get().text, 8)
+        with mock.patch.object(IVFIndex, 'search', autospec=True, side_effect=IVFIndex.search) as search:
+            hits = vector_search_hits(query, limit=1, user=self.user)
+        self.assertEqual(hits[0]['id'], target.id)
+        index = search.call_args.args[0]
+        self.assertIs(index, vector_index.get_chunk_index())
+        self.assertTrue(index.trained)
+
+
+@override_settings(JOB_QUEUE={'LEASE_SECONDS': 60, 'MAX_ATTEMPTS': 2, 'RETRY_BASE_SECONDS': 10, 'RETRY_MAX_SECONDS': 15})
+class JobQueueTests(TestCase):
+
+    def setUp(self):
+        self.handled = []
+        handlers = mock.patch.dict(jobs.HANDLERS, {'test': self.handle})
+        handlers.start()
+        self.addCleanup(handlers.stop)
+
+    def handle(self, job):
+        self.handled.append(job.id)
+        if job.payload.get('fail'):
+            raise ValueError("handler failed")
+
+    def test_claim_leases_one_job_to_one_worker(self):
+        job = jobs.enqueue('test')
+        claimed = jobs.claim('worker-a')
+        self.assertEqual(claimed.id, job.id)
+        self.assertEqual((claimed.status, claimed.worker, claimed.attempts), ('running', 'worker-a', 1))
+        self.assertIsNone(jobs.claim('worker-b'))
+
+        self.assertTrue(jobs.run_job(claimed))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(self.handled, [job.id])
+
+    def test_expired_lease_is_claimed_again(self):
+        job = jobs.enqueue('test')
+        jobs.claim('crashed')
+        Job.objects.filter(id=job.id).update(leased_until=timezone.now() - timedelta(seconds=1))
+        claimed = jobs.claim('worker-b')
+        self.assertEqual((claimed.id, claimed.worker, claimed.attempts), (job.id, 'worker-b', 2))
+
+        # The crashed worker's late completion no longer matches the lease
+        jobs.complete(Job(id=job.id, worker='crashed'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+
+    def test_failures_back_off_then_dead_letter(self):
+        user = User.objects.create_user(username='lawyer', password='secret')
+        document = create_document(user, "lease.pdf")
+        job = jobs.enqueue('test', {'fail': True}, document=document)
+
+        self.assertFalse(jobs.run_job(jobs.claim('worker')))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+        self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=5))
+        self.assertIn("handler failed", job.last_error)
+        self.assertIsNone(jobs.claim('worker'))
+
+        Job.objects.filter(id=job.id).update(run_after=timezone.now())
+        self.assertFalse(jobs.run_job(jobs.claim('worker')))
+        job.refresh_from_db()
+        document.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('dead', 2))
+        self.assertEqual(document.status, 'failed')
+        self.assertIsNone(jobs.claim('worker'))
+
+    def test_lease_expired_on_final_attempt_is_dead_lettered_unrun(self):
+        job = jobs.enqueue('test')
+        Job.objects.filter(id=job.id).update(
+            status='running', attempts=2, leased_until=timezone.now() - timedelta(seconds=1)
+        )
+        self.assertFalse(jobs.run_job(jobs.claim('worker')))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'dead')
+        self.assertEqual(self.handled, [])
+
+
+class BackfillDocumentHashesTests(TestCase):
+
+    def setUp(self):
+        use_temporary_media(self)
+        self.user = User.objects.create_user(username='lawyer', password='secret')
+
+    def stored_document(self, filename, data):
+        document = create_document(self.user, filename)
+        document.file.save(filename, ContentFile(data), save=False)
+        document.save(enrich=False)
+        return document
+
+    def test_hashes_files_and_counts_duplicates(self):
+        first = self.stored_document("lease.pdf", b"%PDF lease")
+        self.stored_document("lease-copy.pdf", b"%PDF lease")
+        self.stored_document("notice.pdf", b"%PDF notice")
+        missing = self.stored_document("gone.pdf", b"%PDF gone")
+        missing.file.delete(save=False)
+        BaseDocument.objects.filter(id=missing.id).update(file='documents/gone.pdf')
+        BaseDocument.objects.update(file_sha256=None, content_sha256=None)
+
+        out = StringIO()
+        call_command('backfill_document_hashes', stdout=out)
+        first.refresh_from_db()
+        self.assertEqual(first.file_sha256, hashlib.sha256(b"%PDF lease").hexdigest())
+        self.assertEqual(first.content_sha256, sha256_text(first.contents))
+        self.assertIn("(1 with missing files)", out.getvalue())
+        self.assertIn("1 of 3 hashed files duplicate another upload", out.getvalue())
+
+
+class VectorFieldTests(TestCase):
+
+    def test_round_trips_each_storage_dtype(self):
+        vector = np.asarray(stub_embedding("lease", 16), dtype=np.float32)
+        for dtype, places in (('float32', 6), ('float16', 3), ('int8', 2)):
+            with self.subTest(dtype=dtype):
+                decoded = decode_vector(encode_vector(vector, dtype))
+                self.assertEqual(decoded.dtype, np.float32)
+                np.testing.assert_array_almost_equal(decoded, vector, decimal=places)
+
+    def test_rejects_bytes_that_are_not_an_encoded_vector(self):
+        with self.assertRaises(ValueError):
+            decode_vector(b'[0.1, 0.2]')
+
+    @override_settings(EMBEDDING_STORAGE={'DTYPE': 'float16'})
+    def test_model_field_stores_the_configured_dtype(self):
+        user = User.objects.create_user(username='lawyer', password='secret')
+        document = create_document(user, "lease.pdf")
+        BaseDocument.objects.filter(id=document.id).update(embeddings=[0.5, -0.25, 1.0])
+        stored = BaseDocument.objects.values_list('embeddings', flat=True).get(id=document.id)
+        self.assertIsInstance(stored, np.ndarray)
+        np.testing.assert_array_equal(stored, np.asarray([0.5, -0.25, 1.0], dtype=np.float32))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT embeddings FROM lawyer_basedocument WHERE id = %s", [document.id])
+            self.assertEqual(bytes(cursor.fetchone()[0])[:2], b'Vh')
+
+    def test_serializes_as_a_json_list(self):
+        field = BaseDocument._meta.get_field('embeddings')
+        document = BaseDocument(embeddings=np.asarray([0.5, 1.0], dtype=np.float32))
+        self.assertEqual(json.loads(field.value_to_string(document)), [0.5, 1.0])
+        np.testing.assert_array_equal(field.to_python("[0.5, 1.0]"), [0.5, 1.0])
+
+
+class EmbeddingVectorMigrationTests(TransactionTestCase):
+    before = ('lawyer', '0006_documentchunk')
+    after = ('lawyer', '0007_embeddings_vectorfield')
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate([target])
+        return executor.loader.project_state([target]).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('lawyer'))
+
+    def test_json_embeddings_become_vectors_and_back(self):
+        apps = self.migrate(self.before)
+        owner = apps.get_model('auth', 'User').objects.create(username='lawyer')
+        Document = apps.get_model('lawyer', 'BaseDocument')
+        embedded = Document.objects.create(filename="lease.pdf", uploaded_by_id=owner.id, embeddings=[0.5, -0.25])
+        Document.objects.create(filename="notice.pdf", uploaded_by_id=owner.id, embeddings=None)
+
+        apps = self.migrate(self.after)
+        Document = apps.get_model('lawyer', 'BaseDocument')
+        vectors = dict(Document.objects.values_list('filename', 'embeddings'))
+        np.testing.assert_array_equal(vectors["lease.pdf"], [0.5, -0.25])
+        self.assertIsNone(vectors["notice.pdf"])
+
+        apps = self.migrate(self.before)
+        Document = apps.get_model('lawyer', 'BaseDocument')
+        self.assertEqual(Document.objects.get(id=embedded.id).embeddings, [0.5, -0.25])
+
+
+class RankFusionTests(TestCase):
+    rankings = {
+        'vector': [{'id': 1, 'score': 0.9}, {'id': 2, 'score': 0.5}, {'id': 3, 'score': 0.1}],
+        'lexical': [{'id': 3, 'score': 12.0}, {'id': 1, 'score': 4.0}],
+    }
+
+    def test_reciprocal_rank_fusion_sums_weighted_reciprocal_ranks(self):
+        fused = reciprocal_rank_fusion(self.rankings, {'vector': 1.0, 'lexical': 2.0}, k=60)
+        self.assertAlmostEqual(fused[1], 1 / 61 + 2 / 62)
+        self.assertAlmostEqual(fused[2], 1 / 62)
+        self.assertAlmostEqual(fused[3], 1 / 63 + 2 / 61)
+        self.assertEqual(max(fused, key=fused.get), 3)
+
+    def test_weighted_fusion_normalizes_each_retriever(self):
+        rankings = {**self.rankings, 'lexical': [*self.rankings['lexical'], {'id': 4, 'score': None}]}
+        fused = weighted_score_fusion(rankings, {'vector': 1.0, 'lexical': 0.5})
+        self.assertAlmostEqual(fused[1], 1.0 + 0.0)
+        self.assertAlmostEqual(fused[2], 0.5)
+        self.assertAlmostEqual(fused[3], 0.0 + 0.5)
+        self.assertNotIn(4, fused)
+
+    def test_weighted_fusion_of_equal_scores(self):
+        fused = weighted_score_fusion({'lexical': [{'id': 1, 'score': 3.0}, {'id': 2, 'score': 3.0}]}, {})
+        self.assertEqual(fused, {1: 1.0, 2: 1.0})
+
+    def test_failed_retriever_leaves_the_other_ranking(self):
+        user = User.objects.create_user(username='lawyer', password='secret')
+        lease, notice = create_document(user, "lease.pdf"), create_document(user, "notice.pdf")
+        lexical = [{'id': notice.id, 'score': 2.0, 'snippet': "notice"}, {'id': lease.id, 'score': 1.0, 'snippet': "lease"}]
+        with mock.patch.object(hybrid_search, '_vector_hits', side_effect=ValueError("embeddings unavailable")), \
+                mock.patch.object(hybrid_search, '_lexical_hits', return_value=lexical):
+            result = hybrid_search.hybrid_search_documents("notice", limit=5, user=user, method='rrf')
+        self.assertEqual(result['errors'], {'vector': "embeddings unavailable"})
+        self.assertEqual([hit['document'].id for hit in result['results']], [notice.id, lease.id])
+        self.assertEqual((result['results'][0]['lexical_rank'], result['results'][0]['vector_rank']), (1, None))
+        self.assertEqual(result['results'][0]['snippet'], "notice")
+
+
+class MessageHistoryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='lawyer', password='secret')
+        case = Case.objects.create(title="Default Case", created_by=self.user)
+        self.conversation = Conversation.objects.create(title="Lease", case=case, created_by=self.user)
+        self.messages = [
+            Message.objects.create(conversation=self.conversation, message_type='user', content=f"Message {number}")
+            for number in range(1, 6)
+        ]
+        # Equal timestamps, so the id alone must break ties
+        Message.objects.filter(conversation=self.conversation).update(created_at=self.messages[0].created_at)
+
+    def contents(self, page):
+        return [message['content'] for message in page['messages']]
+
+    def test_before_cursor_pages_back_without_gaps_or_repeats(self):
+        page = get_message_page(self.conversation.id, limit=2)
+        self.assertEqual(self.contents(page), ["Message 4", "Message 5"])
+        self.assertTrue(page['has_more'])
+        page = get_message_page(self.conversation.id, limit=2, before=page['next_before'])
+        self.assertEqual(self.contents(page), ["Message 2", "Message 3"])
+        page = get_message_page(self.conversation.id, limit=2, before=page['next_before'])
+        self.assertEqual(self.contents(page), ["Message 1"])
+        self.assertFalse(page['has_more'])
+        self.assertIsNone(page['next_before'])
+
+    def test_after_cursor_returns_only_newer_messages(self):
+        latest = get_message_page(self.conversation.id, limit=2)['latest']
+        page = get_message_page(self.conversation.id, after=latest)
+        self.assertEqual((page['messages'], page['latest']), ([], latest))
+
+        Message.objects.create(conversation=self.conversation, message_type='assistant', content="Message 6")
+        page = get_message_page(self.conversation.id, after=latest)
+        self.assertEqual(self.contents(page), ["Message 6"])
+        self.assertEqual(page['latest'], page['messages'][-1]['cursor'])
+
+    def test_invalid_cursor_is_rejected(self):
+        with self.assertRaises(InvalidCursor):
+            decode_cursor("not-a-cursor")
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('lawyer:get_conversation', args=[self.conversation.id]), {'before': "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unchanged_page_revalidates_as_not_modified(self):
+        self.client.force_login(self.user)
+        url = reverse('lawyer:get_conversation', args=[self.conversation.id])
+        response = self.client.get(url, {'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, {'limit': 2}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        Message.objects.create(conversation=self.conversation, message_type='user', content="Message 6")
+        response = self.client.get(url, {'limit': 2}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_other_users_conversation_is_not_found(self):
+        self.client.force_login(User.objects.create_user(username='other', password='secret'))
+        response = self.client.get(reverse('lawyer:get_conversation', args=[self.conversation.id]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ToolMemoTests(TestCase):
+
+    def setUp(self):
+        self.calls = []
+
+        def get_cases(limit: int = 10, query: str = ''):
+            self.calls.append((limit, query))
+            return [f"case {len(self.calls)}"]
+
+        def create_case(title: str):
+            self.calls.append(title)
+            return {'title': title}
+
+        self.get_cases = memoized_tool('get_cases', get_cases)
+        self.create_case = memoized_tool('create_case', create_case)
+
+    def test_equivalent_arguments_share_an_entry(self):
+        memo = ToolMemo()
+        with use_tool_memo(memo):
+            first = self.get_cases()
+            self.assertEqual(self.get_cases(limit=10, query=''), first)
+            self.assertEqual(self.get_cases(query=' notice  period'), self.get_cases(query='notice period '))
+            self.get_cases(limit=5)
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(memo.as_stats()['hits'], 2)
+
+    def test_without_a_memo_every_call_runs(self):
+        self.get_cases()
+        self.get_cases()
+        self.assertEqual(len(self.calls), 2)
+
+    def test_write_tool_invalidates_the_memo(self):
+        memo = ToolMemo()
+        with use_tool_memo(memo):
+            self.get_cases()
+            self.create_case(title="Lease dispute")
+            self.get_cases()
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(memo.as_stats()['invalidations'], 1)
+
+    @override_settings(TOOL_MEMO={'MAX_ENTRIES': 2, 'TTL_SECONDS': 60})
+    def test_least_recently_used_and_expired_entries_are_dropped(self):
+        memo = ToolMemo()
+        memo.set('a', 1)
+        memo.set('b', 2)
+        memo.get('a')
+        memo.set('c', 3)
+        self.assertEqual(list(memo.entries), ['a', 'c'])
+
+        memo.entries['a']['at'] -= 120
+        self.assertIsNone(memo.get('a'))
+        self.assertEqual(list(ToolMemo(dict(memo.entries)).entries), ['c'])
+
+    def test_entries_persist_in_the_conversation_context(self):
+        user = User.objects.create_user(username='lawyer', password='secret')
+        case = Case.objects.create(title="Default Case", created_by=user)
+        conversation = Conversation.objects.create(title="Lease", case=case, created_by=user, context={'summary': "Earlier"})
+        memo = load_tool_memo(conversation)
+        with use_tool_memo(memo):
+            self.get_cases()
+        memo.save(conversation.id)
+
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.context['summary'], "Earlier")
+        with use_tool_memo(load_tool_memo(conversation)):
+            self.get_cases()
+        self.assertEqual(len(self.calls), 1)
+
+    @override_settings(INGESTION={'MODE': 'queue'})
+    def test_uploads_and_deletions_between_turns_invalidate_the_memo(self):
+        use_temporary_media(self)
+        user = User.objects.create_user(username='lawyer', password='secret')
+        self.client.force_login(user)
+        case = Case.objects.create(title="Default Case", created_by=user)
+        conversation = Conversation.objects.create(title="Lease", case=case, created_by=user)
+        get_documents = memoized_tool('get_documents', lambda: sorted(
+            BaseDocument.objects.filter(uploaded_by=user).values_list('filename', flat=True)
+        ))
+
+        def turn():
+            conversation.refresh_from_db()
+            memo = load_tool_memo(conversation)
+            with use_tool_memo(memo):
+                documents = get_documents()
+            memo.save(conversation.id)
+            return documents
+
+        self.assertEqual(turn(), [])
+        upload = SimpleUploadedFile("lease.pdf", _text_pdf("The tenant must give notice"), content_type='application/pdf')
+        self.client.post(reverse('lawyer:upload_documents'), {'files[]': [upload]})
+        self.assertEqual(turn(), ["lease.pdf"])
+        self.assertEqual(turn(), ["lease.pdf"])
+
+        document = BaseDocument.objects.get(uploaded_by=user)
+        self.client.delete(reverse('lawyer:delete_document', args=[document.id]))
+        self.assertEqual(turn(), [])
+
+
+class RuleSpeakerSelectorTests(TestCase):
+
+    def setUp(self):
+        names = ('UserProxy', 'Planner', 'LegalExpert', 'Critic')
+        self.user_proxy, self.planner, self.legal_expert, self.critic = [
+            ConversableAgent(name, llm_config=False, human_input_mode='NEVER') for name in names
+        ]
+        self.groupchat = GroupChat(
+            agents=[self.user_proxy, self.planner, self.legal_expert, self.critic],
+            messages=[],
+            allowed_or_disallowed_speaker_transitions={
+                self.user_proxy: [self.planner],
+                self.planner: [self.legal_expert, self.critic],
+                self.legal_expert: [self.planner],
+                self.critic: [self.planner],
+            },
+            speaker_transitions_type='allowed',
+        )
+        self.selector = RuleSpeakerSelector(self.user_proxy, termination_tags=['TERMINATE', 'APPROVED'])
+
+    def select(self, speaker, **message):
+        self.groupchat.messages.append({'name': speaker.name, 'role': 'assistant', **message})
+        return self.selector(speaker, self.groupchat)
+
+    def test_tool_calls_go_to_the_executor_and_results_back_to_the_caller(self):
+        call = [{'id': 'call_1', 'type': 'function', 'function': {'name': 'get_cases', 'arguments': '{}'}}]
+        self.assertIs(self.select(self.planner, content=None, tool_calls=call), self.user_proxy)
+        result = self.select(self.user_proxy, role='tool', content="[]", tool_responses=[{'tool_call_id': 'call_1'}])
+        self.assertIs(result, self.planner)
+        # The Planner could have handed over to two agents, so routing its tool call saved an LLM call
+        self.assertEqual(self.selector.stats['llm_calls_avoided'], 1)
+
+    def test_single_successor_and_next_tag_avoid_the_llm(self):
+        self.assertIs(self.select(self.legal_expert, content="The clause is void."), self.planner)
+        self.assertIs(self.select(self.planner, content="Draft an answer. NEXT: @legalexpert"), self.legal_expert)
+        self.assertEqual(self.selector.stats['rule_selections'], 2)
+        self.assertEqual(self.selector.stats['llm_calls_avoided'], 1)
+
+    def test_ambiguous_choice_falls_back(self):
+        self.assertEqual(self.select(self.planner, content="NEXT: LegalExpert or NEXT: Critic"), 'auto')
+        self.assertEqual(self.select(self.planner, content="Someone should answer."), 'auto')
+        self.assertEqual(self.selector.stats['llm_fallbacks'], 2)
+
+    def test_termination_tag_ends_the_chat_unless_it_comes_from_a_tool(self):
+        self.assertIs(self.select(self.user_proxy, role='tool', content="APPROVED", tool_responses=[{}]), self.planner)
+        self.assertIsNone(self.select(self.critic, content="APPROVED"))
+        self.assertTrue(self.selector.stats['terminated_early'])
+        self.selector.reset()
+        self.assertFalse(self.selector.stats['terminated_early'])
+
+    def test_termination_tag_must_stand_on_its_own_line(self):
+        self.assertIs(self.select(self.critic, content="The answer is NOT APPROVED yet."), self.planner)
+        self.assertIs(self.select(self.critic, content="This cannot be APPROVED as written."), self.planner)
+        self.assertFalse(self.selector.stats['terminated_early'])
+        self.assertIsNone(self.select(self.planner, content="The request has been answered.\nTERMINATE."))
+
+
+class EmbeddingIndexTests(TestCase):
+
+    def test_search_ranks_by_cosine_within_an_owner(self):
+        index = EmbeddingIndex(initial_capacity=1)
+        index.load([(1, 10, [1.0, 0.0]), (2, 10, [0.6, 0.8]), (3, 20, [1.0, 0.1]), (4, 10, [0.0, 0.0])])
+        self.assertEqual(len(index), 3)
+        self.assertEqual([doc_id for doc_id, _ in index.search([2.0, 0.0], limit=2)], [1, 3])
+        hits = index.search([1.0, 0.0], limit=5, owner_id=10)
+        self.assertEqual([doc_id for doc_id, _ in hits], [1, 2])
+        self.assertAlmostEqual(hits[1][1], 0.6, places=6)
+
+    def test_remove_moves_the_last_row_into_the_gap(self):
+        index = EmbeddingIndex()
+        index.load([(1, 10, [1.0, 0.0]), (2, 10, [0.0, 1.0]), (3, 10, [0.6, 0.8])])
+        self.assertTrue(index.remove(1))
+        self.assertFalse(index.remove(1))
+        self.assertEqual(index.score_ids([0.6, 0.8], [1, 2, 3]), {2: mock.ANY, 3: mock.ANY})
+        self.assertAlmostEqual(index.score_ids([0.6, 0.8], [3])[3], 1.0, places=6)
+
+        index.upsert(2, 10, [1.0, 0.0])
+        self.assertEqual(index.search([1.0, 0.0], limit=1), [(2, mock.ANY)])
+        index.upsert(2, 10, None)
+        self.assertEqual(len(index), 1)
+
+    def test_vectors_of_another_dimension_are_skipped(self):
+        index = EmbeddingIndex()
+        index.load([(1, 10, [1.0, 0.0])])
+        self.assertFalse(index.upsert(2, 10, [1.0, 0.0, 0.0]))
+        self.assertEqual(index.search([1.0, 0.0, 0.0]), [])
+        self.assertEqual(top_k(np.array([7, 8, 9]), np.array([0.1, 0.9, 0.5]), 2), [(8, mock.ANY), (9, mock.ANY)])
+
+
+class LLMResponseCacheTests(TestCase):
+
+    def setUp(self):
+        self.state = StubState(dimensions=8)
+        stub = StubServer(('127.0.0.1', 0), self.state)
+        threading.Thread(target=stub.serve_forever, daemon=True).start()
+        self.addCleanup(stub.server_close)
+        self.addCleanup(stub.shutdown)
+        self.openai = OpenAI(api_key='sk-test', base_url=f"http://127.0.0.1:{stub.server_address[1]}/v1", max_retries=0)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'llm_responses.sqlite3')
+
+    def cached_client(self, memory_entries=100):
+        return CachedOpenAIClient(self.openai, ResponseCache(MemoryTier(max_entries=memory_entries), SQLiteTier(self.path)))
+
+    def test_embeddings_are_cached_per_input(self):
+        client = self.cached_client()
+        first = client.embeddings.create(model='text-embedding-3-small', input=['lease', 'notice'])
+        second = client.embeddings.create(model='text-embedding-3-small', input=['notice', 'term', 'term'])
+        self.assertEqual(self.state.counts['embeddings'], 2)
+        self.assertEqual(second.data[0].embedding, first.data[1].embedding)
+        np.testing.assert_allclose([item.embedding for item in second.data[1:]], [stub_embedding('term', 8)] * 2, rtol=1e-6)
+
+    def test_chat_completions_are_cached_per_request(self):
+        client = self.cached_client()
+        messages = [{'role': 'user', 'content': "Summarize the lease"}]
+        first = client.chat.completions.create(model='gpt-4o', messages=messages)
+        second = client.chat.completions.create(model='gpt-4o', messages=messages, timeout=30)
+        self.assertEqual(second.choices[0].message.content, first.choices[0].message.content)
+        self.assertEqual(self.state.counts['chat'], 1)
+
+        client.chat.completions.create(model='gpt-4o', messages=messages, cache=False)
+        with client.bypass():
+            client.chat.completions.create(model='gpt-4o', messages=messages)
+        self.assertEqual(self.state.counts['chat'], 3)
+        self.assertEqual(client.cache.stats()['bypassed'], 2)
+
+    def test_disk_tier_is_shared_by_a_new_process(self):
+        messages = [{'role': 'user', 'content': "Summarize the lease"}]
+        self.cached_client().chat.completions.create(model='gpt-4o', messages=messages)
+        client = self.cached_client()
+        client.chat.completions.create(model='gpt-4o', messages=messages)
+        self.assertEqual(self.state.counts['chat'], 1)
+        self.assertEqual(client.cache.stats()['disk_hits'], 1)
+
+    def test_cache_hits_are_traced_as_cached_without_tokens(self):
+        client = TracedOpenAIClient(self.cached_client())
+        messages = [{'role': 'user', 'content': "Summarize the lease"}]
+        with start_trace() as trace:
+            for _ in range(2):
+                client.chat.completions.create(model='gpt-4o', messages=messages)
+                client.embeddings.create(model='text-embedding-3-small', input=['lease'])
+        calls = trace.calls
+        self.assertEqual([(call['kind'], call['cached']) for call in calls],
+                         [('chat', False), ('embedding', False), ('chat', True), ('embedding', True)])
+        self.assertGreater(calls[0]['prompt_tokens'], 0)
+        self.assertEqual((calls[2]['prompt_tokens'], calls[2]['completion_tokens']), (0, 0))
+        summary = summarize_calls(calls, key='kind')
+        self.assertEqual((summary['chat']['cached'], summary['chat']['prompt_tokens']), (1, calls[0]['prompt_tokens']))
+
+    def test_memory_tier_evicts_least_recently_used(self):
+        memory = MemoryTier(max_entries=10, max_bytes=10)
+        memory.set('a', '1234')
+        memory.set('b', '1234')
+        memory.get('a', ttl=None)
+        memory.set('c', '1234')
+        self.assertEqual((memory.get('a', None), memory.get('b', None), memory.get('c', None)), ('1234', None, '1234'))
+        self.assertIsNone(memory.get('a', ttl=-1))
+
+
+class CaseCentroidTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='lawyer', password='secret')
+        self.case = Case.objects.create(title="Lease dispute", created_by=self.user)
+
+    def embedded_document(self, filename, embedding):
+        document = create_document(self.user, filename)
+        document.embeddings = embedding
+        document.save(enrich=False)
+        return document
+
+    def centroid(self, case=None):
+        return Case.objects.values_list('centroid', flat=True).get(id=(case or self.case).id)
+
+    def test_centroid_follows_linked_documents(self):
+        east = self.embedded_document("east.pdf", [1.0, 0.0])
+        north = self.embedded_document("north.pdf", [0.0, 2.0])
+        self.case.documents.add(east, north)
+        np.testing.assert_allclose(self.centroid(), [np.sqrt(0.5), np.sqrt(0.5)], rtol=1e-6)
+
+        # Folded into the running sum, then matched by a full recompute
+        self.case.documents.add(self.embedded_document("east-2.pdf", [3.0, 0.0]))
+        incremental = self.centroid()
+        recompute_case_centroid(self.case.id)
+        np.testing.assert_allclose(incremental, self.centroid(), rtol=1e-6)
+
+        self.case.documents.remove(north)
+        np.testing.assert_allclose(self.centroid(), [1.0, 0.0], rtol=1e-6)
+        east.delete()
+        np.testing.assert_allclose(self.centroid(), [1.0, 0.0], rtol=1e-6)
+        self.case.documents.clear()
+        self.assertIsNone(self.centroid())
+
+    def test_reembedded_document_moves_the_centroid(self):
+        document = self.embedded_document("east.pdf", [1.0, 0.0])
+        self.case.documents.add(document)
+        document.embeddings = [0.0, 1.0]
+        document.save(enrich=False)
+        np.testing.assert_allclose(self.centroid(), [0.0, 1.0], rtol=1e-6)
+
+    def test_cases_rank_by_centroid_similarity(self):
+        other = Case.objects.create(title="Notice period", created_by=self.user)
+        self.case.documents.add(self.embedded_document("east.pdf", [1.0, 0.0]))
+        other.documents.add(self.embedded_document("north.pdf", [0.0, 1.0]))
+        Case.objects.create(title="Empty", created_by=self.user)
+        ranked = rank_cases_by_centroid([0.2, 1.0], self.user)
+        self.assertEqual([case_id for case_id, _ in ranked], [other.id, self.case.id])
+        self.assertEqual(rank_cases_by_centroid([0.2, 1.0], User.objects.create_user(username='other')), [])
+
+
+class AgentPoolTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='lawyer', password='secret')
+        config = mock.patch('lawyer.autogen_setup.get_agent_config', return_value={
+            'config_list': [{'model': 'gpt-4o', 'api_key': 'sk-test'}], 'cache_seed': None,
+        })
+        config.start()
+        self.addCleanup(config.stop)
+
+    def test_sessions_are_reset_and_reused(self):
+        pool = AgentPool(max_idle=2)
+        with pool.checkout(self.user) as session:
+            self.assertIs(get_current_user(), self.user)
+            session.manager.groupchat.messages.append({'name': 'UserProxy', 'role': 'user', 'content': "Hi"})
+        with pool.checkout(self.user) as reused:
+            self.assertIs(reused, session)
+            self.assertEqual(reused.manager.groupchat.messages, [])
+        with self.assertRaises(RuntimeError):
+            get_current_user()
+        stats = pool.stats()
+        self.assertEqual((stats['built'], stats['reused'], stats['in_use'], stats['idle']), (1, 1, 0, 1))
+
+    def test_concurrent_checkouts_build_extra_sessions_beyond_max_idle(self):
+        pool = AgentPool(max_idle=1)
+        with pool.checkout(self.user) as first, pool.checkout(self.user) as second:
+            self.assertIsNot(first, second)
+            self.assertEqual(pool.stats()['in_use'], 2)
+        stats = pool.stats()
+        self.assertEqual((stats['built'], stats['idle'], stats['discarded']), (2, 1, 1))
+
+    def test_session_that_fails_to_reset_is_discarded(self):
+        pool = AgentPool(max_idle=2)
+        with pool.checkout(self.user) as session:
+            session.reset = mock.Mock(side_effect=RuntimeError("stuck"))
+        self.assertEqual((pool.stats()['idle'], pool.stats()['discarded']), (0, 1))
+
+
+@override_settings(CONVERSATION_MEMORY={'RECENT_MESSAGES': 4, 'FOLD_BATCH': 3, 'MIN_SIMILARITY': 0.99, 'TOKEN_BUDGET': 3000})
+class ConversationMemoryTests(TestCase):
+
+    def setUp(self):
+        user = User.objects.create_user(username='lawyer', password='secret')
+        case = Case.objects.create(title="Default Case", created_by=user)
+        self.conversation = Conversation.objects.create(title="Lease", case=case, created_by=user, context={})
+        self.openai = FakeOpenAI()
+        for number in range(1, 9):
+            message_type = 'user' if number % 2 else 'assistant'
+            Message.objects.create(conversation=self.conversation, message_type=message_type, content=f"Message {number}",
+                                   metadata={'sender': 'LegalExpert'})
+            Message.objects.create(conversation=self.conversation, message_type='system', content="Tool output")
+
+    def test_messages_leaving_the_recent_window_are_folded_once(self):
+        self.assertEqual(update_conversation_memory(self.conversation.id, client=self.openai), {'folded': 4, 'pending': 0})
+        self.conversation.refresh_from_db()
+        state = get_memory_state(self.conversation)
+        folded = Message.objects.filter(conversation=self.conversation, embeddings__isnull=False)
+        self.assertEqual(sorted(folded.values_list('content', flat=True)), [f"Message {number}" for number in range(1, 5)])
+        self.assertEqual((state['summary'], state['folded_messages']), ("A summary", 4))
+        self.assertEqual(state['summarized_through'], folded.order_by('-id').first().id)
+
+        self.assertEqual(update_conversation_memory(self.conversation.id, client=self.openai), {'folded': 0, 'pending': 0})
+        self.assertEqual(self.openai.calls['chat'], 1)
+
+    def test_prompt_holds_summary_retrieved_and_recent_messages(self):
+        update_conversation_memory(self.conversation.id, client=self.openai)
+        self.conversation.refresh_from_db()
+        # Embedded exactly like the folded "User: Message 3", so only that one passes MIN_SIMILARITY
+        prompt, stats = build_chat_prompt(self.conversation, "User: Message 3", client=self.openai)
+        self.assertEqual((stats['recent'], stats['retrieved']), (4, 1))
+        self.assertEqual(prompt, "\n\n".join([
+            "Summary of the conversation so far:\nA summary",
+            "Relevant earlier messages:\nUser: Message 3",
+            "Most recent messages:\n" + "\n".join(
+                f"{'User' if number % 2 else 'LegalExpert'}: Message {number}" for number in range(5, 9)
+            ),
+            "Current request:\nUser: Message 3",
+        ]))
+
+    def test_prompt_stays_within_the_token_budget(self):
+        with override_settings(CONVERSATION_MEMORY={'TOKEN_BUDGET': 1}):
+            prompt, stats = build_chat_prompt(self.conversation, "What now?", client=self.openai)
+        self.assertEqual((prompt, stats['recent']), ("What now?", 0))
+        with override_settings(CONVERSATION_MEMORY={'ENABLED': False}):
+            self.assertEqual(build_chat_prompt(self.conversation, "What now?")[0], "What now?")
+
+    def test_inline_update_runs_in_the_background_after_commit(self):
+        from . import conversation_memory
+        release, done = threading.Event(), threading.Event()
+
+        def fold(conversation_id, client=None):
+            release.wait(5)
+            done.set()
+
+        with mock.patch.object(conversation_memory, 'update_conversation_memory', side_effect=fold) as update:
+            with self.captureOnCommitCallbacks(execute=True) as callbacks:
+                conversation_memory.schedule_memory_update(self.conversation)
+                self.assertFalse(update.called)
+            self.assertEqual(len(callbacks), 1)
+            # The caller got control back while the fold is still running
+            self.assertFalse(done.is_set())
+            release.set()
+            self.assertTrue(done.wait(5))
+        update.assert_called_once_with(self.conversation.id)
+
+
+class QueryPlanAuditTests(TestCase):
+
+    def test_hot_queries_use_indexes(self):
+        out = StringIO()
+        call_command('audit_query_plans', stdout=out)
+        self.assertIn("no full table scans", out.getvalue())
+        self.assertNotIn("FAIL", out.getvalue())
+        self.assertFalse(User.objects.filter(username='__query_plan_audit__').exists())
+
+    def test_unindexed_query_fails_the_audit(self):
+        scenarios = AuditQueryPlans.scenarios
+
+        def with_scan(command, user):
+            return [*scenarios(command, user), ('content lookup', lambda: list(Message.objects.filter(content="audit 1")))]
+
+        with mock.patch.object(AuditQueryPlans, 'scenarios', with_scan), self.assertRaises(CommandError) as raised:
+            call_command('audit_query_plans', stdout=StringIO())
+        self.assertIn("1 of", str(raised.exception))
+
+
+class ParallelToolExecutionTests(TransactionTestCase):
+    """A TransactionTestCase: calls made inside a transaction run one by one"""
+
+    requested_by = contextvars.ContextVar('requested_by', default=None)
+
+    def setUp(self):
+        self.agent = ToolExecutorAgent('UserProxy', human_input_mode='NEVER', code_execution_config=False, llm_config=False)
+
+        def slow(name: str) -> str:
+            time.sleep(0.2)
+            return f"{name} for {self.requested_by.get()} on {threading.current_thread().name}"
+
+        def fail() -> str:
+            raise ValueError("no such case")
+
+        self.agent.register_function({'slow': slow, 'create_case': slow, 'fail': fail})
+
+    def calls(self, *calls):
+        return [{'id': f"call_{position}", 'type': 'function',
+                 'function': {'name': name, 'arguments': json.dumps(arguments)}}
+                for position, (name, arguments) in enumerate(calls)]
+
+    def test_read_calls_run_concurrently_in_the_chat_context(self):
+        token = self.requested_by.set('lawyer')
+        self.addCleanup(self.requested_by.reset, token)
+        started = time.perf_counter()
+        outcomes = self.agent.run_tool_calls(self.calls(('slow', {'name': 'first'}), ('slow', {'name': 'second'})))
+        self.assertLess(time.perf_counter() - started, 0.35)
+        self.assertTrue(outcomes[0][0].startswith("first for lawyer on agent-tool"))
+        self.assertTrue(outcomes[1][0].startswith("second for lawyer on agent-tool"))
+        self.assertEqual([timing['tool_call_id'] for _, timing in outcomes], ['call_0', 'call_1'])
+        self.assertTrue(all(timing['parallel'] and timing['status'] == 'ok' for _, timing in outcomes))
+
+    def test_turn_with_a_write_runs_in_order_on_the_chat_thread(self):
+        outcomes = self.agent.run_tool_calls(self.calls(('slow', {'name': 'read'}), ('create_case', {'name': 'write'})))
+        self.assertEqual([content.split(" on ")[-1] for content, _ in outcomes], [threading.current_thread().name] * 2)
+        self.assertFalse(any(timing['parallel'] for _, timing in outcomes))
+
+    @override_settings(TOOL_EXECUTION={'TIMEOUT_SECONDS': 0.05})
+    def test_errors_and_timeouts_are_answered_per_call(self):
+        outcomes = self.agent.run_tool_calls(self.calls(('fail', {}), ('slow', {'name': 'late'})))
+        self.assertEqual([timing['status'] for _, timing in outcomes], ['error', 'timeout'])
+        self.assertIn("no such case", outcomes[0][0])
+        self.assertIn("timed out", outcomes[1][0])
+
+    def use_single_thread_pool(self):
+        pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='agent-tool')
+        self.addCleanup(pool.shutdown)
+        patcher = mock.patch('lawyer.tool_execution._tool_executor', pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(TOOL_EXECUTION={'TIMEOUT_SECONDS': 0.3})
+    def test_timeout_starts_when_a_queued_call_starts_running(self):
+        self.use_single_thread_pool()
+        outcomes = self.agent.run_tool_calls(self.calls(*[('slow', {'name': name}) for name in ('a', 'b', 'c')]))
+        self.assertEqual([timing['status'] for _, timing in outcomes], ['ok', 'ok', 'ok'])
+
+    @override_settings(TOOL_EXECUTION={'TIMEOUT_SECONDS': 0.1})
+    def test_calls_still_queued_after_the_timeout_are_cancelled(self):
+        self.use_single_thread_pool()
+        release = threading.Event()
+        self.addCleanup(release.set)
+        ran = []
+        self.agent.register_function({'hang': lambda: release.wait(5) and "released", 'record': lambda: ran.append(1) or "ran"})
+        outcomes = self.agent.run_tool_calls(self.calls(('hang', {}), ('record', {})))
+        self.assertEqual([timing['status'] for _, timing in outcomes], ['timeout', 'timeout'])
+        self.assertIn("did not start", outcomes[1][0])
+        release.set()
+        self.assertEqual(ran, [])
+
+
+class LLMTracingTests(TestCase):
+
+    def test_client_calls_are_recorded_under_the_current_label(self):
+        openai = FakeOpenAI(fail_chat=True)
+        client = TracedOpenAIClient(openai)
+        client.embeddings.create(model='text-embedding-3-small', input="untraced")
+        with start_trace() as trace:
+            with trace_label('tool:search_documents'):
+                contextvars.copy_context().run(client.embeddings.create, model='text-embedding-3-small', input="lease")
+            self.assertEqual([call['agent'] for call in trace.take()], ['tool:search_documents'])
+            with self.assertRaises(ValueError):
+                client.chat.completions.create(model='gpt-4o-mini', messages=[])
+            calls = trace.take()
+        self.assertEqual([(call['kind'], call['agent'], call['model'], call['status']) for call in calls],
+                         [('chat', 'app', 'gpt-4o-mini', 'error')])
+        self.assertEqual(trace.take(), [])
+        self.assertIsNone(current_trace())
+        self.assertEqual(openai.calls, {'chat': 1, 'embeddings': 2})
+
+    @override_settings(LLM_TRACING={'ENABLED': False})
+    def test_disabled_tracing_records_nothing(self):
+        with start_trace() as trace:
+            self.assertIsNone(trace)
+            TracedOpenAIClient(FakeOpenAI()).embeddings.create(model='text-embedding-3-small', input="lease")
+
+    def test_calls_are_summarized_per_agent(self):
+        calls = [
+            {'agent': 'Planner', 'ms': ms, 'status': 'ok', 'retries': 0, 'prompt_tokens': 10, 'completion_tokens': 2}
+            for ms in (10.0, 20.0, 30.0)
+        ] + [{'agent': 'Critic', 'ms': 5.0, 'status': 'error', 'retries': 1}]
+        summary = summarize_calls(calls)
+        self.assertEqual(list(summary), ['Critic', 'Planner'])
+        self.assertEqual((summary['Planner']['calls'], summary['Planner']['p50_ms'], summary['Planner']['prompt_tokens']),
+                         (3, 20.0, 30))
+        self.assertEqual((summary['Critic']['errors'], summary['Critic']['retries']), (1, 1))
+
+    def test_summary_command_reads_traces_from_messages(self):
+        user = User.objects.create_user(username='lawyer', password='secret')
+        case = Case.objects.create(title="Default Case", created_by=user)
+        conversation = Conversation.objects.create(title="Lease", case=case, created_by=user)
+        Message.objects.create(conversation=conversation, message_type='assistant', content="Answer", metadata={
+            TRACE_KEY: [
+                {'agent': 'LegalExpert', 'model': 'gpt-4o', 'ms': 40.0, 'status': 'ok', 'prompt_tokens': 100, 'completion_tokens': 50},
+                {'agent': 'tool:search_documents', 'model': 'text-embedding-3-small', 'ms': 5.0, 'status': 'ok', 'prompt_tokens': 3},
+            ],
+            'tool_timings': [{'name': 'search_documents', 'ms': 12.0, 'status': 'ok'}],
+        })
+        out = StringIO()
+        call_command('llm_trace_summary', '--json', stdout=out)
+        summary = json.loads(out.getvalue())
+        self.assertEqual(summary['agents']['LegalExpert']['completion_tokens'], 50)
+        self.assertEqual((summary['tools']['search_documents']['llm_calls'], summary['tools']['search_documents']['tokens']), (1, 3))
+        self.assertEqual(summary['conversations'][str(conversation.id)]['total_ms'], 45.0)
+
+
+class TranscriptPersistenceTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='lawyer', password='secret')
+        case = Case.objects.create(title="Default Case", created_by=self.user)
+        self.conversation = Conversation.objects.create(title="Lease", case=case, created_by=self.user)
+        self.lease = create_document(self.user, "lease.pdf")
+
+    def transcript(self, turns):
+        return [{
+            'name': 'LegalExpert' if turn % 2 else 'Planner',
+            'role': 'assistant',
+            'content': f"Turn {turn}",
+            'metadata': {'documents': [self.lease.id, self.lease.id, 999999]},
+        } for turn in range(turns)]
+
+    def test_transcript_is_saved_in_a_fixed_number_of_queries(self):
+        with CaptureQueriesContext(connection) as short:
+            save_agent_messages(self.conversation, self.transcript(2))
+        with CaptureQueriesContext(connection) as long:
+            messages, documents = save_agent_messages(self.conversation, self.transcript(8))
+        self.assertEqual(len(long), len(short))
+        self.assertEqual(documents, [self.lease])
+        self.assertEqual([message.message_type for message in messages[:2]], ['system', 'assistant'])
+        self.assertEqual(Message.objects.filter(conversation=self.conversation).count(), 10)
+        self.assertEqual(self.lease.referenced_in_messages.count(), 10)
+        self.assertEqual(save_agent_messages(self.conversation, []), ([], []))
+
+    def test_final_response_is_the_last_non_empty_answer(self):
+        def turns(*messages):
+            return [Message(message_type=message_type, content=content) for message_type, content in messages]
+
+        # Without a LegalExpert answer, both endpoints show the last agent message with content
+        self.assertEqual(final_response(turns(('system', "Plan"), ('system', "Draft"), ('system', ""))), "Draft")
+        self.assertEqual(final_response(turns(('assistant', "Answer"), ('system', "APPROVED"), ('assistant', ""))), "Answer")
+        self.assertIsNone(final_response([]))
@@ -0,0 +1,192 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any, Dict, List, Optional, Tuple
+import autogen
+from django.conf import settings
+from django.db import connection, connections
+from .db_metrics import count_worker_queries
+from .tracing import trace_label
+
+# Tools that write to the database; a turn calling one runs its calls one by one, in order
+WRITE_TOOLS = {'create_case'}
+
+
+def get_tool_execution_options() -> Dict[str, Any]:
+    options = {
+        'PARALLEL': True,
+        'MAX_WORKERS': 4,
+        'TIMEOUT_SECONDS': 30,
+    }
+    options.update(getattr(settings, 'TOOL_EXECUTION', {}))
+    return options
+
+
+_tool_executor: Optional[ThreadPoolExecutor] = None
+_tool_executor_lock = threading.Lock()
+
+
+def get_tool_executor() -> ThreadPoolExecutor:
+    """Process-wide thread pool for tool calls, sized by ``TOOL_EXECUTION['MAX_WORKERS']``"""
+    global _tool_executor
+    if _tool_executor is None:
+        with _tool_executor_lock:
+            if _tool_executor is None:
+                _tool_executor = ThreadPoolExecutor(
+                    max_workers=get_tool_execution_options()['MAX_WORKERS'],
+                    thread_name_prefix='agent-tool'
+                )
+    return _tool_executor
+
+
+class _Started:
+    """Set by a pooled call once a pool thread picks it up, so its timeout excludes time spent queued"""
+
+    def __init__(self):
+        self.at = 0.0
+        self._event = threading.Event()
+
+    def set(self):
+        self.at = time.perf_counter()
+        self._event.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._event.wait(timeout)
+
+
+class ToolExecutorAgent(autogen.UserProxyAgent):
+    """User proxy that runs the tool calls of one turn concurrently.
+
+    Calls go to a shared thread pool, each in a copy of the chat's context so
+    tools still see the requesting user and the chat's IOStream. Pool threads
+    close their database connection after every call. A turn that calls a
+    write tool runs on the chat thread in call order, as its later reads may
+    depend on the write; so does every turn while the chat thread is inside a
+    transaction whose rows other connections cannot see.
+    Results keep the order of the calls. Each call's timeout runs from when a
+    pool thread picks it up, so calls queued behind other chats' are not cut
+    short; a call still queued after the timeout is cancelled. A call that
+    misses its timeout is answered with an error; its thread is left to
+    finish in the background.
+
+    The latency of each call is kept until the group chat collects it with
+    ``pop_tool_timings()`` and stores it with the message.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tool_timings: List[Dict[str, Any]] = []
+        self.replace_reply_func(
+            autogen.ConversableAgent.generate_tool_calls_reply,
+            ToolExecutorAgent.generate_parallel_tool_calls_reply
+        )
+
+    def pop_tool_timings(self) -> List[Dict[str, Any]]:
+        timings, self._tool_timings = self._tool_timings, []
+        return timings
+
+    def reset(self):
+        super().reset()
+        self._tool_timings = []
+
+    def _timed_call(self, function_call: Dict[str, Any], pooled: bool,
+                    started_event: Optional[_Started] = None) -> Tuple[Dict[str, str], float]:
+        if started_event is not None:
+            started_event.set()
+        started = time.perf_counter()
+        try:
+            # OpenAI calls made by the tool are traced under its name, queries counted with the request's
+            with trace_label(f"tool:{function_call.get('name', '')}"), count_worker_queries():
+                _, result = self.execute_function(function_call)
+        finally:
+            if pooled:
+                # Pool threads outlive the request; do not leave their connection open
+                connections.close_all()
+        return result, 1000 * (time.perf_counter() - started)
+
+    @staticmethod
+    def _pooled_result(future, started: _Started, timeout: float) -> Tuple[Optional[Tuple[Dict[str, str], float]], str]:
+        """Wait up to ``timeout`` for a queued call to start, then up to ``timeout`` from its start"""
+        if not started.wait(timeout) and future.cancel():
+            return None, f"did not start within {timeout} seconds"
+        started.wait()
+        try:
+            return future.result(timeout=max(timeout - (time.perf_counter() - started.at), 0)), ''
+        except FutureTimeoutError:
+            return None, f"timed out after {timeout} seconds"
+
+    def run_tool_calls(self, tool_calls: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Execute ``tool_calls`` and return ``(content, timing)`` per call, in call order"""
+        options = get_tool_execution_options()
+        names = {tool_call.get("function", {}).get("name") for tool_call in tool_calls}
+        parallel = (
+            options['PARALLEL'] and len(tool_calls) > 1
+            and not names & WRITE_TOOLS and not connection.in_atomic_block
+        )
+
+        futures = {}
+        if parallel:
+            executor = get_tool_executor()
+            for position, tool_call in enumerate(tool_calls):
+                context = contextvars.copy_context()
+                started = _Started()
+                future = executor.submit(context.run, self._timed_call, tool_call.get("function", {}), True, started)
+                futures[position] = (future, started)
+
+        outcomes = []
+        for position, tool_call in enumerate(tool_calls):
+            function_call = tool_call.get("function", {})
+            name = function_call.get("name", "")
+            status = 'ok'
+            if position in futures:
+                waited = time.perf_counter()
+                future, started = futures[position]
+                outcome, reason = self._pooled_result(future, started, options['TIMEOUT_SECONDS'])
+                if outcome is None:
+                    result = {"content": f"Error: {name} {reason}"}
+                    elapsed = 1000 * (time.perf_counter() - (started.at or waited))
+                    status = 'timeout'
+                else:
+                    result, elapsed = outcome
+            else:
+                result, elapsed = self._timed_call(function_call, False)
+            content = result.get("content") or ""
+            if status == 'ok' and content.startswith("Error:"):
+                status = 'error'
+            outcomes.append((content, {
+                'tool_call_id': tool_call.get("id"),
+                'name': name,
+                'ms': round(elapsed, 2),
+                'status': status,
+                'parallel': position in futures,
+            }))
+        return outcomes
+
+    def generate_parallel_tool_calls_reply(
+        self,
+        messages: Optional[List[Dict]] = None,
+        sender: Optional[autogen.Agent] = None,
+        config: Optional[Any] = None,
+    ) -> Tuple[bool, Optional[Dict]]:
+        """Reply to a message's tool calls, like autogen's ``generate_tool_calls_reply``"""
+        if messages is None:
+            messages = self._oai_messages[sender]
+        tool_calls = messages[-1].get("tool_calls", [])
+        if not tool_calls:
+            return False, None
+
+        tool_returns = []
+        timings = []
+        for tool_call, (content, timing) in zip(tool_calls, self.run_tool_calls(tool_calls)):
+            tool_return = {"role": "tool", "content": content}
+            if tool_call.get("id") is not None:
+                tool_return["tool_call_id"] = tool_call["id"]
+            tool_returns.append(tool_return)
+            timings.append(timing)
+        self._tool_timings = timings
+        return True, {
+            "role": "tool",
+            "tool_responses": tool_returns,
+            "content": "\n\n".join(self._str_for_tool_response(tool_return) for tool_return in tool_returns),
+        }
@@ -0,0 +1,183 @@
+import functools
+import inspect
+import json
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Optional
+from django.conf import settings
+from django.db import transaction
+from .models import BaseDocument, Case, Conversation
+from .tool_execution import WRITE_TOOLS
+
+# Conversation.context key holding the memoized tool results
+MEMO_KEY = 'tool_memo'
+
+
+def get_tool_memo_options() -> Dict[str, Any]:
+    options = {
+        'ENABLED': True,
+        'MAX_ENTRIES': 50,
+        # Results are reused across turns for this long, unless the user's documents or cases change
+        'TTL_SECONDS': 900,
+        'MAX_RESULT_CHARS': 20000,
+    }
+    options.update(getattr(settings, 'TOOL_MEMO', {}))
+    return options
+
+
+def data_generation(user_id: int) -> str:
+    """Fingerprint of a user's documents and cases, changed by any upload, enrichment, deletion or case edit.
+
+    Derived from the rows rather than bumped by each writer, so views, signals,
+    job workers and the admin all move it alike.
+    """
+    from django.db.models import Count, Max
+
+    documents = BaseDocument.objects.filter(uploaded_by_id=user_id).aggregate(count=Count('id'), newest=Max('updated_at'))
+    cases = Case.objects.filter(created_by_id=user_id).aggregate(
+        count=Count('id', distinct=True), newest=Max('updated_at'), links=Count('documents')
+    )
+    return json.dumps([documents['count'], documents['newest'], cases['count'], cases['newest'], cases['links']], default=str)
+
+
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    return value
+
+
+class ToolMemo:
+    """Results of read-only agent tools for one conversation, keyed on tool name and arguments.
+
+    Arguments are bound to the tool's signature with defaults filled in and
+    strings whitespace-normalized, so ``get_cases()`` and ``get_cases(limit=10)``
+    share an entry. At most ``MAX_ENTRIES`` entries are kept, least recently
+    used first out. Entries saved under an older ``data_generation`` of the
+    user's data are dropped on load. Safe to share between the threads running
+    one turn's tool calls.
+    """
+
+    def __init__(self, entries: Optional[Dict[str, Dict[str, Any]]] = None, generation: Optional[str] = None):
+        self.options = get_tool_memo_options()
+        self.generation = generation
+        self.entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        self._lock = threading.Lock()
+        expires = time.time() - self.options['TTL_SECONDS']
+        for key, entry in (entries or {}).items():
+            if entry.get('at', 0) >= expires:
+                self.entries[key] = entry
+
+    @classmethod
+    def load(cls, conversation: Conversation) -> 'ToolMemo':
+        stored = (conversation.context or {}).get(MEMO_KEY, {})
+        generation = data_generation(conversation.created_by_id)
+        if stored.get('entries') and stored.get('generation') != generation:
+            # The user's documents or cases changed since these results were memoized
+            memo = cls(generation=generation)
+            memo.stats['invalidations'] += 1
+            return memo
+        return cls(stored.get('entries'), generation=generation)
+
+    def key(self, name: str, func: Callable, kwargs: Dict[str, Any]) -> str:
+        try:
+            bound = inspect.signature(func).bind(**kwargs)
+            bound.apply_defaults()
+            arguments = bound.arguments
+        except TypeError:
+            arguments = kwargs
+        return f"{name}:{json.dumps({k: _normalize(v) for k, v in arguments.items()}, sort_keys=True, default=str)}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry['at'] < time.time() - self.options['TTL_SECONDS']:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry
+
+    def set(self, key: str, result: Any):
+        try:
+            size = len(json.dumps(result))
+        except (TypeError, ValueError):
+            return
+        if size > self.options['MAX_RESULT_CHARS']:
+            return
+        with self._lock:
+            self.entries[key] = {'result': result, 'at': time.time()}
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.options['MAX_ENTRIES']:
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self.entries.clear()
+            self.stats['invalidations'] += 1
+
+    def as_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.stats, entries=len(self.entries))
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        return stats
+
+    def save(self, conversation_id: int):
+        """Store the entries in ``Conversation.context``, leaving the rest of it as it is now"""
+        with self._lock:
+            entries = dict(self.entries)
+        with transaction.atomic():
+            locked = Conversation.objects.select_for_update().only('id', 'context').get(id=conversation_id)
+            context = dict(locked.context or {})
+            context[MEMO_KEY] = {'entries': entries, 'generation': self.generation}
+            Conversation.objects.filter(id=conversation_id).update(context=context)
+
+
+# The memo of the conversation being served; None disables memoization
+_tool_memo: ContextVar[Optional[ToolMemo]] = ContextVar('agent_tool_memo', default=None)
+
+
+@contextmanager
+def use_tool_memo(memo: Optional[ToolMemo]):
+    """Memoize tool calls made in this context, and in contexts copied from it, into ``memo``"""
+    token = _tool_memo.set(memo)
+    try:
+        yield memo
+    finally:
+        _tool_memo.reset(token)
+
+
+def load_tool_memo(conversation: Conversation) -> Optional[ToolMemo]:
+    """The conversation's memo, or None when ``TOOL_MEMO['ENABLED']`` is off"""
+    return ToolMemo.load(conversation) if get_tool_memo_options()['ENABLED'] else None
+
+
+def memoized_tool(name: str, func: Callable) -> Callable:
+    """Wrap an agent tool so repeated calls within a conversation reuse the first result"""
+
+    @functools.wraps(func)
+    def wrapper(**kwargs):
+        memo = _tool_memo.get()
+        if memo is None:
+            return func(**kwargs)
+        if name in WRITE_TOOLS:
+            # A write can change what any read-only tool returns
+            result = func(**kwargs)
+            memo.invalidate()
+            return result
+        key = memo.key(name, func, kwargs)
+        entry = memo.get(key)
+        if entry is not None:
+            return entry['result']
+        result = func(**kwargs)
+        memo.set(key, result)
+        return result
+
+    return wrapper
@@ -0,0 +1,243 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+import numpy as np
+from autogen import runtime_logging
+from autogen.logger.base_logger import BaseLogger
+from django.conf import settings
+from .llm_cache import served_from_cache
+
+# Message.metadata key holding the LLM calls made to produce the message
+TRACE_KEY = 'trace'
+
+
+def get_tracing_options() -> Dict[str, Any]:
+    options = {
+        'ENABLED': True,
+    }
+    options.update(getattr(settings, 'LLM_TRACING', {}))
+    return options
+
+
+class Trace:
+    """LLM calls made while serving one request, in the order they finished.
+
+    ``take()`` hands over the calls recorded since the previous ``take()``,
+    so each group chat message can carry the calls that produced it. Calls
+    from tool threads land in the same trace through copied contexts.
+    """
+
+    def __init__(self):
+        self.calls: List[Dict[str, Any]] = []
+        self._taken = 0
+        self._lock = threading.Lock()
+
+    def record(self, call: Dict[str, Any]):
+        with self._lock:
+            self.calls.append(call)
+
+    def take(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            taken, self._taken = self.calls[self._taken:], len(self.calls)
+        return taken
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar('llm_trace', default=None)
+
+# Who the next direct OpenAI calls are made for, e.g. "tool:search_documents"
+_trace_label: ContextVar[str] = ContextVar('llm_trace_label', default='app')
+
+# Set by services.with_retries around each attempt
+retry_attempt: ContextVar[int] = ContextVar('llm_retry_attempt', default=0)
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+@contextmanager
+def start_trace():
+    """Record the LLM calls made in this context, and contexts copied from it, into a new ``Trace``"""
+    if not get_tracing_options()['ENABLED']:
+        yield None
+        return
+    install_autogen_logger()
+    trace = Trace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+@contextmanager
+def trace_label(label: str):
+    token = _trace_label.set(label)
+    try:
+        yield
+    finally:
+        _trace_label.reset(token)
+
+
+def _usage(response: Any) -> Dict[str, int]:
+    usage = getattr(response, 'usage', None)
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_tokens', 0) or 0,
+        'completion_tokens': getattr(usage, 'completion_tokens', 0) or 0,
+    }
+
+
+def record_call(kind: str, agent: str, model: Optional[str], started: float, response: Any = None,
+                error: Optional[Exception] = None, cached: bool = False, retries: Optional[int] = None):
+    trace = _trace.get()
+    if trace is None:
+        return
+    # A cache hit replays the usage of the original call; no tokens were spent on it
+    usage = {'prompt_tokens': 0, 'completion_tokens': 0} if cached else _usage(response)
+    trace.record({
+        'kind': kind,
+        'agent': agent,
+        'model': getattr(response, 'model', None) or model,
+        **usage,
+        'ms': round(1000 * (time.perf_counter() - started), 2),
+        'retries': retry_attempt.get() if retries is None else retries,
+        'status': 'error' if error is not None else 'ok',
+        'cached': cached,
+    })
+
+
+class TracedOpenAIClient:
+    """Wrapper around an ``OpenAI`` client that records chat and embedding calls in the active trace"""
+
+    def __init__(self, client):
+        self._client = client
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create_chat_completion))
+        self.embeddings = SimpleNamespace(create=self._create_embeddings)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _create_chat_completion(self, **kwargs):
+        return self._call('chat', self._client.chat.completions.create, kwargs)
+
+    def _create_embeddings(self, **kwargs):
+        return self._call('embedding', self._client.embeddings.create, kwargs)
+
+    def _call(self, kind: str, create, kwargs: Dict[str, Any]):
+        if _trace.get() is None:
+            return create(**kwargs)
+        started = time.perf_counter()
+        # The wrapped CachedOpenAIClient, if any, flags hits in this context
+        token = served_from_cache.set(False)
+        try:
+            response = create(**kwargs)
+        except Exception as e:
+            record_call(kind, _trace_label.get(), kwargs.get('model'), started, error=e)
+            raise
+        else:
+            record_call(kind, _trace_label.get(), kwargs.get('model'), started, response=response,
+                        cached=served_from_cache.get())
+        finally:
+            served_from_cache.reset(token)
+        return response
+
+
+class TraceLogger(BaseLogger):
+    """autogen runtime logger that records agents' chat completions in the active trace.
+
+    autogen calls ``log_chat_completion`` once per config it tries within
+    one ``create()``, under one invocation id, so failed attempts before a
+    success count as retries. Speaker selection by the LLM shows up under
+    autogen's internal ``speaker_selection_agent``.
+    """
+
+    def __init__(self):
+        self._attempts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def start(self) -> str:
+        return 'llm-trace'
+
+    def log_chat_completion(self, invocation_id, client_id, wrapper_id, agent, request, response, is_cached,
+                            cost, start_time) -> None:
+        if _trace.get() is None:
+            return
+        with self._lock:
+            retries = self._attempts.pop(str(invocation_id), 0)
+            if isinstance(response, str):
+                # An error string; the next config is tried under the same invocation id
+                self._attempts[str(invocation_id)] = retries + 1
+        elapsed = (datetime.utcnow() - datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S.%f")).total_seconds()
+        record_call(
+            'chat',
+            getattr(agent, 'name', None) or str(agent),
+            request.get('model') if isinstance(request, dict) else None,
+            time.perf_counter() - elapsed,
+            response=None if isinstance(response, str) else response,
+            error=Exception(response) if isinstance(response, str) else None,
+            cached=bool(is_cached),
+            retries=retries,
+        )
+
+    def log_new_agent(self, agent, init_args) -> None:
+        pass
+
+    def log_event(self, source, name, **kwargs) -> None:
+        pass
+
+    def log_new_wrapper(self, wrapper, init_args) -> None:
+        pass
+
+    def log_new_client(self, client, wrapper, init_args) -> None:
+        pass
+
+    def log_function_use(self, source, function, args, returns) -> None:
+        pass
+
+    def stop(self) -> None:
+        pass
+
+    def get_connection(self):
+        return None
+
+
+_install_lock = threading.Lock()
+
+
+def install_autogen_logger():
+    """Route autogen's runtime logging to ``TraceLogger``, once per process"""
+    if isinstance(runtime_logging.autogen_logger, TraceLogger):
+        return
+    with _install_lock:
+        if not isinstance(runtime_logging.autogen_logger, TraceLogger):
+            runtime_logging.start(logger=TraceLogger())
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    return round(float(np.percentile(values, q)), 2) if values else None
+
+
+def summarize_calls(calls: List[Dict[str, Any]], key: str = 'agent') -> Dict[str, Dict[str, Any]]:
+    """Count, p50/p95 latency and tokens of ``calls`` grouped by ``key``"""
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for call in calls:
+        groups.setdefault(call.get(key) or 'unknown', []).append(call)
+    summary = {}
+    for name, group in sorted(groups.items()):
+        latencies = [call['ms'] for call in group]
+        summary[name] = {
+            'calls': len(group),
+            'errors': sum(1 for call in group if call.get('status') != 'ok'),
+            'cached': sum(1 for call in group if call.get('cached')),
+            'retries': sum(call.get('retries', 0) for call in group),
+            'p50_ms': _percentile(latencies, 50),
+            'p95_ms': _percentile(latencies, 95),
+            'total_ms': round(sum(latencies), 2),
+            'prompt_tokens': sum(call.get('prompt_tokens', 0) for call in group),
+            'completion_tokens': sum(call.get('completion_tokens', 0) for call in group),
+        }
+    return summary
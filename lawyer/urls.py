@@ -8,9 +8,13 @@ urlpatterns = [
     path('chat/', views.chat, name='chat'),
     path('configure/', views.configure, name='configure'),
     path('upload/', views.upload_documents, name='upload_documents'),
+    path('documents/status/', views.document_status, name='document_status'),
+    path('search/', views.search_documents, name='search_documents'),
     path('case/create/', views.create_case, name='create_case'),
     path('document/<int:document_id>/delete/', views.delete_document, name='delete_document'),
     path('chat/send/', views.send_message, name='send_message'),
+    path('chat/stream/', views.stream_message, name='stream_message'),
+    path('chat/agents/stats/', views.agent_pool_stats, name='agent_pool_stats'),
     path('chat/<int:conversation_id>/', views.get_conversation, name='get_conversation'),
     path('chat/new/', views.new_conversation, name='new_conversation'),
 ] 
\ No newline at end of file
@@ -1,16 +1,23 @@
 import os
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from django.conf import settings
 from openai import OpenAI
-from tqdm import tqdm
 import json
 import numpy as np
-from .models import BaseDocument, Case
+from .models import BaseDocument, Case, DocumentChunk
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.db.models import Q
-from .services import get_openai_client, extract_text_from_pdf
+from .services import get_openai_client, extract_text_from_pdf, sha256_bytes
+from .vector_index import get_chunk_index, get_embedding_index
+from .case_vectors import rank_cases_by_centroid
+from .fulltext import get_full_text_backend
+from .pipeline import IngestionPipeline
+from .jobs import enqueue
+from .chunking import chunk_documents, get_chunking_options
+from .dedup import API_CALLS_PER_ENRICHMENT, copy_enrichment, find_by_file_hashes, store_file
 
 def get_embeddings(text: str, client: OpenAI) -> List[float]:
     """Get embeddings for text using OpenAI's API"""
@@ -74,40 +81,101 @@ def get_case_documents(case: Case) -> List[BaseDocument]:
     return list(case.documents.all().order_by('-created_at'))
 
 # Document Search Functions
-def search_documents_by_similarity(query: str, limit: int = 10) -> List[Dict[str, Any]]:
+def chunk_search_hits(query_embedding: List[float], limit: int = 10, user: Optional[User] = None,
+                      aggregate: str = 'max', candidates: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Document ``{'id', 'score', 'passage'}`` hits aggregated from the best matching chunks"""
+    candidates = candidates or getattr(settings, 'VECTOR_SEARCH', {}).get('CHUNK_CANDIDATES', 200)
+    hits = get_chunk_index().search(
+        query_embedding,
+        limit=max(limit, candidates),
+        owner_id=user.id if user else None
+    )
+    chunk_scores = dict(hits)
+    chunks = DocumentChunk.objects.filter(id__in=chunk_scores).only('id', 'document_id', 'text')
+
+    # Group candidate chunks under their documents, best chunk first
+    per_document = {}
+    for chunk in sorted(chunks, key=lambda chunk: chunk_scores[chunk.id], reverse=True):
+        per_document.setdefault(chunk.document_id, []).append(chunk)
+    scored = []
+    for doc_id, matches in per_document.items():
+        scores = [chunk_scores[chunk.id] for chunk in matches]
+        similarity = max(scores) if aggregate == 'max' else sum(scores) / len(scores)
+        scored.append({'id': doc_id, 'score': similarity, 'passage': matches[0].text})
+    scored.sort(key=lambda hit: hit['score'], reverse=True)
+    return scored[:limit]
+
+def vector_search_hits(query_embedding: List[float], limit: int = 10, user: Optional[User] = None,
+                       chunks: Optional[bool] = None, aggregate: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Document ``{'id', 'score', 'passage'}`` hits from the chunk index, or description embeddings without chunks"""
+    options = getattr(settings, 'VECTOR_SEARCH', {})
+    chunks = options.get('CHUNK_SEARCH', True) if chunks is None else chunks
+
+    # Chunks cover the whole text, not just the summary of its first pages
+    if chunks and len(get_chunk_index()):
+        return chunk_search_hits(
+            query_embedding,
+            limit=limit,
+            user=user,
+            aggregate=aggregate or options.get('CHUNK_AGGREGATE', 'max')
+        )
+
+    # Score every indexed document in one matrix-vector product
+    hits = get_embedding_index().search(
+        query_embedding,
+        limit=limit,
+        owner_id=user.id if user else None
+    )
+    return [{'id': doc_id, 'score': similarity, 'passage': None} for doc_id, similarity in hits]
+
+def search_document_chunks(query_embedding: List[float], limit: int = 10, user: Optional[User] = None,
+                           aggregate: str = 'max', candidates: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Rank documents by their best matching chunks ('max') or the mean of their matching chunks ('mean')"""
+    hits = chunk_search_hits(query_embedding, limit=limit, user=user, aggregate=aggregate, candidates=candidates)
+    documents = BaseDocument.objects.in_bulk([hit['id'] for hit in hits])
+    return [{
+        'document': documents[hit['id']],
+        'similarity': hit['score'],
+        'passage': hit['passage']
+    } for hit in hits if hit['id'] in documents]
+
+def search_documents_by_similarity(query: str, limit: int = 10, user: Optional[User] = None,
+                                   chunks: Optional[bool] = None, aggregate: Optional[str] = None) -> List[Dict[str, Any]]:
     """Search for documents using cosine similarity with query embeddings"""
     try:
         client = get_openai_client()
         query_embedding = get_embeddings(query, client)
+        hits = vector_search_hits(query_embedding, limit=limit, user=user, chunks=chunks, aggregate=aggregate)
         
-        # Get all documents with embeddings
-        documents = BaseDocument.objects.exclude(embeddings__isnull=True)
-        
-        # Calculate similarities
-        similarities = []
-        for doc in documents:
-            if doc.embeddings:  # Make sure document has embeddings
-                similarity = cosine_similarity(query_embedding, doc.embeddings)
-                similarities.append({
-                    'document': doc,
-                    'similarity': similarity
-                })
-        
-        # Sort by similarity and get top results
-        similarities.sort(key=lambda x: x['similarity'], reverse=True)
-        return similarities[:limit]
+        # Fetch only the winning rows, preserving rank order
+        documents = BaseDocument.objects.in_bulk([hit['id'] for hit in hits])
+        results = []
+        for hit in hits:
+            if hit['id'] not in documents:
+                continue
+            result = {'document': documents[hit['id']], 'similarity': hit['score']}
+            if hit['passage'] is not None:
+                result['passage'] = hit['passage']
+            results.append(result)
+        return results
     
     except Exception as e:
         print(f"Error in similarity search: {str(e)}")
         return []
 
-def search_documents_by_text(query: str, limit: int = 10) -> List[BaseDocument]:
+def search_documents_full_text(query: str, limit: int = 10, user: Optional[User] = None) -> List[Dict[str, Any]]:
+    """Ranked keyword search; supports "quoted phrases", prefix* terms and AND/OR/NOT"""
+    hits = get_full_text_backend().search(query, limit=limit, owner_id=user.id if user else None)
+    documents = BaseDocument.objects.in_bulk([hit['id'] for hit in hits])
+    return [{
+        'document': documents[hit['id']],
+        'score': hit['score'],
+        'snippet': hit['snippet']
+    } for hit in hits if hit['id'] in documents]
+
+def search_documents_by_text(query: str, limit: int = 10, user: Optional[User] = None) -> List[BaseDocument]:
     """Search for documents by text content or description"""
-    return BaseDocument.objects.filter(
-        Q(contents__icontains=query) |
-        Q(description__icontains=query) |
-        Q(filename__icontains=query)
-    ).distinct()[:limit]
+    return [result['document'] for result in search_documents_full_text(query, limit=limit, user=user)]
 
 def get_case_summary(case: Case) -> Dict[str, Any]:
     """Get a comprehensive summary of a case including documents and metadata"""
@@ -128,39 +196,56 @@ def get_case_summary(case: Case) -> Dict[str, Any]:
         'tags': case.tags or []
     }
 
-def find_similar_cases(query: str, user: User, limit: int = 5) -> List[Dict[str, Any]]:
-    """Find cases similar to a query using document similarity"""
+def find_similar_cases(query: str, user: User, limit: int = 5, mode: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Find cases similar to a query using document similarity.
+
+    mode 'centroid' compares the query to each case's precomputed centroid;
+    'mean' averages the exact similarity of every case document.
+    """
     try:
+        mode = mode or getattr(settings, 'VECTOR_SEARCH', {}).get('CASE_SIMILARITY', 'centroid')
         client = get_openai_client()
         query_embedding = get_embeddings(query, client)
-        
-        # Get all user's cases with their documents
-        cases = Case.objects.filter(created_by=user)
-        case_similarities = []
-        
-        for case in cases:
-            # Get average similarity across all case documents
-            doc_similarities = []
-            for doc in case.documents.all():
-                if doc.embeddings:
-                    similarity = cosine_similarity(query_embedding, doc.embeddings)
-                    doc_similarities.append(similarity)
-            
-            if doc_similarities:
-                avg_similarity = sum(doc_similarities) / len(doc_similarities)
-                case_similarities.append({
-                    'case': case,
-                    'similarity': avg_similarity
-                })
-        
-        # Sort by similarity and return top results
-        case_similarities.sort(key=lambda x: x['similarity'], reverse=True)
-        return case_similarities[:limit]
+
+        if mode == 'centroid':
+            ranked = rank_cases_by_centroid(query_embedding, user, limit=limit)
+        else:
+            ranked = _rank_cases_by_mean_similarity(query_embedding, user, limit=limit)
+        cases = Case.objects.in_bulk([case_id for case_id, _ in ranked])
+        return [{
+            'case': cases[case_id],
+            'similarity': similarity
+        } for case_id, similarity in ranked if case_id in cases]
     
     except Exception as e:
         print(f"Error finding similar cases: {str(e)}")
         return []
 
+def _rank_cases_by_mean_similarity(query_embedding: List[float], user: User, limit: int = 5) -> List[Tuple[int, float]]:
+    """Mean of exact per-document similarities for each of the user's cases"""
+    # One query for every (case, document) pair the user owns, instead of one per case
+    links = list(Case.documents.through.objects.filter(
+        case__created_by=user
+    ).values_list('case_id', 'basedocument_id'))
+    
+    # Score each linked document once, exactly, against the embedding index
+    doc_scores = get_embedding_index().score_ids(
+        query_embedding,
+        list({doc_id for _, doc_id in links})
+    )
+    
+    # Average similarity across all case documents
+    case_scores = {}
+    for case_id, doc_id in links:
+        if doc_id in doc_scores:
+            case_scores.setdefault(case_id, []).append(doc_scores[doc_id])
+    
+    return sorted(
+        ((case_id, sum(scores) / len(scores)) for case_id, scores in case_scores.items()),
+        key=lambda item: item[1],
+        reverse=True
+    )[:limit]
+
 # Document Processing Functions
 def process_document(file, user: User, client: OpenAI) -> BaseDocument:
     """Process a single document: save file and let the model handle content extraction and OpenAI processing"""
@@ -175,21 +260,48 @@ def process_document(file, user: User, client: OpenAI) -> BaseDocument:
         raise Exception(f"Error processing document {file.name}: {str(e)}")
 
 def process_multiple_documents(files: List[Any], user: User) -> Dict[str, Any]:
-    """Process multiple documents and return results with any errors"""
-    client = get_openai_client()
-    processed_documents = []
+    """Process multiple documents and return results, any errors and per-stage throughput"""
+    return IngestionPipeline(user).run(files)
+
+def enqueue_documents(files: List[Any], user: User) -> Dict[str, Any]:
+    """Store uploaded files and queue their enrichment instead of waiting on OpenAI"""
+    queued_documents = []
     errors = []
+    deduplicated = 0
 
-    for file in tqdm(files, desc="Processing documents"):
+    for file in files:
         try:
             if not file.name.lower().endswith('.pdf'):
                 raise ValueError("Only PDF files are supported")
-            document = process_document(file, user, client)
-            processed_documents.append(document)
+            data = file.read()
+            file_sha256 = sha256_bytes(data)
+            duplicate = find_by_file_hashes([file_sha256]).get(file_sha256)
+            with transaction.atomic():
+                document = BaseDocument(
+                    filename=file.name,
+                    file_sha256=file_sha256,
+                    uploaded_by=user,
+                    status='pending'
+                )
+                store_file(document, data, file_sha256, file.name)
+                if duplicate:
+                    # Same bytes were processed before: nothing left to queue
+                    copy_enrichment(duplicate, document)
+                    document.save(enrich=False)
+                    if get_chunking_options()['ENABLED']:
+                        # Chunk text matches the original's, so every embedding is reused
+                        chunk_documents([document])
+                    deduplicated += 1
+                else:
+                    document.save(enrich=False)
+                    enqueue('enrich_document', {'document_id': document.id}, document=document)
+            queued_documents.append(document)
         except Exception as e:
             errors.append({"file": file.name, "error": str(e)})
 
     return {
-        "success": processed_documents,
-        "errors": errors
-    } 
\ No newline at end of file
+        "success": queued_documents,
+        "errors": errors,
+        "deduplicated": deduplicated,
+        "api_calls_saved": deduplicated * API_CALLS_PER_ENRICHMENT
+    }
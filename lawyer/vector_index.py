@@ -0,0 +1,383 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def normalize_vector(vector: Sequence[float]) -> Optional[np.ndarray]:
+    """Return a float32 unit vector, or None if the vector is empty or all zeros"""
+    array = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(array)
+    if array.size == 0 or not np.isfinite(norm) or norm == 0:
+        return None
+    return array / norm
+
+
+class EmbeddingIndex:
+    """In-memory top-k cosine search over pre-normalized document embeddings.
+
+    Vectors live in one contiguous float32 matrix with parallel id and owner
+    arrays, so a query is a single matrix-vector product followed by
+    ``argpartition``. Rows are kept dense: removing a document moves the last
+    row into the freed slot.
+    """
+
+    # Whether other processes write to this index directly, as they do to a shared on-disk store
+    shared = False
+
+    def __init__(self, initial_capacity: int = 1024):
+        self._lock = threading.RLock()
+        self._initial_capacity = max(1, initial_capacity)
+        self._matrix: Optional[np.ndarray] = None
+        self._ids = np.empty(0, dtype=np.int64)
+        self._owners = np.empty(0, dtype=np.int64)
+        self._positions: Dict[int, int] = {}
+        self._size = 0
+        self.loaded = False
+        self.refreshed_at = 0.0
+        # What the database held when the index was last in step with it; see ``sync_loaded_index``
+        self.source_version: Optional[Tuple[int, Any]] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return None if self._matrix is None else self._matrix.shape[1]
+
+    def _allocate(self, capacity: int, dimension: int):
+        matrix = np.empty((capacity, dimension), dtype=np.float32)
+        ids = np.empty(capacity, dtype=np.int64)
+        owners = np.empty(capacity, dtype=np.int64)
+        if self._matrix is not None and self._size:
+            matrix[:self._size] = self._matrix[:self._size]
+            ids[:self._size] = self._ids[:self._size]
+            owners[:self._size] = self._owners[:self._size]
+        self._matrix, self._ids, self._owners = matrix, ids, owners
+
+    def _ensure_capacity(self, needed: int, dimension: int):
+        capacity = 0 if self._matrix is None else self._matrix.shape[0]
+        if needed > capacity:
+            self._allocate(max(needed, capacity * 2, self._initial_capacity), dimension)
+
+    def _reset(self):
+        self._matrix = None
+        self._ids = np.empty(0, dtype=np.int64)
+        self._owners = np.empty(0, dtype=np.int64)
+        self._positions = {}
+        self._size = 0
+
+    # Hooks for subclasses that keep per-row side structures
+    def _row_written(self, position: int):
+        pass
+
+    def _row_removed(self, position: int):
+        pass
+
+    def _row_moved(self, source: int, target: int):
+        pass
+
+    def load(self, rows: Iterable[Tuple[int, int, Sequence[float]]], expected: int = 0):
+        """Replace the index contents with ``(id, owner_id, embedding)`` rows"""
+        with self._lock:
+            self._reset()
+            for doc_id, owner_id, embedding in rows:
+                self._insert(doc_id, owner_id, embedding, reserve=expected)
+            self.loaded = True
+
+    def _insert(self, doc_id: int, owner_id: int, embedding: Sequence[float], reserve: int = 0) -> bool:
+        vector = normalize_vector(embedding)
+        if vector is None:
+            self._remove(doc_id)
+            return False
+        if self._matrix is not None and vector.shape[0] != self._matrix.shape[1]:
+            print(f"Skipping embedding for document {doc_id}: dimension {vector.shape[0]} != {self._matrix.shape[1]}")
+            return False
+
+        position = self._positions.get(doc_id)
+        if position is None:
+            position = self._size
+            self._ensure_capacity(max(position + 1, reserve), vector.shape[0])
+            self._positions[doc_id] = position
+            self._size += 1
+        else:
+            self._row_removed(position)
+        self._matrix[position] = vector
+        self._ids[position] = doc_id
+        self._owners[position] = owner_id if owner_id is not None else -1
+        self._row_written(position)
+        return True
+
+    def _remove(self, doc_id: int) -> bool:
+        position = self._positions.pop(doc_id, None)
+        if position is None:
+            return False
+        last = self._size - 1
+        self._row_removed(position)
+        if position != last:
+            self._matrix[position] = self._matrix[last]
+            self._ids[position] = self._ids[last]
+            self._owners[position] = self._owners[last]
+            self._positions[int(self._ids[position])] = position
+            self._row_moved(last, position)
+        self._size = last
+        return True
+
+    def upsert(self, doc_id: int, owner_id: int, embedding: Optional[Sequence[float]]) -> bool:
+        """Insert or replace a document vector; an empty embedding removes it"""
+        with self._lock:
+            if embedding is None or len(embedding) == 0:
+                return self._remove(doc_id)
+            return self._insert(doc_id, owner_id, embedding)
+
+    def remove(self, doc_id: int) -> bool:
+        with self._lock:
+            return self._remove(doc_id)
+
+    def score(self, query: Sequence[float], owner_id: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(ids, scores)`` for every indexed vector, optionally limited to one owner"""
+        vector = normalize_vector(query)
+        with self._lock:
+            if vector is None or self._size == 0 or vector.shape[0] != self._matrix.shape[1]:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+            scores = self._matrix[:self._size] @ vector
+            ids = self._ids[:self._size].copy()
+            if owner_id is not None:
+                mask = self._owners[:self._size] == owner_id
+                ids, scores = ids[mask], scores[mask]
+        return ids, scores
+
+    def score_ids(self, query: Sequence[float], doc_ids: Sequence[int]) -> Dict[int, float]:
+        """Exact similarities for the given documents; ids missing from the index are skipped"""
+        vector = normalize_vector(query)
+        with self._lock:
+            if vector is None or self._size == 0 or vector.shape[0] != self._matrix.shape[1]:
+                return {}
+            present = [doc_id for doc_id in doc_ids if doc_id in self._positions]
+            positions = np.fromiter((self._positions[doc_id] for doc_id in present), dtype=np.int64, count=len(present))
+            scores = self._matrix[positions] @ vector
+        return dict(zip(present, scores.tolist()))
+
+    def exact_search(self, query: Sequence[float], limit: int = 10, owner_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Brute-force top-k over every indexed vector"""
+        ids, scores = self.score(query, owner_id=owner_id)
+        return top_k(ids, scores, limit)
+
+    def search(self, query: Sequence[float], limit: int = 10, owner_id: Optional[int] = None, **options) -> List[Tuple[int, float]]:
+        """Return the ``limit`` most similar ``(document_id, similarity)`` pairs, best first"""
+        return self.exact_search(query, limit=limit, owner_id=owner_id)
+
+    def refresh(self) -> bool:
+        """Pick up externally rebuilt index structures; the exact index has none"""
+        return False
+
+    def vectors(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return copies of the ``(ids, matrix)`` currently held by the index"""
+        with self._lock:
+            if self._matrix is None:
+                return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+            return self._ids[:self._size].copy(), self._matrix[:self._size].copy()
+
+
+def top_k(ids: np.ndarray, scores: np.ndarray, limit: int) -> List[Tuple[int, float]]:
+    """Select the highest scoring ids without sorting the whole score array"""
+    k = min(limit, scores.shape[0])
+    if k <= 0:
+        return []
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    candidates = candidates[np.argsort(-scores[candidates], kind='stable')]
+    return [(int(ids[i]), float(scores[i])) for i in candidates]
+
+
+_index: Optional[EmbeddingIndex] = None
+_chunk_index: Optional[EmbeddingIndex] = None
+_index_lock = threading.Lock()
+
+
+def _refresh_interval() -> float:
+    from django.conf import settings
+
+    return getattr(settings, 'VECTOR_SEARCH', {}).get('REFRESH_SECONDS', 1)
+
+
+def document_embeddings_version() -> Tuple[int, Any]:
+    """Count and newest ``updated_at`` of embedded documents; changes whenever any process embeds one"""
+    from django.db.models import Count, Max
+    from .models import BaseDocument
+
+    version = BaseDocument.objects.exclude(embeddings__isnull=True).aggregate(count=Count('id'), newest=Max('updated_at'))
+    return version['count'], version['newest']
+
+
+def chunk_embeddings_version() -> Tuple[int, Any]:
+    """Count and highest id of embedded chunks; re-chunking replaces rows, so new chunks get new ids"""
+    from django.db.models import Count, Max
+    from .models import DocumentChunk
+
+    version = DocumentChunk.objects.exclude(embeddings__isnull=True).aggregate(count=Count('id'), newest=Max('id'))
+    return version['count'], version['newest']
+
+
+def load_document_embeddings(index: EmbeddingIndex):
+    """Fill ``index`` from every ``BaseDocument`` that has an embedding"""
+    from .models import BaseDocument
+
+    index.source_version = document_embeddings_version()
+    queryset = BaseDocument.objects.exclude(embeddings__isnull=True).order_by()
+    rows = queryset.values_list('id', 'uploaded_by_id', 'embeddings').iterator(chunk_size=2000)
+    index.load(rows, expected=queryset.count())
+
+
+def load_chunk_embeddings(index: EmbeddingIndex):
+    """Fill an index with every embedded document chunk, owned by the document's uploader"""
+    from .models import DocumentChunk
+
+    index.source_version = chunk_embeddings_version()
+    queryset = DocumentChunk.objects.exclude(embeddings__isnull=True).order_by()
+    rows = queryset.values_list('id', 'document__uploaded_by_id', 'embeddings').iterator(chunk_size=2000)
+    index.load(rows, expected=queryset.count())
+
+
+def _changed_documents(since) -> Iterable[Tuple[int, int, Any]]:
+    from .models import BaseDocument
+
+    return BaseDocument.objects.filter(updated_at__gte=since).values_list('id', 'uploaded_by_id', 'embeddings')
+
+
+def _changed_chunks(since) -> Iterable[Tuple[int, int, Any]]:
+    from .models import DocumentChunk
+
+    return DocumentChunk.objects.filter(id__gt=since, embeddings__isnull=False).values_list(
+        'id', 'document__uploaded_by_id', 'embeddings'
+    )
+
+
+def sync_loaded_index(index: EmbeddingIndex, version: Callable[[], Tuple[int, Any]],
+                      changed: Callable[[Any], Iterable[Tuple[int, int, Any]]], load: Callable[[EmbeddingIndex], None]):
+    """Catch an in-process index up with rows other processes, e.g. job workers, wrote since it last looked.
+
+    Rows changed since the previous version are upserted; if the index still
+    holds a different number of vectors than the database, rows were deleted
+    elsewhere and the index is reloaded. Costs one aggregate query when
+    nothing changed.
+    """
+    current = version()
+    if current == index.source_version:
+        return
+    previous = index.source_version
+    if previous is not None and previous[1] is not None:
+        for row_id, owner_id, embeddings in changed(previous[1]):
+            index.upsert(row_id, owner_id, embeddings)
+    if len(index) != current[0]:
+        with _index_lock:
+            load(index)
+        return
+    index.source_version = current
+
+
+def _refresh_loaded(index: EmbeddingIndex, version, changed, load):
+    """Pick up writes from other processes, at most once every ``VECTOR_SEARCH['REFRESH_SECONDS']``"""
+    now = time.monotonic()
+    if now - index.refreshed_at < _refresh_interval():
+        return
+    index.refreshed_at = now
+    index.refresh()
+    if not index.shared:
+        # A shared store follows other processes' appends in refresh(); an in-process one asks the database
+        sync_loaded_index(index, version, changed, load)
+
+
+def create_embedding_index(backend: Optional[str] = None, index_path: Optional[str] = None) -> EmbeddingIndex:
+    """Instantiate the index class selected by ``settings.VECTOR_SEARCH['BACKEND']``"""
+    from django.conf import settings
+
+    options = getattr(settings, 'VECTOR_SEARCH', {})
+    backend = backend or options.get('BACKEND', 'exact')
+    if backend == 'exact':
+        return EmbeddingIndex()
+    if backend == 'ivf':
+        from .ann import IVFIndex
+        return IVFIndex(
+            centroids_path=index_path or options.get('INDEX_PATH'),
+            nprobe=options.get('NPROBE', 8),
+            rerank=options.get('RERANK', 100),
+        )
+    if backend == 'mmap':
+        from .mmap_store import MmapEmbeddingIndex
+        return MmapEmbeddingIndex(index_path or options.get('STORE_PATH'))
+    raise ValueError(f"Unknown vector search backend: {backend}")
+
+
+def get_embedding_index() -> EmbeddingIndex:
+    """Return the process-wide document embedding index, loading it on first use"""
+    global _index
+    if _index is None or not _index.loaded:
+        with _index_lock:
+            if _index is None:
+                _index = create_embedding_index()
+            if not _index.loaded:
+                load_document_embeddings(_index)
+    else:
+        _refresh_loaded(_index, document_embeddings_version, _changed_documents, load_document_embeddings)
+    return _index
+
+
+def chunk_backend() -> str:
+    """The chunk index backend: ``VECTOR_SEARCH['CHUNK_BACKEND']``, or the document ``BACKEND`` when unset"""
+    from django.conf import settings
+
+    options = getattr(settings, 'VECTOR_SEARCH', {})
+    return options.get('CHUNK_BACKEND') or options.get('BACKEND', 'exact')
+
+
+def _uses_shared_store(chunks: bool = False) -> bool:
+    from django.conf import settings
+
+    backend = chunk_backend() if chunks else getattr(settings, 'VECTOR_SEARCH', {}).get('BACKEND', 'exact')
+    return backend == 'mmap'
+
+
+def peek_embedding_index() -> Optional[EmbeddingIndex]:
+    """Return the index only if it has already been loaded in this process.
+
+    A shared on-disk store is always returned: writes from processes that
+    never search, such as job workers, must still reach it. Other processes'
+    in-memory indexes pick those writes up from the database instead.
+    """
+    if _index is not None and _index.loaded:
+        return _index
+    if _uses_shared_store():
+        return get_embedding_index()
+    return None
+
+
+def get_chunk_index() -> EmbeddingIndex:
+    """Return the process-wide document chunk index, loading it on first use"""
+    global _chunk_index
+    from django.conf import settings
+
+    if _chunk_index is None or not _chunk_index.loaded:
+        with _index_lock:
+            if _chunk_index is None:
+                options = getattr(settings, 'VECTOR_SEARCH', {})
+                backend = chunk_backend()
+                path = options.get('CHUNK_STORE_PATH') if backend == 'mmap' else options.get('CHUNK_INDEX_PATH')
+                _chunk_index = create_embedding_index(backend, path)
+            if not _chunk_index.loaded:
+                load_chunk_embeddings(_chunk_index)
+    else:
+        _refresh_loaded(_chunk_index, chunk_embeddings_version, _changed_chunks, load_chunk_embeddings)
+    return _chunk_index
+
+
+def peek_chunk_index() -> Optional[EmbeddingIndex]:
+    """Return the chunk index only if it has already been loaded in this process, or is shared on disk"""
+    if _chunk_index is not None and _chunk_index.loaded:
+        return _chunk_index
+    if _uses_shared_store(chunks=True):
+        return get_chunk_index()
+    return None
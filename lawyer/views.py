@@ -1,17 +1,27 @@
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
-from django.views.decorators.http import require_http_methods
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition, require_http_methods
 from django.core.exceptions import ValidationError
 from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
+from django.db.models import Prefetch
 from .forms import CaseForm
 from .utils import (
     process_multiple_documents,
+    enqueue_documents,
     create_case_with_title,
     add_documents_to_case
 )
-from .models import BaseDocument, Case, Conversation, Message
-from .autogen_setup import create_agents, create_group_chat
+from .models import BaseDocument, Case, Conversation, Message, Job
+from .hybrid_search import hybrid_search_documents
+from .autogen_setup import get_agent_pool
+from .chat_stream import ChatEventStream, final_response, save_agent_messages, save_prompt_trace
+from .db_metrics import QueryCounter
+from .history import get_history_version, get_message_page, get_recent_conversations, history_etag
+from .conversation_memory import build_chat_prompt, schedule_memory_update
+from .tool_memo import load_tool_memo
+from .tracing import start_trace, summarize_calls, trace_label
 from .services import get_openai_client
 import json
 
@@ -27,30 +37,40 @@ def chat(request):
         defaults={'description': 'Default case for general conversations'}
     )
     
-    # Get all conversations for the user
-    conversations = Conversation.objects.filter(
-        created_by=request.user
-    ).order_by('-updated_at')
+    # Get the user's recent conversations
+    conversations = get_recent_conversations(request.user)
     
     # Get current conversation or create new one
-    current_conversation = conversations.first()
-    if not current_conversation:
+    if conversations:
+        current_conversation_id = conversations[0].id
+    else:
         from django.utils import timezone
         current_time = timezone.now().strftime("%b %d, %Y %I:%M %p")
-        current_conversation = Conversation.objects.create(
+        current_conversation_id = Conversation.objects.create(
             title=f"Legal Consultation - {current_time}",
             case=default_case,
             created_by=request.user,
             is_active=True
-        )
+        ).id
+    
+    # The case panel: conversation and case in one join, the case's documents in one more
+    current_conversation = Conversation.objects.select_related('case').defer(
+        'context', 'case__embedding_sum', 'case__centroid'
+    ).prefetch_related(
+        Prefetch('case__documents', queryset=BaseDocument.objects.only('id', 'filename', 'description'))
+    ).get(id=current_conversation_id)
+    case = current_conversation.case
     
-    # Get conversation history
-    messages = Message.objects.filter(conversation=current_conversation).order_by('created_at')
+    # Only the newest page of history; older messages are fetched as the user scrolls back
+    history = get_message_page(current_conversation.id)
     
     context = {
         'current_conversation': current_conversation,
+        'case_documents': list(case.documents.all()) if case else [],
         'conversations': conversations,
-        'messages': messages
+        'messages': history['messages'],
+        'history_before': history['next_before'],
+        'history_latest': history['latest']
     }
     return render(request, 'chat.html', context)
 
@@ -58,8 +78,10 @@ def chat(request):
 def configure(request):
     case_form = CaseForm()
     
-    # Get user's documents
-    documents = BaseDocument.objects.filter(uploaded_by=request.user).order_by('-created_at')
+    # Get user's documents, without the contents and embeddings the list never shows
+    documents = BaseDocument.objects.filter(uploaded_by=request.user).only(
+        'id', 'filename', 'created_at', 'status'
+    ).order_by('-created_at')
     
     context = {
         'case_form': case_form,
@@ -79,24 +101,37 @@ def upload_documents(request):
                 'message': 'No files were uploaded.'
             }, status=400)
 
-        # Process the uploaded files
-        result = process_multiple_documents(
-            files=files,
-            user=request.user
-        )
+        # Process inline, or queue enrichment for `manage.py run_jobs` workers
+        if getattr(settings, 'INGESTION', {}).get('MODE', 'inline') == 'inline':
+            result = process_multiple_documents(
+                files=files,
+                user=request.user
+            )
+            message = f"Successfully processed {len(result['success'])} documents"
+        else:
+            result = enqueue_documents(
+                files=files,
+                user=request.user
+            )
+            message = f"Successfully queued {len(result['success'])} documents"
 
         # Prepare response
         response_data = {
             'status': 'success',
-            'message': f"Successfully processed {len(result['success'])} documents",
+            'message': message,
             'documents': [{
                 'id': doc.id,
                 'filename': doc.filename,
                 'created_at': doc.created_at.isoformat(),
-                'description': doc.description
+                'description': doc.description,
+                'processing_status': doc.status
             } for doc in result['success']],
-            'errors': result['errors']
+            'errors': result['errors'],
+            'deduplicated': result['deduplicated'],
+            'api_calls_saved': result['api_calls_saved']
         }
+        if 'stats' in result:
+            response_data['stats'] = result['stats']
 
         # If there were any errors, change status to partial success
         if result['errors']:
@@ -111,6 +146,143 @@ def upload_documents(request):
             'message': str(e)
         }, status=500)
 
+@login_required
+@require_http_methods(["GET"])
+def search_documents(request):
+    """Hybrid keyword + vector search over the user's documents"""
+    query = request.GET.get('q', '').strip()
+    method = request.GET.get('method')
+    if not query:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'q is required'
+        }, status=400)
+    if method not in (None, 'rrf', 'weighted'):
+        return JsonResponse({
+            'status': 'error',
+            'message': "method must be 'rrf' or 'weighted'"
+        }, status=400)
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 50)
+    except ValueError:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'limit must be an integer'
+        }, status=400)
+
+    search = hybrid_search_documents(query, limit=limit, user=request.user, method=method)
+    return JsonResponse({
+        'status': 'success',
+        'method': search['method'],
+        'timings': search['timings'],
+        'errors': search['errors'],
+        'results': [{
+            'id': result['document'].id,
+            'filename': result['document'].filename,
+            'description': result['document'].description,
+            'score': result['score'],
+            'vector_rank': result['vector_rank'],
+            'vector_score': result['vector_score'],
+            'lexical_rank': result['lexical_rank'],
+            'lexical_score': result['lexical_score'],
+            'passage': result['passage'],
+            'snippet': result['snippet']
+        } for result in search['results']]
+    })
+
+@login_required
+@csrf_exempt
+@require_http_methods(["POST"])
+async def stream_message(request):
+    """Run the agents on a message and stream their turns as Server-Sent Events.
+
+    Emits ``start``, then ``speaker`` / ``delta`` / ``turn`` events while the
+    agents work, and finally ``done`` or ``error``. Each turn is saved as it
+    happens; if the client disconnects, the chat is cancelled.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Invalid JSON body'
+        }, status=400)
+    content = data.get('message')
+    if not content:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Message content is required'
+        }, status=400)
+
+    user = await request.auser()
+    try:
+        conversation = await Conversation.objects.aget(id=data.get('conversation_id'), created_by=user)
+    except (Conversation.DoesNotExist, ValueError):
+        return JsonResponse({
+            'status': 'error',
+            'message': 'Conversation not found'
+        }, status=404)
+
+    user_message = await Message.objects.acreate(
+        conversation=conversation,
+        message_type='user',
+        content=content
+    )
+
+    stream = ChatEventStream(conversation)
+    response = StreamingHttpResponse(
+        stream.events(user, content, user_message.id),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+@require_http_methods(["GET"])
+def agent_pool_stats(request):
+    """How often agents were built versus reused, and what building them cost"""
+    return JsonResponse({
+        'status': 'success',
+        'stats': get_agent_pool().stats()
+    })
+
+@login_required
+@require_http_methods(["GET"])
+def document_status(request):
+    """Report enrichment progress for the requested documents (polled by the configure page)"""
+    try:
+        ids = [int(value) for value in request.GET.get('ids', '').split(',') if value.strip()]
+    except ValueError:
+        return JsonResponse({
+            'status': 'error',
+            'message': 'ids must be a comma separated list of document ids'
+        }, status=400)
+
+    documents = BaseDocument.objects.filter(
+        id__in=ids,
+        uploaded_by=request.user
+    ).only('id', 'filename', 'status', 'description')
+
+    # Latest job per document, for attempt counts and error messages
+    jobs = {}
+    for job in Job.objects.filter(document_id__in=ids).order_by('created_at').values(
+        'document_id', 'status', 'attempts', 'last_error'
+    ):
+        jobs[job['document_id']] = job
+
+    return JsonResponse({
+        'status': 'success',
+        'documents': [{
+            'id': doc.id,
+            'filename': doc.filename,
+            'processing_status': doc.status,
+            'description': doc.description,
+            'attempts': jobs.get(doc.id, {}).get('attempts', 0),
+            'error': (jobs.get(doc.id, {}).get('last_error') or '').split('\n')[0] or None
+        } for doc in documents]
+    })
+
 @login_required
 @csrf_exempt  # Temporary for testing
 @require_http_methods(["POST"])
@@ -189,6 +361,8 @@ def delete_document(request, document_id):
 @csrf_exempt
 @require_http_methods(["POST"])
 def send_message(request):
+    # Every query this request makes, including the agents' tool calls on pooled threads, for debug metadata
+    db = QueryCounter().start()
     try:
         data = json.loads(request.body)
         conversation_id = data.get('conversation_id')
@@ -209,72 +383,62 @@ def send_message(request):
             content=content
         )
 
-        # Create agents with tools
-        agents = create_agents(request.user)
-        manager = create_group_chat(agents)
-        
-        # Start the conversation with the user's message
-        response = agents["user_proxy"].initiate_chat(
-            manager,
-            message=content,
-            clear_history=True
-        )
+        # Every LLM call from here on, by agent and tool, is recorded with the message it produced
+        with start_trace() as trace:
+            # Prior turns reach the agents as a bounded summary + recent/relevant messages
+            with trace_label('memory'):
+                prompt, memory_stats = build_chat_prompt(conversation, content, exclude_id=user_message.id)
 
-        # Process and save agent messages
-        agent_messages = []
-        final_response = None
-        referenced_docs = set()
-        
-        # Get all messages from the group chat
-        all_messages = manager.groupchat.messages
-        
-        for msg in all_messages:
-            if msg["role"] != "user":  # Skip user messages
-                agent_message = {
-                    "role": msg["role"],
-                    "sender": msg.get("name", "System"),
-                    "content": msg["content"]
-                }
-                agent_messages.append(agent_message)
-                
-                # Save to database
-                if msg.get("name") == "LegalExpert":
-                    message_type = 'assistant'
-                    final_response = msg["content"]
-                else:
-                    message_type = 'system'
-                
-                # Create message and track referenced documents
-                message = Message.objects.create(
-                    conversation=conversation,
-                    message_type=message_type,
-                    content=msg["content"],
-                    metadata={"sender": msg.get("name", "System"), "role": msg["role"]}
+            # Tool results already fetched in this conversation are reused, across turns too
+            memo = load_tool_memo(conversation)
+
+            # Borrow pooled agents; their tools act on behalf of this user until returned
+            with get_agent_pool().checkout(request.user, memo=memo) as session:
+                # Start the conversation with the user's message
+                response = session.agents["user_proxy"].initiate_chat(
+                    session.manager,
+                    message=prompt,
+                    clear_history=True
                 )
+                # Get all messages from the group chat before the session is reset
+                all_messages = list(session.manager.groupchat.messages)
+                speaker_selection = session.selection_stats()
 
-                # If message contains document references, add them
-                if "metadata" in msg and "documents" in msg["metadata"]:
-                    doc_ids = msg["metadata"]["documents"]
-                    docs = BaseDocument.objects.filter(id__in=doc_ids)
-                    message.referenced_documents.add(*docs)
-                    referenced_docs.update(docs)
+        # The first message is the user's own, saved above. Agent replies reach the group chat
+        # with role "user" (the manager received them), so the role cannot tell them apart.
+        save_prompt_trace(user_message.id, all_messages[0])
+        messages, referenced_docs = save_agent_messages(conversation, all_messages[1:])
+        agent_messages = [{
+            "role": msg["role"],
+            "sender": message.metadata["sender"],
+            "content": message.content
+        } for msg, message in zip(all_messages[1:], messages)]
 
-        # If no LegalExpert response was found, use the last non-user message
-        if final_response is None and agent_messages:
-            final_response = agent_messages[-1]["content"]
+        if memo is not None:
+            memo.save(conversation.id)
+        schedule_memory_update(conversation)
 
-        return JsonResponse({
+        result = {
             'status': 'success',
             'response': {
-                'content': final_response,
+                'content': final_response(messages),
                 'agent_messages': agent_messages,
+                'memory': memory_stats,
+                'speaker_selection': speaker_selection,
                 'referenced_documents': [{
                     'id': doc.id,
                     'filename': doc.filename,
                     'description': doc.description
                 } for doc in referenced_docs]
             }
-        })
+        }
+        if settings.DEBUG:
+            result['debug'] = {
+                'db': db.as_dict(),
+                'tool_memo': memo.as_stats() if memo else None,
+                'llm': summarize_calls(trace.calls) if trace else None,
+            }
+        return JsonResponse(result)
 
     except Exception as e:
         import traceback
@@ -284,29 +448,54 @@ def send_message(request):
             'status': 'error',
             'message': str(e)
         }, status=500)
+    finally:
+        db.stop()
+
+def _history_version(request, conversation_id):
+    # condition() asks for the ETag and Last-Modified separately; look the version up once
+    if not hasattr(request, '_history_version'):
+        request._history_version = get_history_version(conversation_id, request.user)
+    return request._history_version
+
+
+def _history_etag(request, conversation_id):
+    version = _history_version(request, conversation_id)
+    return history_etag(conversation_id, version, request.GET.urlencode()) if version else None
+
+
+def _history_last_modified(request, conversation_id):
+    version = _history_version(request, conversation_id)
+    return version['last_modified'] if version else None
+
 
 @login_required
+@require_http_methods(["GET"])
+@condition(etag_func=_history_etag, last_modified_func=_history_last_modified)
 def get_conversation(request, conversation_id):
-    try:
-        conversation = Conversation.objects.get(
-            id=conversation_id,
-            created_by=request.user
-        )
-        messages = Message.objects.filter(conversation=conversation).order_by('created_at')
-        
-        return JsonResponse({
-            'status': 'success',
-            'messages': [{
-                'content': msg.content,
-                'message_type': msg.message_type,
-                'created_at': msg.created_at.isoformat()
-            } for msg in messages]
-        })
-    except Conversation.DoesNotExist:
+    """A page of the conversation's messages; see ``history.get_message_page`` for the cursors"""
+    if _history_version(request, conversation_id) is None:
         return JsonResponse({
             'status': 'error',
             'message': 'Conversation not found'
         }, status=404)
+    try:
+        limit = int(request.GET['limit']) if 'limit' in request.GET else None
+        page = get_message_page(
+            conversation_id,
+            limit=limit,
+            before=request.GET.get('before'),
+            after=request.GET.get('after')
+        )
+    except ValueError as e:
+        return JsonResponse({
+            'status': 'error',
+            'message': str(e)
+        }, status=400)
+
+    response = JsonResponse({'status': 'success', **page})
+    # Revalidate on every use so new messages show up, but let unchanged pages come back as 304
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
 @login_required
 @require_http_methods(["POST"])
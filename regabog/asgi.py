@@ -3,6 +3,12 @@ ASGI config for regabog project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server (e.g. ``uvicorn regabog.asgi:application``) so the
+streaming chat endpoint delivers events as they happen and notices client
+disconnects. Under WSGI (runserver, wsgi.py) Django reads the whole event
+stream in a loop of its own before sending any of it, so the browser gets
+every event at once when the chat finishes and a disconnect does not stop it.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
@@ -25,6 +25,10 @@ OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 if not OPENAI_API_KEY:
     raise ValueError("OpenAI API key not found in environment variables")
 
+# Alternative OpenAI-compatible endpoint, e.g. http://127.0.0.1:8765/v1 for the local
+# stand-in started with `manage.py openai_stub`; unset means api.openai.com
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/5.0/howto/deployment/checklist/
 
@@ -140,6 +144,193 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# OpenAI response cache used by lawyer.services.get_openai_client: an in-process LRU in
+# front of a persistent SQLite file. Embeddings are cached per input string.
+LLM_CACHE = {
+    'ENABLED': os.getenv('LLM_CACHE_ENABLED', 'True') == 'True',
+    'PATH': BASE_DIR / '.cache' / 'llm_responses.sqlite3',
+    'TTL_SECONDS': 30 * 24 * 60 * 60,
+    'MEMORY_ENTRIES': 2048,
+    'MEMORY_BYTES': 64 * 1024 * 1024,
+    'MAX_ENTRIES': 200000,
+    'MAX_BYTES': 1024 * 1024 * 1024,
+}
+
+# Vector search
+# BACKEND is 'exact' (brute-force matrix scan) or 'ivf' (inverted-file ANN, trained with
+# `manage.py build_vector_index`). NPROBE trades recall for latency, RERANK is the number
+# of IVF candidates re-scored exactly.
+VECTOR_SEARCH = {
+    'BACKEND': os.getenv('VECTOR_SEARCH_BACKEND', 'exact'),
+    'NLIST': None,
+    'NPROBE': int(os.getenv('VECTOR_SEARCH_NPROBE', 8)),
+    'RERANK': 100,
+    'INDEX_PATH': BASE_DIR / 'vector_index' / 'ivf_centroids.npy',
+    # Loaded indexes look for new centroids, or for embeddings other processes (e.g. run_jobs workers)
+    # wrote to the shared store or the database, at most this often
+    'REFRESH_SECONDS': 1,
+    # BACKEND 'mmap' keeps vectors in append-only files shared by every worker process;
+    # run `manage.py compact_embedding_store` to drop deleted vectors
+    'STORE_PATH': BASE_DIR / 'vector_index' / 'documents',
+    # Search document chunks and aggregate their scores per document ('max' or 'mean');
+    # falls back to description embeddings while no chunks are indexed
+    'CHUNK_SEARCH': True,
+    'CHUNK_AGGREGATE': 'max',
+    'CHUNK_CANDIDATES': 200,
+    # Chunk index backend, defaulting to BACKEND; train IVF chunk centroids with
+    # `manage.py build_vector_index --chunks`
+    'CHUNK_BACKEND': None,
+    'CHUNK_INDEX_PATH': BASE_DIR / 'vector_index' / 'ivf_chunk_centroids.npy',
+    'CHUNK_STORE_PATH': BASE_DIR / 'vector_index' / 'chunks',
+    # find_similar_cases: 'centroid' (precomputed per-case centroid) or 'mean' (exact mean of
+    # per-document similarities)
+    'CASE_SIMILARITY': 'centroid',
+}
+
+# Keyword search. 'sqlite_fts5' ranks with BM25 over an FTS5 table kept in sync by signals
+# (rebuild with `manage.py rebuild_full_text_index`); 'icontains' scans with LIKE and works
+# on any database. FTS5 falls back to icontains when SQLite was built without it.
+FULL_TEXT_SEARCH = {
+    'BACKEND': os.getenv('FULL_TEXT_SEARCH_BACKEND', 'sqlite_fts5'),
+    'SNIPPET_TOKENS': 24,
+}
+
+# Agents are built once and reused across chat requests. MAX_IDLE caps how many
+# idle agent sets each process keeps; a busier process builds extra ones on demand.
+AGENT_POOL = {
+    'MAX_IDLE': 4,
+}
+
+# Group chat speaker selection. 'rules' follows the transition graph, tool calls and
+# "NEXT: <agent>" tags, asking the LLM (FALLBACK) only when they leave a choice open;
+# 'auto' asks the LLM whenever several agents may speak. An agent message with one of
+# TERMINATION_TAGS on a line of its own ends the chat.
+SPEAKER_SELECTION = {
+    'MODE': 'rules',
+    'FALLBACK': 'auto',
+    'TERMINATION_TAGS': ['TERMINATE', 'APPROVED'],
+}
+
+# Tool calls made in one agent turn run concurrently on a shared pool of MAX_WORKERS
+# threads; a call still running TIMEOUT_SECONDS after a thread picked it up, or still
+# waiting for a thread after TIMEOUT_SECONDS, is answered with an error.
+TOOL_EXECUTION = {
+    'PARALLEL': True,
+    'MAX_WORKERS': 4,
+    'TIMEOUT_SECONDS': 30,
+}
+
+# Read-only agent tool results are memoized per conversation in Conversation.context and
+# reused for TTL_SECONDS, across turns too; create_case, and any change to the user's
+# documents or cases between turns, clears them. At most MAX_ENTRIES results of up to
+# MAX_RESULT_CHARS characters (as JSON) are kept.
+TOOL_MEMO = {
+    'ENABLED': True,
+    'MAX_ENTRIES': 50,
+    'TTL_SECONDS': 900,
+    'MAX_RESULT_CHARS': 20000,
+}
+
+# Every LLM call made while serving a chat (agents, speaker selection, tools' embeddings,
+# memory retrieval) is recorded with agent, model, tokens, wall time and retries in the
+# metadata of the message it produced. Summarize with `manage.py llm_trace_summary`.
+LLM_TRACING = {
+    'ENABLED': True,
+}
+
+# Chat streaming (chat/stream/). TOKEN_DELTAS streams completions so token deltas reach the
+# browser; KEEPALIVE_SECONDS is how often an idle stream sends a comment frame.
+CHAT_STREAM = {
+    'TOKEN_DELTAS': True,
+    'KEEPALIVE_SECONDS': 15,
+}
+
+# Rolling chat memory kept in Conversation.context. Each agent run starts from at most
+# TOKEN_BUDGET tokens: the RECENT_MESSAGES newest messages verbatim, a running summary of older
+# ones (SUMMARY_TOKENS max) and up to RETRIEVED_MESSAGES older messages similar to the new one.
+# The summary is refreshed once FOLD_BATCH messages have left the recent window, after the
+# response: MODE 'inline' folds in a background thread of the web process, MODE 'queue' in
+# `manage.py run_jobs` workers.
+CONVERSATION_MEMORY = {
+    'ENABLED': True,
+    'TOKEN_BUDGET': 3000,
+    'RECENT_MESSAGES': 6,
+    'SUMMARY_TOKENS': 500,
+    'RETRIEVED_MESSAGES': 4,
+    'MIN_SIMILARITY': 0.3,
+    'FOLD_BATCH': 4,
+    'MODE': os.getenv('CONVERSATION_MEMORY_MODE', 'inline'),
+}
+
+# Conversation history is paged by (created_at, id) cursors. PAGE_SIZE messages load with the
+# chat page and per request; the sidebar lists the CONVERSATION_LIST_SIZE most recent chats.
+CHAT_HISTORY = {
+    'PAGE_SIZE': 50,
+    'MAX_PAGE_SIZE': 200,
+    'CONVERSATION_LIST_SIZE': 50,
+}
+
+# Hybrid search fuses vector and keyword rankings. METHOD 'rrf' sums weight / (RRF_K + rank);
+# 'weighted' sums min-max normalized scores. CANDIDATES is how deep each retriever ranks.
+HYBRID_SEARCH = {
+    'METHOD': 'rrf',
+    'RRF_K': 60,
+    'WEIGHTS': {'vector': 1.0, 'lexical': 1.0},
+    'CANDIDATES': 50,
+}
+
+# Embeddings are stored as packed bytes. 'float32' is exact and decodes without copying;
+# 'float16' halves the size and 'int8' quarters it, at a small cost in accuracy.
+# Rows record their own format, so changing DTYPE only affects newly written vectors.
+EMBEDDING_STORAGE = {
+    'DTYPE': os.getenv('EMBEDDING_STORAGE_DTYPE', 'float32'),
+}
+
+# Overlapping token windows of document contents, embedded for chunk-level search
+DOCUMENT_CHUNKS = {
+    'ENABLED': True,
+    'MAX_TOKENS': 400,
+    'OVERLAP_TOKENS': 60,
+    'EMBEDDING_BATCH_SIZE': 64,
+}
+
+# Document ingestion: text extraction runs in a process pool, OpenAI calls in a bounded
+# thread pool with retry/backoff, and descriptions are embedded in batches.
+# MODE 'inline' runs the whole pipeline inside the upload request. 'queue' stores uploads and
+# leaves enrichment to `manage.py run_jobs` workers; without a running worker, uploads stay pending.
+INGESTION = {
+    'MODE': os.getenv('INGESTION_MODE', 'inline'),
+    'EXTRACT_WORKERS': int(os.getenv('INGESTION_EXTRACT_WORKERS', os.cpu_count() or 1)),
+    'API_CONCURRENCY': int(os.getenv('INGESTION_API_CONCURRENCY', 4)),
+    'EMBEDDING_BATCH_SIZE': 64,
+    'MAX_RETRIES': 4,
+}
+
+# Background job queue (lawyer.Job rows, processed by `manage.py run_jobs`)
+JOB_QUEUE = {
+    'LEASE_SECONDS': 300,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BASE_SECONDS': 10,
+    'RETRY_MAX_SECONDS': 3600,
+    'POLL_INTERVAL': 2.0,
+}
+
+# PDF text extraction budget. Files with at least PARALLEL_MIN_PAGES pages are split into
+# PAGES_PER_TASK page ranges and extracted in a process pool. Worker-side extraction keeps up to
+# SPOOL_BYTES of text in memory, spills the rest to a temporary file and stores it in one UPDATE.
+PDF_EXTRACTION = {
+    'MAX_PAGES': int(os.getenv('PDF_MAX_PAGES', 10000)),
+    'MAX_BYTES': int(os.getenv('PDF_MAX_BYTES', 50 * 1024 * 1024)),
+    'PARALLEL_MIN_PAGES': 200,
+    'PAGES_PER_TASK': 50,
+    'WORKERS': int(os.getenv('PDF_EXTRACTION_WORKERS', os.cpu_count() or 1)),
+    'SPOOL_BYTES': 1024 * 1024,
+}
+
+# Store uploaded files once per SHA-256 under media/documents/blobs/, so identical uploads
+# share a single file on disk
+DOCUMENT_BLOB_STORE = os.getenv('DOCUMENT_BLOB_STORE', 'False') == 'True'
+
 # File Upload Settings
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB